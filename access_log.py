@@ -0,0 +1,97 @@
+"""Log de acesso estruturado (uma linha JSON por requisição) com a divisão do tempo gasto.
+
+Cada requisição recebe um `request_id` (o X-Request-ID do cliente, se
+válido, ou um novo), devolvido no cabeçalho da resposta e incluído em todos
+os registros de log emitidos durante ela. Ao final, grava em ACCESS_LOG_FILE:
+
+    {"ts": ..., "request_id": ..., "method": "GET", "path": "/files/", "status": 200,
+     "bytes": 5120, "duration_ms": 12.4, "db_wait_ms": 0.3, "sql_ms": 8.1,
+     "sql_count": 2, "serialize_ms": 1.2, "remote_addr": ...}
+"""
+import json
+import logging
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+from config import Config
+
+access_logger = logging.getLogger('api_jatoba.access')
+
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Componentes acumulados em g.timings: nome -> segundos
+TIMINGS = ('db_wait', 'sql', 'serialize')
+
+
+def add_timing(name, seconds, count=1):
+    """Soma `seconds` ao componente `name` da requisição atual (sem efeito fora dela)."""
+    if not has_request_context():
+        return
+    timings = g.get('timings')
+    if timings is None:
+        return
+    timings[name] = timings.get(name, 0.0) + seconds
+    counts = g.timing_counts
+    counts[name] = counts.get(name, 0) + count
+
+def current_request_id():
+    if has_request_context():
+        return g.get('request_id')
+    return None
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.timings = {}
+    g.timing_counts = {}
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if _REQUEST_ID.match(request_id) else uuid.uuid4().hex
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+def _finish_request(response):
+    response.headers['X-Request-ID'] = g.request_id
+    entry = {
+        'ts': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'request_id': g.request_id,
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('latin-1') or None,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'bytes': response.content_length,
+        'remote_addr': request.remote_addr,
+        'user_agent': request.user_agent.string or None,
+    }
+    timings, counts, started = g.timings, g.timing_counts, g.request_started
+
+    def write():
+        # Depois do envio do corpo: inclui o tempo de respostas em streaming
+        entry['duration_ms'] = _ms(time.perf_counter() - started)
+        for name in TIMINGS:
+            entry[f'{name}_ms'] = _ms(timings.get(name, 0.0))
+        entry['sql_count'] = counts.get('sql', 0)
+        access_logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    response.call_on_close(write)
+    return response
+
+def _set_request_id_header(response):
+    response.headers['X-Request-ID'] = g.request_id
+    return response
+
+def init_app(app):
+    """Ativa o request_id e o log de acesso (ACCESS_LOG_ENABLED).
+
+    O tempo de serialização (`serialize`) é medido pelo provider de json_provider.py.
+    """
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    if Config.ACCESS_LOG_ENABLED:
+        app.after_request(_finish_request)
+    else:
+        app.after_request(_set_request_id_header)
@@ -1,7 +1,18 @@
+import logging
 import os
 from flask import Flask, jsonify, request
 from config import Config
 from logger import app_logger # Importa o logger
+import database
+import access_log
+import json_provider
+import metrics
+import storage_layout
+import storage_gc
+import stats_summary
+import download_analytics
+from werkzeug.utils import secure_filename
+import suggest_index
 
 # Certifica-se de que a pasta de uploads existe
 if not os.path.exists(Config.UPLOAD_FOLDER):
@@ -14,6 +25,30 @@ app.config.from_object(Config)
 app.logger.handlers = app_logger.handlers
 app.logger.setLevel(app_logger.level)
 
+# request_id, medição de tempos e log de acesso em JSON (ACCESS_LOG_FILE)
+access_log.init_app(app)
+
+# JSON das respostas: orjson quando instalado, com o tempo medido no log de acesso
+json_provider.init_app(app)
+
+# Contadores e histogramas de latência, expostos em GET /metrics
+metrics.init_app(app)
+
+# Devolve ao pool a conexão de cada requisição ao final do contexto
+database.init_app(app)
+
+# Carrega em segundo plano o índice de sugestões (/search/suggest)
+suggest_index.init_app(app)
+
+# Varredura periódica de arquivos órfãos (GC_ENABLED)
+storage_gc.init_app(app)
+
+# Recálculo periódico dos contadores de /admin/stats
+stats_summary.init_app(app)
+
+# Agregação dos eventos de download por hora e por dia
+download_analytics.init_app(app)
+
 # Importar e registrar os Blueprints
 from routes.manufacturers import manufacturers_bp
 from routes.equipments import equipments_bp
@@ -27,14 +62,16 @@ app.register_blueprint(files_bp, url_prefix='/files')
 app.register_blueprint(search_bp, url_prefix='/search')
 app.register_blueprint(admin_bp, url_prefix='/admin')
 
-# Exemplo de logging para requisições
+# Log de cada requisição (amostrado conforme LOG_SAMPLE_RATE / LOG_RATE_LIMIT)
+request_logger = logging.getLogger('api_jatoba.requests')
+
 @app.before_request
 def log_request_info():
-    app.logger.info(f"Requisição recebida: {request.method} {request.url} de {request.remote_addr}")
+    request_logger.info("Requisição recebida: %s %s de %s", request.method, request.url, request.remote_addr)
 
 @app.after_request
 def log_response_info(response):
-    app.logger.info(f"Requisição finalizada: {request.method} {request.url} com status {response.status_code}")
+    request_logger.info("Requisição finalizada: %s %s com status %s", request.method, request.url, response.status_code)
     return response
 
 # Endpoint genérico de upload (fora dos blueprints específicos de entidade)
@@ -51,10 +88,13 @@ def generic_upload():
         return jsonify({"message": "Nenhum arquivo selecionado"}), 400
     
     if file:
-        filename = file.filename
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        filename = secure_filename(file.filename)
+        if not filename:
+            app_logger.warning(f"Upload genérico: Nome de arquivo inválido: '{file.filename}'.")
+            return jsonify({"message": "Nome de arquivo inválido"}), 400
+        file_path = storage_layout.storage_path('generic', filename)
         try:
-            file.save(file_path)
+            storage_layout.save_upload(file, file_path)
             app_logger.info(f"Upload genérico de '{filename}' bem-sucedido. Salvo em: {file_path}")
             return jsonify({"message": "Upload genérico bem-sucedido", "file_url": file_path}), 201
         except Exception as e:
@@ -67,8 +107,15 @@ def generic_upload():
 @app.route('/upload/<filename>', methods=['DELETE'])
 def delete_uploaded_file(filename):
     app_logger.info(f"Requisição de exclusão de arquivo genérico iniciada para: {filename}")
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    if os.path.exists(file_path):
+    filename = secure_filename(filename)
+    # Arquivos enviados antes do layout atual podem estar na raiz de UPLOAD_FOLDER
+    candidates = [storage_layout.storage_path('generic', filename), storage_layout.legacy_path(filename)]
+    file_path = next((path for path in candidates if filename and os.path.isfile(path)), None)
+    if file_path and storage_gc.is_tracked(file_path):
+        # Logos, imagens e arquivos registrados só saem pela exclusão do próprio registro
+        app_logger.warning(f"Tentativa de excluir pelo upload genérico um arquivo registrado no banco: {file_path}.")
+        return jsonify({"message": "Arquivo em uso por um registro; exclua o registro correspondente."}), 409
+    if file_path:
         try:
             os.remove(file_path)
             app_logger.info(f"Arquivo genérico '{filename}' deletado com sucesso do sistema de arquivos.")
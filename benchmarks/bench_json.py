@@ -0,0 +1,105 @@
+"""Compara a serialização das respostas: jsonify padrão do Flask x json_provider.
+
+Gera linhas no formato do DictCursor (como GET /files/ e o bulk import) e
+mede, para cada tamanho, o tempo médio de montar a resposta:
+
+    flask          DefaultJSONProvider (o jsonify de antes)
+    json           JSONProvider sem orjson (fallback da biblioteca padrão)
+    orjson/http    JSONProvider com orjson, datas no formato do Flask
+    orjson/iso     JSONProvider com orjson, datas ISO 8601 nativas
+    stream         JSONProvider.stream (corpo em partes), consumido por inteiro
+
+Uso (na raiz do projeto):
+
+    python benchmarks/bench_json.py [--rows 50,500,5000] [--repeat 20]
+
+As linhas com orjson só aparecem se o pacote estiver instalado.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import json_provider
+
+
+def make_rows(count):
+    base = datetime(2026, 1, 1, 12, 0, 0)
+    return [{
+        'id': i,
+        'name': f"Firmware {i} – versão estável",
+        'type': 'firmware' if i % 3 else 'document',
+        'equipment_id': i % 97,
+        'file_url': f"/srv/uploads/blobs/ab/cd/{i:064x}",
+        'file_size': 1024 * i,
+        'sha256': f"{i:064x}",
+        'download_count': i * 7,
+        'uploaded_by': None if i % 5 else 101,
+        'score': Decimal('1.5'),
+        'created_at': base + timedelta(minutes=i),
+        'updated_at': base + timedelta(minutes=i, seconds=30),
+    } for i in range(count)]
+
+
+def measure(app, provider, body, repeat, stream=False):
+    app.json = provider
+    with app.test_request_context():
+        best = float('inf')
+        size = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if stream:
+                response = provider.stream({'limit': len(body['items'])}, body['items'])
+                data = b''.join(response.response)
+            else:
+                data = provider.response(body).get_data()
+            best = min(best, time.perf_counter() - start)
+            size = len(data)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', default='50,500,5000', help="Tamanhos das listas, separados por vírgula")
+    parser.add_argument('--repeat', type=int, default=20, help="Repetições por medida (vale a melhor)")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    has_orjson = json_provider.orjson is not None
+    cases = [('flask', lambda: DefaultJSONProvider(app), False)]
+    if has_orjson:
+        cases += [('orjson/http', lambda: json_provider.JSONProvider(app, 'http'), False),
+                  ('orjson/iso', lambda: json_provider.JSONProvider(app, 'iso'), False),
+                  ('stream', lambda: json_provider.JSONProvider(app, 'http'), True)]
+
+    def fallback():
+        # Mesmo provider, com o orjson desativado
+        saved, json_provider.orjson = json_provider.orjson, None
+        return saved
+
+    print(f"orjson: {'instalado' if has_orjson else 'não instalado'}")
+    print(f"{'linhas':>7}  {'caminho':<12} {'ms':>9} {'x flask':>8} {'bytes':>10}")
+    for count in (int(value) for value in args.rows.split(',')):
+        body = {'items': make_rows(count), 'next_cursor': None, 'limit': count}
+        baseline, _ = measure(app, DefaultJSONProvider(app), body, args.repeat)
+        results = []
+        for name, factory, stream in cases:
+            results.append((name,) + measure(app, factory(), body, args.repeat, stream))
+        saved = fallback()
+        try:
+            results.insert(1, ('json',) + measure(app, json_provider.JSONProvider(app), body, args.repeat))
+        finally:
+            json_provider.orjson = saved
+        for name, seconds, size in results:
+            print(f"{count:>7}  {name:<12} {seconds * 1000:>9.3f} {baseline / seconds:>7.1f}x {size:>10}")
+
+
+if __name__ == '__main__':
+    main()
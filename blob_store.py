@@ -0,0 +1,158 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import secrets
+
+from config import Config
+import storage_layout
+import metrics
+
+logger = logging.getLogger('api_jatoba.blobs')
+
+_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobError(Exception):
+    """Erro ao gravar ou referenciar um blob; `status` é o código HTTP sugerido."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def is_valid_digest(value):
+    return bool(value) and _SHA256.match(value) is not None
+
+def blob_path(sha256):
+    """Caminho do blob, distribuído em dois níveis pelo início do hash (ab/cd/abcd...)."""
+    return storage_layout.content_path(sha256)
+
+def repr_digest(sha256):
+    """Valor do cabeçalho Repr-Digest (RFC 9530) para o hash em hexadecimal."""
+    return f"sha-256=:{base64.b64encode(bytes.fromhex(sha256)).decode('ascii')}:"
+
+def new_temp_path():
+    """Caminho temporário no mesmo sistema de arquivos dos blobs (a publicação é só um rename)."""
+    tmp_dir = os.path.join(Config.BLOB_FOLDER, '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, secrets.token_hex(16))
+
+def write_temp(stream):
+    """Copia `stream` para um arquivo temporário calculando o SHA-256 na mesma passagem.
+
+    Retorna (caminho_temporário, sha256, tamanho).
+    """
+    tmp_path = new_temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'xb') as tmp_file:
+            while True:
+                block = stream.read(Config.UPLOAD_BUFFER_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                tmp_file.write(block)
+                size += len(block)
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    metrics.UPLOAD_BYTES.inc(size, kind='files')
+    return tmp_path, digest.hexdigest(), size
+
+def hash_file(path):
+    """SHA-256 e tamanho de um arquivo já gravado (uploads em partes, migração)."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        while True:
+            block = source.read(Config.UPLOAD_BUFFER_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+def discard_temp(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+def add_reference(cursor, sha256, size, tmp_path=None):
+    """Registra uma referência ao blob na transação do chamador e garante o conteúdo no disco.
+
+    O INSERT ... ON DUPLICATE KEY UPDATE trava a linha do blob até o commit,
+    serializando uploads e exclusões do mesmo conteúdo. Com `tmp_path`, o
+    temporário vira o blob (rename) ou é descartado se o blob já existir;
+    sem ele, o blob precisa existir (referência a conteúdo já enviado).
+    Retorna (caminho_do_blob, criado): `criado` indica que o arquivo foi
+    colocado agora e deve ser removido se a transação for desfeita.
+    """
+    path = blob_path(sha256)
+    if tmp_path is None:
+        cursor.execute("UPDATE blobs SET ref_count = ref_count + 1 WHERE sha256 = %s", (sha256,))
+        if cursor.rowcount == 0 or not os.path.isfile(path):
+            raise BlobError("Conteúdo não encontrado no servidor", 404)
+        return path, False
+
+    cursor.execute(
+        "INSERT INTO blobs (sha256, size, ref_count) VALUES (%s, %s, 1) "
+        "ON DUPLICATE KEY UPDATE ref_count = ref_count + 1",
+        (sha256, size)
+    )
+    if os.path.isfile(path):
+        discard_temp(tmp_path)
+        logger.info(f"Blob {sha256} já existente; upload deduplicado.")
+        return path, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Blob {sha256} gravado ({size} bytes).")
+    return path, True
+
+def release_reference(cursor, sha256):
+    """Remove uma referência ao blob na transação do chamador.
+
+    Na última referência, a linha é apagada e o arquivo é renomeado para
+    fora do caminho do blob ainda com a linha travada; depois do commit o
+    chamador chama `purge_released` e, se a transação for desfeita,
+    `restore_released`. Retorna o caminho renomeado ou None.
+    """
+    cursor.execute("SELECT ref_count FROM blobs WHERE sha256 = %s FOR UPDATE", (sha256,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if row['ref_count'] > 1:
+        cursor.execute("UPDATE blobs SET ref_count = ref_count - 1 WHERE sha256 = %s", (sha256,))
+        return None
+    cursor.execute("DELETE FROM blobs WHERE sha256 = %s", (sha256,))
+    path = blob_path(sha256)
+    released = f"{path}.{os.getpid()}.released"
+    try:
+        os.replace(path, released)
+    except FileNotFoundError:
+        return None
+    return released
+
+def purge_released(released):
+    if not released:
+        return
+    try:
+        discard_temp(released)
+        logger.info(f"Blob sem referências removido: {os.path.basename(released).split('.')[0]}.")
+    except OSError as e:
+        logger.error(f"Não foi possível remover o blob liberado {released}: {e}", exc_info=True)
+
+def restore_released(released):
+    if released:
+        os.replace(released, released.rsplit('.', 2)[0])
+
+def describe(cursor, sha256):
+    """Metadados do blob (para o cliente verificar se precisa enviar o conteúdo) ou None."""
+    cursor.execute("SELECT sha256, size, ref_count, created_at FROM blobs WHERE sha256 = %s", (sha256,))
+    row = cursor.fetchone()
+    if row is None or not os.path.isfile(blob_path(sha256)):
+        return None
+    return row
@@ -0,0 +1,432 @@
+"""Importação em lote (POST /manufacturers/bulk, /equipments/bulk, /files/bulk).
+
+O corpo é um array JSON (ou {"items": [...]}) ou NDJSON (uma linha por
+registro, Content-Type application/x-ndjson). Todas as linhas são validadas
+antes de qualquer escrita, com consultas em lote para as referências
+(fabricante, equipamento, blob). As válidas são gravadas em blocos de
+BULK_BATCH_SIZE, cada bloco numa transação:
+
+- com chave única (fabricantes.name, equipamentos (name, model,
+  manufacturer_id)), um `executemany` de `INSERT ... ON DUPLICATE KEY
+  UPDATE`, que o PyMySQL envia como um único INSERT de várias linhas;
+- sem chave única (arquivos, equipamentos sem fabricante), um INSERT por
+  linha dentro da transação do bloco, para devolver o id de cada uma.
+
+A resposta traz o resultado de cada linha, na ordem recebida.
+"""
+import logging
+
+from flask import current_app, request
+
+from config import Config
+from database import get_db_connection, close_db_connection
+from cache import response_cache
+import blob_store
+import image_variants
+import stats_summary
+import suggest_index
+
+logger = logging.getLogger('api_jatoba.bulk')
+
+
+class BulkImportError(ValueError):
+    """Corpo da importação inválido como um todo; `status` é o código HTTP."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_items():
+    """Lê os registros do corpo. Retorna [(registro ou None, erro ou None)] na ordem recebida."""
+    content_type = (request.mimetype or '').lower()
+    items = []
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json-seq'):
+        for number, line in enumerate(request.stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if len(items) >= Config.BULK_MAX_ROWS:
+                raise BulkImportError(f"Máximo de {Config.BULK_MAX_ROWS} registros por importação.", 413)
+            try:
+                items.append((current_app.json.loads(line), None))
+            except ValueError:
+                items.append((None, f"JSON inválido na linha {number}"))
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('items')
+        if not isinstance(data, list):
+            raise BulkImportError("Envie um array JSON (ou {\"items\": [...]}) ou NDJSON (application/x-ndjson).")
+        if len(data) > Config.BULK_MAX_ROWS:
+            raise BulkImportError(f"Máximo de {Config.BULK_MAX_ROWS} registros por importação.", 413)
+        items = [(item, None) for item in data]
+    if not items:
+        raise BulkImportError("Nenhum registro enviado.")
+    return [(item, error) if error or isinstance(item, dict) else (None, "Registro deve ser um objeto JSON")
+            for item, error in items]
+
+
+def _text(record, field, errors, required=False, max_length=255):
+    value = record.get(field)
+    if value is None or value == '':
+        if required:
+            errors.append(f"'{field}' é obrigatório")
+        return None
+    if not isinstance(value, str):
+        errors.append(f"'{field}' deve ser texto")
+    elif len(value) > max_length:
+        errors.append(f"'{field}' excede {max_length} caracteres")
+    return value
+
+def _integer(record, field, errors):
+    value = record.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        errors.append(f"'{field}' deve ser um inteiro positivo")
+    return value
+
+def _existing_ids(cursor, table, ids):
+    ids = sorted({value for value in ids if isinstance(value, int)})
+    if not ids:
+        return set()
+    cursor.execute(f"SELECT id FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+    return {row['id'] for row in cursor.fetchall()}
+
+
+class BulkSpec:
+    """Como validar e gravar os registros de uma tabela."""
+
+    table = None
+    columns = ()
+    key = ()  # Colunas da chave única (vazio: só inserção)
+    update_columns = ()  # Atualizadas no upsert, se vierem preenchidas
+    image_kind = None  # Tipo em image_variants.TARGETS, se a tabela tiver imagem com variantes
+    cache_namespace = None
+    stats_key = None
+
+    def validate(self, record, errors):
+        """Retorna a tupla de valores de `columns`, acrescentando problemas em `errors`."""
+        raise NotImplementedError
+
+    def check_references(self, cursor, rows):
+        """Validações que dependem do banco, feitas em lote. `rows`: [(resultado, valores)]."""
+
+    def has_key(self, values):
+        return bool(self.key) and all(values[self.columns.index(column)] is not None for column in self.key)
+
+    def before_insert(self, cursor, rows):
+        """Escritas auxiliares antes das inserções sem chave, na transação do bloco."""
+
+    def after_write(self, cursor, written):
+        """Efeitos colaterais depois do commit de um bloco: [(resultado, valores)]."""
+
+    def stats_deltas(self, created):
+        return {self.stats_key: len(created)}
+
+
+class ManufacturerSpec(BulkSpec):
+    table = 'fabricantes'
+    columns = ('name', 'logo_url')
+    key = ('name',)
+    update_columns = ('logo_url',)
+    image_kind = 'logo'
+    cache_namespace = 'manufacturers'
+    stats_key = 'fabricantes'
+
+    def validate(self, record, errors):
+        return (_text(record, 'name', errors, required=True), _text(record, 'logo_url', errors, max_length=512))
+
+    def after_write(self, cursor, written):
+        for result, values in written:
+            suggest_index.index_manufacturer(result['id'], values[0])
+
+
+class EquipmentSpec(BulkSpec):
+    table = 'equipamentos'
+    columns = ('name', 'model', 'manufacturer_id', 'image_url')
+    key = ('name', 'model', 'manufacturer_id')
+    update_columns = ('image_url',)
+    image_kind = 'image'
+    cache_namespace = 'equipments'
+    stats_key = 'equipamentos'
+
+    def validate(self, record, errors):
+        return (_text(record, 'name', errors, required=True), _text(record, 'model', errors, required=True),
+                _integer(record, 'manufacturer_id', errors), _text(record, 'image_url', errors, max_length=512))
+
+    def check_references(self, cursor, rows):
+        existing = _existing_ids(cursor, 'fabricantes', [values[2] for _, values in rows])
+        for result, values in rows:
+            if values[2] is not None and values[2] not in existing:
+                result['errors'].append(f"Fabricante {values[2]} não encontrado")
+
+    def after_write(self, cursor, written):
+        for result, values in written:
+            suggest_index.index_equipment(result['id'], values[0], values[1], values[2])
+
+
+class FileSpec(BulkSpec):
+    """Metadados de arquivos já disponíveis: `sha256` de um blob existente ou `file_url` externa (http/https)."""
+
+    table = 'arquivos'
+    columns = ('name', 'type', 'equipment_id', 'file_url', 'file_size', 'sha256', 'uploaded_by')
+    cache_namespace = 'files'
+    stats_key = 'arquivos'
+
+    def validate(self, record, errors):
+        name = _text(record, 'name', errors, required=True)
+        file_type = record.get('type')
+        if file_type not in ('firmware', 'document'):
+            errors.append("'type' deve ser 'firmware' ou 'document'")
+        sha256 = record.get('sha256')
+        file_url = _text(record, 'file_url', errors, max_length=512)
+        if sha256 is not None:
+            sha256 = sha256.lower() if isinstance(sha256, str) else sha256
+            if not blob_store.is_valid_digest(sha256):
+                errors.append("'sha256' deve ter 64 caracteres hexadecimais")
+            file_url = None  # Definida pelo blob
+        elif not (isinstance(file_url, str) and file_url.startswith(('http://', 'https://'))):
+            # Caminhos locais só entram pelo upload: a API serviria qualquer arquivo do servidor
+            errors.append("Informe 'sha256' de um conteúdo já enviado ou uma 'file_url' http(s)")
+        return (name, file_type, _integer(record, 'equipment_id', errors), file_url,
+                _integer(record, 'file_size', errors), sha256, _integer(record, 'uploaded_by', errors))
+
+    def check_references(self, cursor, rows):
+        existing = _existing_ids(cursor, 'equipamentos', [values[2] for _, values in rows])
+        digests = sorted({values[5] for _, values in rows if values[5]})
+        blobs = {}
+        if digests:
+            cursor.execute(f"SELECT sha256, size FROM blobs WHERE sha256 IN ({', '.join(['%s'] * len(digests))})",
+                           digests)
+            blobs = {row['sha256']: row['size'] for row in cursor.fetchall()}
+        for index, (result, values) in enumerate(rows):
+            if values[2] is not None and values[2] not in existing:
+                result['errors'].append(f"Equipamento {values[2]} não encontrado")
+            if values[5]:
+                if values[5] not in blobs:
+                    result['errors'].append(f"Conteúdo {values[5]} não encontrado no servidor")
+                else:
+                    values = list(values)
+                    values[3], values[4] = blob_store.blob_path(values[5]), blobs[values[5]]
+                    rows[index] = (result, tuple(values))
+
+    def before_insert(self, cursor, rows):
+        """Referências aos blobs, somadas em um UPDATE por bloco."""
+        counts = {}
+        for _, values in rows:
+            if values[5]:
+                counts[values[5]] = counts.get(values[5], 0) + 1
+        if counts:
+            digests = sorted(counts)
+            cases = ' '.join(['WHEN %s THEN %s'] * len(digests))
+            cursor.execute(
+                f"UPDATE blobs SET ref_count = ref_count + CASE sha256 {cases} END "
+                f"WHERE sha256 IN ({', '.join(['%s'] * len(digests))})",
+                [value for sha256 in digests for value in (sha256, counts[sha256])] + digests
+            )
+
+    def stats_deltas(self, created):
+        deltas = {'arquivos': len(created)}
+        for _, values in created:
+            key = stats_summary.file_type_key(values[1])
+            deltas[key] = deltas.get(key, 0) + 1
+        return deltas
+
+
+SPECS = {
+    'manufacturers': ManufacturerSpec(),
+    'equipments': EquipmentSpec(),
+    'files': FileSpec(),
+}
+
+
+def _key_condition(spec, rows):
+    """WHERE que localiza as linhas de `rows` pela chave única, e seus parâmetros."""
+    tuple_sql = '(' + ', '.join(['%s'] * len(spec.key)) + ')'
+    params = [values[spec.columns.index(column)] for _, values in rows for column in spec.key]
+    return f"({', '.join(spec.key)}) IN ({', '.join([tuple_sql] * len(rows))})", params
+
+def _row_key(spec, values):
+    # Só para juntar registros idênticos da mesma importação; equivalências da
+    # collation (maiúsculas, acentos, espaços à direita) ficam com o banco
+    return tuple(values[spec.columns.index(column)] for column in spec.key)
+
+def _match(cursor, spec, rows, columns='id'):
+    """Linha da tabela com a mesma chave única de cada registro, pela comparação do banco.
+
+    Um SELECT por registro, unidos por UNION ALL numa só consulta: cada um
+    compara coluna = valor, com a collation da coluna (a mesma do índice
+    único). Retorna {índice do registro: linha}.
+    """
+    condition = ' AND '.join(f"{column} = %s" for column in spec.key)
+    branch = f"SELECT %s AS row_index, {columns} FROM {spec.table} WHERE {condition}"
+    params = [value for result, values in rows
+              for value in (result['index'],) + tuple(values[spec.columns.index(column)] for column in spec.key)]
+    cursor.execute(' UNION ALL '.join([branch] * len(rows)), params)
+    return {row['row_index']: row for row in cursor.fetchall()}
+
+def _update_clause(spec):
+    """Atribuições do ON DUPLICATE KEY UPDATE: colunas preenchidas substituem as atuais.
+
+    Se a imagem muda, as variantes da anterior são descartadas na mesma
+    atribuição (antes da própria URL: o SET é avaliado da esquerda para a direita).
+    """
+    assignments = []
+    for column in spec.update_columns:
+        if spec.image_kind and image_variants.TARGETS[spec.image_kind][1] == column:
+            variants = image_variants.TARGETS[spec.image_kind][2]
+            assignments.append(f"{variants} = IF(VALUES({column}) IS NULL OR {column} <=> VALUES({column}), "
+                               f"{variants}, NULL)")
+        assignments.append(f"{column} = COALESCE(VALUES({column}), {column})")
+    return ', '.join(assignments) or 'id = id'
+
+def _upsert(cursor, spec, rows):
+    """Grava as linhas com chave única: classifica, faz o upsert em lote e lê os ids.
+
+    Retorna (criadas, atualizadas com imagem nova). Registros que o banco
+    considera a mesma chave (ex.: 'Cafe' e 'Café') gravam a mesma linha: vale
+    o último, e os anteriores ficam como `skipped`.
+    """
+    condition, params = _key_condition(spec, rows)
+    image_column = image_variants.TARGETS[spec.image_kind][1] if spec.image_kind else None
+    # Trava as chaves existentes: classificação e escrita na mesma transação
+    cursor.execute(f"SELECT id FROM {spec.table} WHERE {condition} FOR UPDATE", params)
+    before = _match(cursor, spec, rows, f"id, {image_column}" if image_column else 'id')
+
+    columns = ', '.join(spec.columns)
+    cursor.executemany(
+        f"INSERT INTO {spec.table} ({columns}) VALUES ({', '.join(['%s'] * len(spec.columns))}) "
+        f"ON DUPLICATE KEY UPDATE {_update_clause(spec)}",
+        [values for _, values in rows]
+    )
+    new = [(result, values) for result, values in rows if result['index'] not in before]
+    after = _match(cursor, spec, new) if new else {}
+
+    last_by_id = {}
+    for result, _ in rows:
+        row = before.get(result['index']) or after.get(result['index'])
+        result['id'] = row['id'] if row else None
+        if row:
+            last_by_id[row['id']] = result['index']
+    created = []
+    replaced = []
+    for result, values in rows:
+        if result['id'] is None:
+            result['status'] = 'error'
+            result['errors'].append("Registro gravado, mas não localizado pela chave única")
+        elif last_by_id[result['id']] != result['index']:
+            result['status'] = 'skipped'
+            result['superseded_by'] = last_by_id[result['id']]
+        elif result['index'] in before:
+            result['status'] = 'updated'
+            image = values[spec.columns.index(image_column)] if image_column else None
+            if image is not None and image != before[result['index']][image_column]:
+                replaced.append((result, values))
+        else:
+            result['status'] = 'created'
+            created.append((result, values))
+    return created, replaced
+
+def _insert(cursor, spec, rows):
+    """Linhas sem chave única: um INSERT por linha na transação do bloco, para obter os ids."""
+    spec.before_insert(cursor, rows)
+    sql = (f"INSERT INTO {spec.table} ({', '.join(spec.columns)}) "
+           f"VALUES ({', '.join(['%s'] * len(spec.columns))})")
+    for result, values in rows:
+        cursor.execute(sql, values)
+        result['id'] = cursor.lastrowid
+        result['status'] = 'created'
+    return list(rows)
+
+def _write_chunk(conn, spec, rows):
+    cursor = conn.cursor()
+    try:
+        keyed = [row for row in rows if spec.has_key(row[1])]
+        plain = [row for row in rows if not spec.has_key(row[1])]
+        created, replaced = _upsert(cursor, spec, keyed) if keyed else ([], [])
+        created += _insert(cursor, spec, plain) if plain else []
+        stats_summary.adjust(cursor, spec.stats_deltas(created))
+        conn.commit()
+        spec.after_write(cursor, [row for row in rows if row[0]['status'] in ('created', 'updated')])
+        if spec.image_kind:
+            # Variantes das imagens novas (só as guardadas pela API)
+            image_column = spec.columns.index(image_variants.TARGETS[spec.image_kind][1])
+            for result, values in created + replaced:
+                image_variants.requeue(spec.image_kind, result['id'], values[image_column])
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def run(kind):
+    """Executa a importação de `kind` para a requisição atual. Retorna (corpo, status HTTP)."""
+    spec = SPECS[kind]
+    items = parse_items()
+
+    results = []
+    valid = []
+    for index, (record, error) in enumerate(items):
+        result = {'index': index, 'status': None, 'errors': [error] if error else []}
+        results.append(result)
+        if record is not None:
+            values = spec.validate(record, result['errors'])
+            if not result['errors']:
+                valid.append((result, values))
+
+    conn = get_db_connection()
+    if conn is None:
+        return {"message": "Erro de conexão ao banco de dados"}, 500
+    try:
+        if valid:
+            cursor = conn.cursor()
+            try:
+                spec.check_references(cursor, valid)
+                conn.commit()
+            finally:
+                cursor.close()
+        valid = [(result, values) for result, values in valid if not result['errors']]
+
+        # Chave repetida na mesma importação: vale a última ocorrência
+        last_by_key = {}
+        for result, values in valid:
+            if spec.has_key(values):
+                last_by_key[_row_key(spec, values)] = result['index']
+        rows = []
+        for result, values in valid:
+            if spec.has_key(values) and last_by_key[_row_key(spec, values)] != result['index']:
+                result['status'] = 'skipped'
+                result['superseded_by'] = last_by_key[_row_key(spec, values)]
+            else:
+                rows.append((result, values))
+
+        for start in range(0, len(rows), Config.BULK_BATCH_SIZE):
+            chunk = rows[start:start + Config.BULK_BATCH_SIZE]
+            try:
+                _write_chunk(conn, spec, chunk)
+            except Exception as e:
+                logger.error(f"Importação em lote de {kind}: bloco a partir do registro {chunk[0][0]['index']} "
+                             f"falhou: {e}", exc_info=True)
+                for result, _ in chunk:
+                    result['status'] = 'error'
+                    result['id'] = None
+                    result.pop('superseded_by', None)
+                    result['errors'].append(f"Erro ao gravar o bloco: {e}")
+    finally:
+        close_db_connection(conn)
+
+    summary = {'received': len(results), 'created': 0, 'updated': 0, 'skipped': 0, 'error': 0}
+    for result in results:
+        if result['status'] is None:
+            result['status'] = 'error'
+        summary[result['status']] += 1
+        if not result['errors']:
+            del result['errors']
+    if summary['created'] or summary['updated']:
+        # Listagens e, das linhas atualizadas, as respostas de GET /<id> (chave com a versão do item)
+        response_cache.invalidate_items(spec.cache_namespace,
+                                        [result['id'] for result in results if result['status'] == 'updated'])
+    logger.info(f"Importação em lote de {kind}: {summary}")
+    return {'summary': summary, 'results': results}, 200
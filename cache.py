@@ -0,0 +1,305 @@
+import functools
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import Response, current_app, request
+from config import Config
+
+try:
+    import redis
+except ImportError:  # Backend compartilhado opcional
+    redis = None
+
+logger = logging.getLogger('api_jatoba.cache')
+
+
+class LocalLRUBackend:
+    """Cache em processo com LRU, TTL e limite por número de entradas e por bytes.
+
+    As versões de invalidação ficam fora da área sujeita a despejo: perder
+    uma versão faria respostas antigas voltarem a ser válidas.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # chave -> (expira_em, tamanho, valor)
+        self._versions = {}
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop_locked(key)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value, ttl, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop_locked(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop_locked(oldest)
+                self.evictions += 1
+
+    def _drop_locked(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get_versions(self, names):
+        with self._lock:
+            return [self._versions.get(name, 0) for name in names]
+
+    def bump_version(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def bump_versions(self, names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class LocalSharedBackend(LocalLRUBackend):
+    """Substituto local do backend compartilhado, para desenvolvimento e testes.
+
+    Serializa os valores como o Redis faria, de modo que o modo 'shared'
+    se comporte igual com ou sem um servidor disponível.
+    """
+
+    def get(self, key):
+        value = super().get(key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl, size):
+        super().set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl, size)
+
+
+class RedisBackend:
+    """Backend compartilhado entre processos workers e instâncias da API."""
+
+    def __init__(self, url, prefix='jatoba:cache:'):
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        value = self._client.get(self._prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl, size):
+        self._client.set(self._prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=max(1, int(ttl)))
+
+    def get_versions(self, names):
+        keys = [f"{self._prefix}v:{name}" for name in names]
+        values = self._client.mget(keys)
+        versions = []
+        for key, value in zip(keys, values):
+            if value is None:
+                # Versão ausente (nunca criada ou despejada pelo Redis): inicia em um valor
+                # baseado no relógio para não coincidir com versões já usadas em chaves antigas.
+                self._client.set(key, time.time_ns(), nx=True)
+                value = self._client.get(key)
+            versions.append(int(value))
+        return versions
+
+    def bump_version(self, name):
+        key = f"{self._prefix}v:{name}"
+        if not self._client.exists(key):
+            self._client.set(key, time.time_ns(), nx=True)
+        self._client.incr(key)
+
+    def bump_versions(self, names):
+        # Um round trip para todas: SET NX inicia as ausentes como em bump_version
+        pipeline = self._client.pipeline(transaction=False)
+        for name in names:
+            key = f"{self._prefix}v:{name}"
+            pipeline.set(key, time.time_ns(), nx=True)
+            pipeline.incr(key)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self._prefix + 'resp:*'):
+            self._client.delete(key)
+
+    def stats(self):
+        return {'backend': 'redis', 'entries': None, 'bytes': None,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class ResponseCache:
+    """Cache read-through de respostas GET, com invalidação por versão.
+
+    A chave combina o endpoint, os argumentos da rota, a query string
+    normalizada e as versões do namespace (listas) e do item, mais as dos
+    namespaces relacionados embutidos na resposta. Escritas incrementam
+    essas versões, tornando inacessíveis de uma vez todas as variações em
+    cache de um item ou das listagens de um recurso.
+    """
+
+    def __init__(self, backend=None, default_ttl=60):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def normalized_args(args):
+        """Query string em forma canônica: chaves ordenadas, parâmetros vazios removidos."""
+        items = sorted((key, value) for key, value in args.items(multi=True) if value != '')
+        return urlencode(items)
+
+    def _version_names(self, namespace, item_id, related=()):
+        if item_id is None:
+            return [namespace] + list(related)
+        return [f"{namespace}:{item_id}"] + list(related)
+
+    def build_key(self, namespace, item_id=None, related=()):
+        versions = self.backend.get_versions(self._version_names(namespace, item_id, related))
+        view_args = ','.join(f"{k}={v}" for k, v in sorted((request.view_args or {}).items()))
+        version_part = '.'.join(str(v) for v in versions)
+        return f"resp:{request.endpoint}:{version_part}:{view_args}:{self.normalized_args(request.args)}"
+
+    def invalidate(self, namespace, item_id=None):
+        """Invalida as listagens do namespace e, se informado, todas as variações do item."""
+        if not self.enabled:
+            return
+        try:
+            self.backend.bump_version(namespace)
+            if item_id is not None:
+                self.backend.bump_version(f"{namespace}:{item_id}")
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Erro ao invalidar cache de '{namespace}' (item {item_id}): {e}", exc_info=True)
+            return
+        self._count('invalidations')
+        logger.debug(f"Cache invalidado: namespace '{namespace}', item {item_id}.")
+
+    def invalidate_items(self, namespace, item_ids):
+        """Como `invalidate` para vários itens, com um único incremento das listagens."""
+        if not self.enabled:
+            return
+        item_ids = sorted(set(item_ids))
+        try:
+            self.backend.bump_versions([namespace] + [f"{namespace}:{item_id}" for item_id in item_ids])
+        except Exception as e:
+            self._count('errors')
+            logger.error(f"Erro ao invalidar cache de '{namespace}' ({len(item_ids)} itens): {e}", exc_info=True)
+            return
+        self._count('invalidations')
+        logger.debug(f"Cache invalidado: namespace '{namespace}', {len(item_ids)} itens.")
+
+    def cached(self, namespace, item_arg=None, ttl=None, related=None):
+        """Decorador para views GET; só respostas 200 são armazenadas.
+
+        `related`, se informado, é chamado a cada requisição e retorna os
+        namespaces de outros recursos incluídos na resposta.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+                item_id = kwargs.get(item_arg) if item_arg else None
+                try:
+                    key = self.build_key(namespace, item_id, related() if related else ())
+                    entry = self.backend.get(key)
+                except Exception as e:
+                    self._count('errors')
+                    logger.error(f"Erro ao consultar o cache: {e}", exc_info=True)
+                    return view(*args, **kwargs)
+
+                if entry is not None:
+                    self._count('hits')
+                    status, body, headers = entry
+                    response = Response(body, status=status, headers=headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    # Responde 304 direto do cache quando o cliente já tem esta versão
+                    return response.make_conditional(request)
+
+                self._count('misses')
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.is_streamed:
+                    body = response.get_data()
+                    headers = [(k, v) for k, v in response.headers.items() if k.lower() != 'set-cookie']
+                    try:
+                        self.backend.set(key, (200, body, headers), ttl or self.default_ttl, len(body))
+                        self._count('stores')
+                    except Exception as e:
+                        self._count('errors')
+                        logger.error(f"Erro ao armazenar resposta no cache: {e}", exc_info=True)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = counters['hits'] / lookups if lookups else 0.0
+        counters['backend'] = type(self.backend).__name__ if self.backend else None
+        if self.backend is not None:
+            counters.update(self.backend.stats())
+        return counters
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+
+def _build_backend():
+    backend = Config.CACHE_BACKEND
+    if backend == 'none':
+        return None
+    if backend == 'shared':
+        if redis is not None and Config.CACHE_REDIS_URL:
+            return RedisBackend(Config.CACHE_REDIS_URL)
+        logger.warning("Cache compartilhado solicitado sem redis/CACHE_REDIS_URL; usando o substituto local.")
+        return LocalSharedBackend(Config.CACHE_MAX_ENTRIES, Config.CACHE_MAX_BYTES)
+    return LocalLRUBackend(Config.CACHE_MAX_ENTRIES, Config.CACHE_MAX_BYTES)
+
+
+response_cache = ResponseCache(_build_backend(), default_ttl=Config.CACHE_DEFAULT_TTL)
@@ -0,0 +1,197 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+
+from config import Config
+import metrics
+
+logger = logging.getLogger('api_jatoba.uploads')
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# SHA-256 incremental de cada sessão: upload_id -> (bytes já processados, hasher).
+# O estado do hashlib não pode ser gravado em disco, então fica na memória do
+# processo; um worker que recebe um trecho sem o estado atualizado retoma a
+# partir do ponto em que parou (ou do início), lendo só o que falta.
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+class UploadSessionError(Exception):
+    """Erro de protocolo no upload em partes; `status` é o código HTTP sugerido."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _session_dir():
+    os.makedirs(Config.CHUNKED_UPLOAD_FOLDER, exist_ok=True)
+    return Config.CHUNKED_UPLOAD_FOLDER
+
+def _paths(upload_id):
+    if not _UPLOAD_ID.match(upload_id or ''):
+        raise UploadSessionError("Upload não encontrado", 404)
+    base = os.path.join(_session_dir(), upload_id)
+    return base + '.json', base + '.part'
+
+def load_session(upload_id):
+    """Lê os metadados da sessão; o offset é o tamanho atual do arquivo parcial."""
+    meta_path, part_path = _paths(upload_id)
+    try:
+        with open(meta_path, encoding='utf-8') as meta_file:
+            session = json.load(meta_file)
+        session['offset'] = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise UploadSessionError("Upload não encontrado", 404)
+    session['upload_id'] = upload_id
+    session['expires_at'] = session['updated_at'] + Config.UPLOAD_SESSION_TTL
+    session['complete'] = session['offset'] == session['total_size']
+    return session
+
+def _save_metadata(upload_id, metadata):
+    meta_path, _ = _paths(upload_id)
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as meta_file:
+        json.dump(metadata, meta_file)
+    os.replace(tmp_path, meta_path)
+
+def create_session(metadata, total_size):
+    """Abre uma sessão de upload e reserva o arquivo parcial na área temporária."""
+    if isinstance(total_size, bool) or not isinstance(total_size, int) or total_size <= 0:
+        raise UploadSessionError("'total_size' deve ser um inteiro positivo")
+    if total_size > Config.CHUNKED_UPLOAD_MAX_SIZE:
+        raise UploadSessionError(f"Arquivo excede o limite de {Config.CHUNKED_UPLOAD_MAX_SIZE} bytes", 413)
+    purge_expired()
+    upload_id = secrets.token_hex(16)
+    now = time.time()
+    metadata = dict(metadata, total_size=total_size, created_at=now, updated_at=now)
+    _, part_path = _paths(upload_id)
+    open(part_path, 'xb').close()
+    _save_metadata(upload_id, metadata)
+    logger.info(f"Sessão de upload {upload_id} criada para '{metadata.get('filename')}' ({total_size} bytes).")
+    return load_session(upload_id)
+
+def _digest_at(upload_id, part_path, offset):
+    """Retorna o hasher do arquivo parcial até `offset`. Chamar com o flock do arquivo."""
+    with _digests_lock:
+        position, digest = _digests.pop(upload_id, (0, None))
+    if digest is None or position > offset:
+        position, digest = 0, hashlib.sha256()
+    if position < offset:
+        logger.info(f"Upload {upload_id}: SHA-256 retomado do byte {position} (até {offset}).")
+        with open(part_path, 'rb') as source:
+            source.seek(position)
+            while position < offset:
+                block = source.read(min(Config.UPLOAD_BUFFER_SIZE, offset - position))
+                if not block:
+                    raise UploadSessionError("Arquivo parcial menor que o offset registrado", 409, offset=position)
+                digest.update(block)
+                position += len(block)
+    return digest
+
+def _keep_digest(upload_id, offset, digest):
+    with _digests_lock:
+        _digests[upload_id] = (offset, digest)
+
+def _forget_digest(upload_id):
+    with _digests_lock:
+        _digests.pop(upload_id, None)
+
+def append_chunk(upload_id, offset, stream, chunk_size_hint=None):
+    """Grava no arquivo parcial o trecho que começa em `offset`.
+
+    Os trechos são sequenciais: `offset` precisa ser igual ao tamanho já
+    recebido (caso contrário, 409 com o offset correto). Se a conexão cair
+    no meio do trecho, o que chegou fica gravado e o cliente retoma do
+    offset informado pelo status. O SHA-256 é atualizado com cada bloco
+    gravado, para a conclusão não precisar reler o arquivo.
+    """
+    session = load_session(upload_id)
+    _, part_path = _paths(upload_id)
+    with open(part_path, 'ab') as part_file:
+        # Impede que duas requisições escrevam na mesma sessão ao mesmo tempo
+        fcntl.flock(part_file.fileno(), fcntl.LOCK_EX)
+        current = os.fstat(part_file.fileno()).st_size
+        if offset != current:
+            raise UploadSessionError("Offset não corresponde ao já recebido", 409, offset=current)
+        remaining = session['total_size'] - current
+        if chunk_size_hint is not None and chunk_size_hint > remaining:
+            raise UploadSessionError("Trecho ultrapassa o tamanho total declarado", 413, offset=current)
+        digest = _digest_at(upload_id, part_path, current)
+        written = 0
+        try:
+            while True:
+                block = stream.read(min(Config.UPLOAD_BUFFER_SIZE, remaining - written + 1))
+                if not block:
+                    break
+                if written + len(block) > remaining:
+                    part_file.truncate(current + written)
+                    raise UploadSessionError("Trecho ultrapassa o tamanho total declarado", 413,
+                                             offset=current + written)
+                part_file.write(block)
+                digest.update(block)
+                written += len(block)
+            part_file.flush()
+        finally:
+            _keep_digest(upload_id, current + written, digest)
+    session['updated_at'] = time.time()
+    _save_metadata(upload_id, {k: v for k, v in session.items()
+                               if k not in ('offset', 'upload_id', 'expires_at', 'complete')})
+    metrics.UPLOAD_BYTES.inc(written, kind='chunked')
+    return current + written
+
+def finalize_session(upload_id, destination):
+    """Move o arquivo montado para `destination` (rename, sem reler o conteúdo).
+
+    Retorna (sessão, sha256 do conteúdo). Só relê o arquivo se este processo
+    não acompanhou os trechos (conclusão recebida por outro worker, reinício).
+    """
+    session = load_session(upload_id)
+    if not session['complete']:
+        raise UploadSessionError("Upload incompleto", 409, offset=session['offset'])
+    meta_path, part_path = _paths(upload_id)
+    with open(part_path, 'rb') as part_file:
+        fcntl.flock(part_file.fileno(), fcntl.LOCK_EX)
+        digest = _digest_at(upload_id, part_path, session['total_size'])
+        os.replace(part_path, destination)
+    os.remove(meta_path)
+    _forget_digest(upload_id)
+    return session, digest.hexdigest()
+
+def discard_session(upload_id):
+    meta_path, part_path = _paths(upload_id)
+    _forget_digest(upload_id)
+    found = False
+    for path in (part_path, meta_path):
+        try:
+            os.remove(path)
+            found = True
+        except FileNotFoundError:
+            pass
+    if not found:
+        raise UploadSessionError("Upload não encontrado", 404)
+
+def purge_expired():
+    """Remove sessões sem atividade há mais de UPLOAD_SESSION_TTL segundos."""
+    cutoff = time.time() - Config.UPLOAD_SESSION_TTL
+    for entry in os.scandir(_session_dir()):
+        if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+            upload_id = entry.name[:-len('.json')]
+            try:
+                discard_session(upload_id)
+                logger.info(f"Sessão de upload expirada {upload_id} removida.")
+            except UploadSessionError:
+                pass
+    # Hashers de sessões concluídas ou canceladas por outro worker
+    with _digests_lock:
+        for upload_id in list(_digests):
+            if not os.path.exists(_paths(upload_id)[0]):
+                del _digests[upload_id]
@@ -0,0 +1,79 @@
+import hashlib
+from datetime import timezone
+
+from flask import Response, request
+from cache import ResponseCache
+
+
+def _as_utc(value):
+    """Os TIMESTAMPs vêm do PyMySQL sem fuso; como no jsonify, são tratados como UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def _representation():
+    """Identifica a representação pedida: endpoint e query string normalizada."""
+    return f"{request.endpoint}?{ResponseCache.normalized_args(request.args)}"
+
+def make_etag(*parts):
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8'))
+    return digest.hexdigest()
+
+def item_validators(table, row):
+    """ETag e Last-Modified de um registro, derivados de id e updated_at."""
+    last_modified = _as_utc(row.get('updated_at'))
+    etag = make_etag(_representation(), table, row['id'], last_modified.isoformat() if last_modified else '')
+    return etag, last_modified
+
+def _list_validators(table, row_count, last_modified, id_sum):
+    last_modified = _as_utc(last_modified)
+    etag = make_etag(_representation(), table, row_count, int(id_sum or 0),
+                     last_modified.isoformat() if last_modified else '')
+    return etag, last_modified
+
+def rows_validators(table, rows):
+    """Validadores de uma página a partir das linhas já buscadas (limit + 1 linhas)."""
+    last_modified = max((row['updated_at'] for row in rows if row.get('updated_at')), default=None)
+    return _list_validators(table, len(rows), last_modified, sum(row['id'] for row in rows))
+
+def probe_list_validators(cursor, table, page_sql, params):
+    """Calcula os validadores de uma página com uma consulta agregada barata.
+
+    `page_sql` deve selecionar `id, updated_at` com os mesmos filtros, keyset e
+    LIMIT da listagem; contagem, soma dos ids e maior updated_at mudam com
+    inserções, exclusões e atualizações dentro da página.
+    """
+    cursor.execute(
+        "SELECT COUNT(*) AS row_count, MAX(updated_at) AS last_modified, SUM(id) AS id_sum "
+        f"FROM ({page_sql}) AS page",
+        params
+    )
+    probe = cursor.fetchone()
+    return _list_validators(table, probe['row_count'], probe['last_modified'], probe['id_sum'])
+
+def is_conditional():
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+def not_modified(etag, last_modified):
+    """Retorna uma resposta 304 se os validadores da requisição ainda valem, senão None.
+
+    If-None-Match tem precedência; If-Modified-Since só é avaliado na sua ausência.
+    """
+    if request.if_none_match:
+        if not request.if_none_match.contains(etag):
+            return None
+    elif request.if_modified_since is not None:
+        if last_modified is None or last_modified.replace(microsecond=0) > request.if_modified_since:
+            return None
+    else:
+        return None
+    response = Response(status=304)
+    return with_validators(response, etag, last_modified)
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
@@ -9,9 +9,124 @@ class Config:
     DB_USER = os.getenv('DB_USER')
     DB_PASSWORD = os.getenv('DB_PASSWORD')
     DB_NAME = os.getenv('DB_NAME')
+
+    # Configurações do pool de conexões
+    DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+    DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))  # Segundos até fechar uma conexão ociosa
+    DB_POOL_WAIT_TIMEOUT = float(os.getenv('DB_POOL_WAIT_TIMEOUT', 5))  # Segundos aguardando uma conexão livre
+    DB_POOL_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', 30))  # Ociosidade que dispara um ping
+
     UPLOAD_FOLDER = os.path.abspath(os.getenv('UPLOAD_FOLDER', './uploads'))
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # Limite de 16MB para uploads
+    # Layout das pastas de upload: 'hashed' (subpasta por tipo + 2 níveis de hash) ou 'flat' (tudo na raiz, legado)
+    STORAGE_LAYOUT = os.getenv('STORAGE_LAYOUT', 'hashed')
+    STORAGE_FANOUT_DEPTH = int(os.getenv('STORAGE_FANOUT_DEPTH', 2))
+    STORAGE_FANOUT_WIDTH = int(os.getenv('STORAGE_FANOUT_WIDTH', 2))
+    # Armazenamento endereçado por conteúdo (SHA-256) dos arquivos enviados
+    BLOB_FOLDER = os.path.abspath(os.getenv('BLOB_FOLDER', os.path.join(UPLOAD_FOLDER, 'blobs')))
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # Limite de 16MB para uploads (e para cada trecho dos uploads em partes)
+
+    # Uploads em partes (retomáveis); a área temporária fica no mesmo sistema de arquivos
+    # de UPLOAD_FOLDER para que a conclusão seja só um rename.
+    CHUNKED_UPLOAD_FOLDER = os.path.abspath(os.getenv('CHUNKED_UPLOAD_FOLDER', os.path.join(UPLOAD_FOLDER, '.chunked')))
+    CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', 4 * 1024 * 1024 * 1024))  # 4GB
+    UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 60 * 60))  # Segundos sem atividade até expirar
+    UPLOAD_BUFFER_SIZE = int(os.getenv('UPLOAD_BUFFER_SIZE', 1024 * 1024))  # Bytes lidos por vez do corpo da requisição
+
+    # Paginação das listagens
+    PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', 50))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', 500))  # Limite imposto pelo servidor
+    BATCH_IDS_MAX = int(os.getenv('BATCH_IDS_MAX', 100))  # IDs aceitos em ?ids= nas listagens
+    EXPAND_MAX_DEPTH = int(os.getenv('EXPAND_MAX_DEPTH', 2))  # Níveis aceitos em ?expand= (ex.: equipment.manufacturer)
+
+    # Busca (FULLTEXT)
+    SEARCH_PAGE_SIZE_DEFAULT = int(os.getenv('SEARCH_PAGE_SIZE_DEFAULT', 20))
+    SEARCH_PAGE_SIZE_MAX = int(os.getenv('SEARCH_PAGE_SIZE_MAX', 100))
+    SEARCH_MIN_TOKEN_SIZE = int(os.getenv('SEARCH_MIN_TOKEN_SIZE', 3))  # Deve acompanhar innodb_ft_min_token_size
+
+    # Sugestões de autocompletar (índice de trigramas em memória)
+    SUGGEST_ENABLED = os.getenv('SUGGEST_ENABLED', 'true').lower() == 'true'
+    SUGGEST_REFRESH_INTERVAL = float(os.getenv('SUGGEST_REFRESH_INTERVAL', 300))  # Segundos entre reconstruções; 0 desativa
+    SUGGEST_MIN_SIMILARITY = float(os.getenv('SUGGEST_MIN_SIMILARITY', 0.5))  # Fração mínima de trigramas da consulta em comum
+    SUGGEST_PREFIX_SCAN_LIMIT = int(os.getenv('SUGGEST_PREFIX_SCAN_LIMIT', 2000))  # Termos examinados em consultas de 1-2 caracteres
+    SUGGEST_LIMIT_DEFAULT = int(os.getenv('SUGGEST_LIMIT_DEFAULT', 10))
+    SUGGEST_LIMIT_MAX = int(os.getenv('SUGGEST_LIMIT_MAX', 50))
+
+    # Cache de respostas GET do catálogo
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'local').lower()  # 'local', 'shared' ou 'none'
+    CACHE_DEFAULT_TTL = float(os.getenv('CACHE_DEFAULT_TTL', 60))  # Segundos
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')  # Usado pelo backend 'shared' (requer o pacote redis)
+
+    # Contador de downloads write-behind
+    DOWNLOAD_FLUSH_INTERVAL = float(os.getenv('DOWNLOAD_FLUSH_INTERVAL', 5))  # Segundos entre gravações
+    DOWNLOAD_FLUSH_THRESHOLD = int(os.getenv('DOWNLOAD_FLUSH_THRESHOLD', 1000))  # Downloads pendentes que antecipam a gravação
+    DOWNLOAD_FLUSH_BATCH_SIZE = int(os.getenv('DOWNLOAD_FLUSH_BATCH_SIZE', 500))  # Arquivos por UPDATE
+
+    # Histórico de downloads (eventos + agregações por hora/dia)
+    DOWNLOAD_EVENTS_ENABLED = os.getenv('DOWNLOAD_EVENTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    DOWNLOAD_EVENTS_MAX_BUCKETS = int(os.getenv('DOWNLOAD_EVENTS_MAX_BUCKETS', 100000))  # Pares arquivo/segundo no buffer; o excedente é descartado
+    DOWNLOAD_ROLLUP_INTERVAL = float(os.getenv('DOWNLOAD_ROLLUP_INTERVAL', 60))  # Segundos entre agregações
+    DOWNLOAD_ROLLUP_BATCH_SIZE = int(os.getenv('DOWNLOAD_ROLLUP_BATCH_SIZE', 50000))  # Eventos por transação
+    DOWNLOAD_EVENTS_RETENTION_DAYS = int(os.getenv('DOWNLOAD_EVENTS_RETENTION_DAYS', 30))  # Eventos brutos já agregados
+    DOWNLOAD_HOURLY_RETENTION_DAYS = int(os.getenv('DOWNLOAD_HOURLY_RETENTION_DAYS', 90))  # Agregados por hora (os diários ficam)
+
+    # Downloads de arquivos
+    DOWNLOAD_BUFFER_SIZE = int(os.getenv('DOWNLOAD_BUFFER_SIZE', 256 * 1024))  # Bytes por leitura quando não há sendfile
+    DOWNLOAD_MAX_RANGES = int(os.getenv('DOWNLOAD_MAX_RANGES', 16))  # Acima disso o Range é ignorado e o arquivo vai inteiro
+    FILE_OFFLOAD = os.getenv('FILE_OFFLOAD', '').lower()  # '', 'x-accel-redirect' (nginx) ou 'x-sendfile' (Apache/lighttpd)
+    FILE_OFFLOAD_INTERNAL_PREFIX = os.getenv('FILE_OFFLOAD_INTERNAL_PREFIX', '/protected-uploads/')  # location internal do nginx
+
+    # Variantes de logos e imagens de equipamentos (requer Pillow)
+    IMAGE_VARIANTS_ENABLED = os.getenv('IMAGE_VARIANTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))  # Threads de geração por processo
+    IMAGE_VARIANT_SIZES = os.getenv('IMAGE_VARIANT_SIZES', 'thumb:160,medium:640')  # nome:lado máximo em pixels
+    IMAGE_VARIANT_WEBP = os.getenv('IMAGE_VARIANT_WEBP', 'true').lower() in ('1', 'true', 'yes')  # Gera também cada tamanho em WebP
+    IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', 82))  # Qualidade JPEG/WebP
+
+    # Varredura de arquivos órfãos e registros sem arquivo (storage_gc.py)
+    GC_ENABLED = os.getenv('GC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    GC_MODE = os.getenv('GC_MODE', 'report')  # 'report' só relata; 'quarantine' move os órfãos para UPLOAD_FOLDER/.quarantine
+    GC_INTERVAL = float(os.getenv('GC_INTERVAL', 6 * 60 * 60))  # Segundos entre varreduras completas
+    GC_BATCH_SIZE = int(os.getenv('GC_BATCH_SIZE', 500))  # Arquivos/linhas por passo (uma consulta por lote)
+    GC_IO_RATE = float(os.getenv('GC_IO_RATE', 200))  # Máximo de arquivos/linhas examinados por segundo (0 = sem limite)
+    GC_GRACE_PERIOD = int(os.getenv('GC_GRACE_PERIOD', 60 * 60))  # Arquivos mais novos que isso nunca são órfãos
+
+    # Exportações em streaming (NDJSON/CSV)
+    EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))  # Linhas lidas do cursor por lote
+    EXPORT_NET_WRITE_TIMEOUT = int(os.getenv('EXPORT_NET_WRITE_TIMEOUT', 600))  # Segundos; 0 mantém o padrão do servidor
+
+    # Importação em lote (bulk_import.py)
+    BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', 5000))  # Registros por requisição (acima disso, 413)
+    BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 500))  # Registros por transação / INSERT de várias linhas
+
+    # Contadores de /admin/stats (stats_summary.py)
+    STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', 15 * 60))  # Segundos entre recálculos; 0 desativa
+
+    # Log de queries lentas (slow_query.py)
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', 200))  # 0 desativa
+    SLOW_QUERY_EXPLAIN_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_RATE', 0))  # Fração dos SELECTs lentos com EXPLAIN (0 a 1)
+    SLOW_QUERY_EXPLAIN_INTERVAL = int(os.getenv('SLOW_QUERY_EXPLAIN_INTERVAL', 300))  # Segundos entre EXPLAINs do mesmo statement
+
+    # Métricas no formato do Prometheus (GET /metrics)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_DIR = os.getenv('METRICS_DIR', '')  # Retratos por processo para somar vários workers; vazio = só o processo atual
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))  # Segundos entre gravações do retrato
 
     # Configurações de Logging
     LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.log')
-    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper() # Nível padrão: INFO
\ No newline at end of file
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper() # Nível padrão: INFO
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 50 * 1024 * 1024))  # Rotação por tamanho (0 = sem rotação)
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # Rotação por horário ('midnight', 'H'...); tem precedência sobre o tamanho
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))  # Arquivos rotacionados mantidos
+    LOG_COMPRESS = os.getenv('LOG_COMPRESS', 'true').lower() in ('1', 'true', 'yes')  # Compacta os rotacionados com gzip
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))  # Mensagens aguardando a thread de escrita
+    LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 1.0))  # Fração mantida dos logs por requisição/conexão (0 a 1)
+    LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 0))  # Máximo por segundo desses logs (0 = sem limite)
+    ACCESS_LOG_ENABLED = os.getenv('ACCESS_LOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')  # Log de acesso em JSON
+    ACCESS_LOG_FILE = os.getenv('ACCESS_LOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'access.log'))
+
+    # Serialização JSON (json_provider.py; usa o orjson se instalado)
+    JSON_DATETIME_FORMAT = os.getenv('JSON_DATETIME_FORMAT', 'http').lower()  # 'http' (como o jsonify do Flask) ou 'iso' (ISO 8601, mais rápido com orjson)
+    JSON_STREAM_MIN_ITEMS = int(os.getenv('JSON_STREAM_MIN_ITEMS', 1000))  # Arrays a partir deste tamanho são enviados em partes; 0 desativa
\ No newline at end of file
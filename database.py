@@ -1,36 +1,381 @@
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
 import pymysql
 from pymysql import Error
+from pymysql.constants import SERVER_STATUS
+from flask import g, has_app_context
 from config import Config
+from access_log import add_timing
+import metrics
+from slow_query import slow_query_log
 import logging # Importa o módulo logging
 
 # O logger já foi configurado em logger.py, apenas o obtemos aqui
 db_logger = logging.getLogger('api_jatoba.database')
 
+
+class PoolTimeoutError(Error):
+    """Nenhuma conexão ficou disponível no pool dentro do tempo de espera."""
+
+
+class ConnectionPool:
+    """Pool limitado e thread-safe de conexões PyMySQL.
+
+    Mantém até `max_size` conexões abertas. Conexões ociosas há mais de
+    `idle_timeout` segundos são fechadas (preservando `min_size`), e uma
+    conexão ociosa há mais de `health_check_interval` segundos recebe um
+    `ping` antes de ser entregue.
+    """
+
+    def __init__(self, creator, min_size=0, max_size=10, idle_timeout=300,
+                 wait_timeout=5, health_check_interval=30):
+        if max_size < 1:
+            raise ValueError("max_size deve ser maior ou igual a 1")
+        self._creator = creator
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = collections.deque()  # (conexão, instante em que foi devolvida)
+        self._size = 0  # conexões abertas (ociosas + em uso)
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'acquired': 0,
+            'released': 0,
+            'timeouts': 0,
+            'failed_health_checks': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+    def _open(self):
+        conn = self._creator()
+        with self._cond:
+            self._stats['created'] += 1
+        db_logger.info("Nova conexão ao banco de dados criada para o pool.")
+        return conn
+
+    def discard(self, conn):
+        """Fecha uma conexão e libera sua vaga no pool."""
+        try:
+            if conn.open:
+                conn.close()
+        except Error as e:
+            db_logger.warning(f"Erro ao fechar conexão descartada do pool: {e}")
+        with self._cond:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    def _prune_idle_locked(self, now):
+        """Remove do pool as conexões ociosas expiradas. Deve ser chamado com o lock."""
+        expired = []
+        # As conexões mais antigas ficam à esquerda da deque.
+        while (self._idle and self._size - len(expired) > self.min_size
+               and now - self._idle[0][1] > self.idle_timeout):
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def _is_healthy(self, conn, idle_for):
+        if not conn.open:
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Error:
+            return False
+
+    def acquire(self):
+        """Retira uma conexão do pool, criando uma nova se houver vaga."""
+        start = time.monotonic()
+        deadline = start + self.wait_timeout
+        waited = False
+        while True:
+            conn = None
+            create = False
+            timed_out = False
+            expired = []
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    pruned = self._prune_idle_locked(now)
+                    if pruned:
+                        self._size -= len(pruned)
+                        self._stats['closed'] += len(pruned)
+                        expired.extend(pruned)
+                    if self._idle:
+                        # LIFO: reutiliza a conexão mais recente, deixando as antigas expirarem.
+                        conn, released_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        timed_out = True
+                        break
+                    waited = True
+                    self._cond.wait(remaining)
+            for stale in expired:
+                try:
+                    stale.close()
+                except Error:
+                    pass
+            if timed_out:
+                raise PoolTimeoutError(
+                    f"Tempo de espera de {self.wait_timeout}s esgotado aguardando conexão do pool"
+                )
+
+            if create:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, time.monotonic() - released_at):
+                with self._cond:
+                    self._stats['failed_health_checks'] += 1
+                db_logger.warning("Conexão ociosa falhou no health check e foi descartada.")
+                self.discard(conn)
+                continue
+
+            wait_time = time.monotonic() - start
+            metrics.DB_ACQUIRE.observe(wait_time)
+            with self._cond:
+                self._stats['acquired'] += 1
+                self._stats['wait_time_total'] += wait_time
+                if wait_time > self._stats['wait_time_max']:
+                    self._stats['wait_time_max'] = wait_time
+                if waited:
+                    self._stats['waits'] += 1
+            return conn
+
+    def release(self, conn):
+        """Devolve uma conexão ao pool, desfazendo qualquer transação pendente."""
+        if conn is None:
+            return
+        try:
+            if not conn.open:
+                raise Error("conexão fechada")
+            if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                conn.rollback()
+        except Error as e:
+            db_logger.warning(f"Conexão devolvida em estado inválido, descartando: {e}")
+            self.discard(conn)
+            return
+        with self._cond:
+            self._stats['released'] += 1
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        """Fecha todas as conexões ociosas; as que estão em uso continuam válidas."""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except Error:
+                pass
+
+    def stats(self):
+        """Retorna um retrato dos contadores do pool para dimensionamento."""
+        with self._cond:
+            stats = dict(self._stats)
+            idle = len(self._idle)
+            size = self._size
+        stats.update({
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'wait_time_avg': stats['wait_time_total'] / stats['acquired'] if stats['acquired'] else 0.0,
+        })
+        return stats
+
+
+class _InstrumentedCursorMixin:
+    """Mede cada statement (execute + fetches) e registra linhas, métricas e queries lentas.
+
+    O `executemany` do PyMySQL passa por `execute`, então também é medido.
+    Nos cursores bufferizados o resultado já chega inteiro no `execute`; nos
+    não bufferizados o statement só é contabilizado no próximo `execute` ou
+    no `close`, somando o tempo e as linhas de todos os fetches.
+    """
+
+    _statement = None  # [query, args, segundos, linhas]
+
+    def execute(self, query, args=None):
+        self._finish_statement()
+        start = time.perf_counter()
+        completed = False
+        try:
+            result = super().execute(query, args)
+            completed = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            add_timing('sql', elapsed)
+            self._statement = [query, args, elapsed, 0]
+            if not self._unbuffered or not completed:
+                self._statement[3] = max(self.rowcount, 0) if completed else 0
+                self._finish_statement(explain=completed)
+
+    def _fetched(self, start, rows):
+        elapsed = time.perf_counter() - start
+        add_timing('sql', elapsed, count=0)
+        if self._statement is not None:
+            self._statement[2] += elapsed
+            self._statement[3] += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._finish_statement()
+
+    def abandon(self):
+        """Registra o comando nas métricas e solta o cursor sem ler o restante do resultado.
+
+        Para cursores não bufferizados cuja conexão vai ser descartada: o
+        `close` leria (e descartaria) todas as linhas que faltam.
+        """
+        self._finish_statement()
+        self.connection = None
+
+    def _finish_statement(self, explain=False):
+        statement, self._statement = self._statement, None
+        if statement is None:
+            return
+        query, args, elapsed, rows = statement
+        metrics.observe_query(query, elapsed, rows)
+        # EXPLAIN só com o resultado já lido (cursor bufferizado), na mesma conexão
+        slow_query_log.record(query, args, elapsed, rows, self.connection if explain else None)
+
+
+class TimedDictCursor(_InstrumentedCursorMixin, pymysql.cursors.DictCursor):
+    """Cursor padrão das conexões do pool."""
+
+    _unbuffered = False
+
+
+class TimedSSDictCursor(_InstrumentedCursorMixin, pymysql.cursors.SSDictCursor):
+    """Cursor não bufferizado instrumentado, para exportações em streaming."""
+
+    _unbuffered = True
+
+
+def _create_connection():
+    return pymysql.connect(
+        host=Config.DB_HOST,
+        port=Config.DB_PORT,
+        user=Config.DB_USER,
+        password=Config.DB_PASSWORD,
+        database=Config.DB_NAME,
+        cursorclass=TimedDictCursor
+    )
+
+
+pool = ConnectionPool(
+    _create_connection,
+    min_size=Config.DB_POOL_MIN_SIZE,
+    max_size=Config.DB_POOL_MAX_SIZE,
+    idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+    wait_timeout=Config.DB_POOL_WAIT_TIMEOUT,
+    health_check_interval=Config.DB_POOL_HEALTH_CHECK_INTERVAL,
+)
+
+
 def get_db_connection():
-    """Cria e retorna uma nova conexão com o banco de dados usando PyMySQL."""
+    """Retorna uma conexão do pool.
+
+    Dentro de uma requisição, a mesma conexão é reutilizada por todos os
+    handlers e devolvida ao pool no teardown do contexto da aplicação.
+    Fora dela, quem chama deve devolvê-la com `close_db_connection`.
+    """
+    if has_app_context() and '_db_conn' in g:
+        return g._db_conn
+    start = time.perf_counter()
     try:
-        conn = pymysql.connect(
-            host=Config.DB_HOST,
-            port=Config.DB_PORT,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            database=Config.DB_NAME,
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        db_logger.info("Conexão ao banco de dados estabelecida com sucesso.")
-        return conn
+        conn = pool.acquire()
+        db_logger.debug("Conexão ao banco de dados obtida do pool.")
     except Error as e:
-        db_logger.error(f"Erro ao conectar ao MariaDB com PyMySQL: {e}", exc_info=True)
+        db_logger.error(f"Erro ao obter conexão do pool para o MariaDB: {e}", exc_info=True)
         return None
+    finally:
+        add_timing('db_wait', time.perf_counter() - start)
+    if has_app_context():
+        g._db_conn = conn
+    return conn
 
 def close_db_connection(conn):
-    """Fecha a conexão com o banco de dados, se estiver aberta."""
-    if conn and conn.open:
-        try:
-            conn.close()
-            db_logger.info("Conexão ao banco de dados fechada com sucesso.")
-        except Error as e:
-            db_logger.error(f"Erro ao fechar conexão com o banco de dados: {e}", exc_info=True)
+    """Devolve ao pool uma conexão obtida fora do contexto de requisição.
+
+    A conexão vinculada à requisição atual é devolvida apenas no teardown,
+    então chamar esta função nos handlers é seguro e não tem efeito.
+    """
+    if conn is None:
+        return
+    if has_app_context() and g.get('_db_conn') is conn:
+        return
+    pool.release(conn)
+    db_logger.debug("Conexão ao banco de dados devolvida ao pool.")
+
+def release_request_connection(exc=None):
+    """Devolve ao pool a conexão vinculada à requisição atual, se houver."""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        pool.release(conn)
+        db_logger.debug("Conexão da requisição devolvida ao pool.")
+
+@contextmanager
+def pooled_connection():
+    """Empresta uma conexão do pool fora do ciclo da requisição (jobs, streaming)."""
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+def init_app(app):
+    """Registra a devolução da conexão da requisição no teardown da aplicação."""
+    app.teardown_appcontext(release_request_connection)
 
 # Exemplo de uso
 if __name__ == '__main__':
@@ -48,4 +393,5 @@ if __name__ == '__main__':
             db_logger.error(f"Erro ao executar query de teste: {e}", exc_info=True)
         finally:
             cursor.close()
-            close_db_connection(conn)
\ No newline at end of file
+            close_db_connection(conn)
+            print(f"Estatísticas do pool: {pool.stats()}")
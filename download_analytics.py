@@ -0,0 +1,241 @@
+"""Séries temporais de downloads: agregação de `eventos_download` por hora e por dia.
+
+Os eventos são só inseridos (pelo contador de downloads, em lote), cada um
+com os downloads de um arquivo num segundo (coluna `downloads`). Uma
+thread os agrega em `downloads_por_hora` e `downloads_por_dia` a partir de
+uma marca d'água (último id agregado, em `agregacoes_downloads`), de modo
+que cada evento é lido uma única vez, e apaga os eventos já agregados que
+passaram do prazo de retenção. As consultas de ranking leem só as tabelas
+agregadas, cujo tamanho depende de arquivos x períodos, não do número de
+downloads.
+"""
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+from database import pooled_connection
+
+logger = logging.getLogger('api_jatoba.download_analytics')
+
+ROLLUP_NAME = 'downloads'
+
+# Janela máxima respondida com a granularidade horária; acima disso usa a diária
+HOURLY_WINDOW_LIMIT = timedelta(hours=72)
+
+# Dimensão do ranking -> (coluna agrupada, JOINs a partir de d.file_id)
+DIMENSIONS = {
+    'file': ('d.file_id', ''),
+    'equipment': ('a.equipment_id', 'JOIN arquivos a ON a.id = d.file_id'),
+    'manufacturer': ('e.manufacturer_id', 'JOIN arquivos a ON a.id = d.file_id '
+                                          'JOIN equipamentos e ON e.id = a.equipment_id'),
+}
+
+# Nome e colunas descritivas de cada dimensão no ranking
+_LABELS = {
+    'file': "SELECT id, name, type, equipment_id FROM arquivos WHERE id IN ({})",
+    'equipment': "SELECT id, name, model, manufacturer_id FROM equipamentos WHERE id IN ({})",
+    'manufacturer': "SELECT id, name FROM fabricantes WHERE id IN ({})",
+}
+
+
+class AnalyticsError(ValueError):
+    """Parâmetro inválido nas consultas de downloads."""
+
+
+_WINDOW_UNITS = {'h': 'hours', 'd': 'days'}
+
+def parse_window(value, default='7d'):
+    """'24h', '7d', '30d' -> timedelta (de 1 hora a 3660 dias)."""
+    value = (value or default).strip().lower()
+    unit = _WINDOW_UNITS.get(value[-1:])
+    if unit is None or not value[:-1].isdigit() or int(value[:-1]) <= 0:
+        raise AnalyticsError("Parâmetro 'window' inválido. Use horas ou dias, ex.: '24h', '7d'.")
+    window = timedelta(**{unit: int(value[:-1])})
+    if window > timedelta(days=3660):
+        raise AnalyticsError("Parâmetro 'window' muito longo (máximo de 3660 dias).")
+    return window
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def _source(window):
+    """Tabela agregada, coluna do período e início da janela (alinhado ao período)."""
+    now = _utcnow()
+    if window <= HOURLY_WINDOW_LIMIT:
+        start = (now - window).replace(minute=0, second=0, microsecond=0)
+        return 'downloads_por_hora', 'bucket', start, 'hour'
+    start = (now - window).replace(hour=0, minute=0, second=0, microsecond=0)
+    return 'downloads_por_dia', 'day', start.date(), 'day'
+
+
+class DownloadRollup:
+    """Agrega os eventos novos em lotes de `batch_size` ids por transação.
+
+    Ids de AUTO_INCREMENT podem ser confirmados fora de ordem por flushes
+    concorrentes; por isso só são agregados os eventos até o maior id visto
+    há pelo menos `settle_seconds` (um flush leva bem menos que isso).
+    """
+
+    def __init__(self, batch_size=50000, settle_seconds=30, event_retention_days=30, hourly_retention_days=90):
+        self.batch_size = batch_size
+        self.settle_seconds = settle_seconds
+        self.event_retention_days = event_retention_days
+        self.hourly_retention_days = hourly_retention_days
+        self._observed = []  # (instante, maior id visto)
+
+    def _safe_upper(self, cursor):
+        cursor.execute("SELECT MAX(id) AS max_id FROM eventos_download")
+        max_id = cursor.fetchone()['max_id'] or 0
+        now = time.monotonic()
+        self._observed.append((now, max_id))
+        settled = [item for item in self._observed if now - item[0] >= self.settle_seconds]
+        if not settled:
+            return 0
+        # Mantém só a observação estável mais recente e as ainda em espera
+        self._observed = [settled[-1]] + [item for item in self._observed if now - item[0] < self.settle_seconds]
+        return settled[-1][1]
+
+    def run_once(self, conn):
+        """Agrega um lote de eventos. Retorna quantos ids foram consumidos (0 = em dia)."""
+        cursor = conn.cursor()
+        try:
+            upper_safe = self._safe_upper(cursor)
+            conn.commit()
+            # A linha da marca d'água serializa as agregações entre processos
+            cursor.execute("SELECT last_event_id FROM agregacoes_downloads WHERE name = %s FOR UPDATE",
+                           (ROLLUP_NAME,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT IGNORE INTO agregacoes_downloads (name, last_event_id) VALUES (%s, 0)",
+                               (ROLLUP_NAME,))
+                conn.commit()
+                return 0
+            last_id = row['last_event_id']
+            upper = min(last_id + self.batch_size, upper_safe)
+            if upper <= last_id:
+                conn.rollback()
+                return 0
+            for table, period, expression in (
+                    ('downloads_por_hora', 'bucket', "DATE_FORMAT(occurred_at, '%%Y-%%m-%%d %%H:00:00')"),
+                    ('downloads_por_dia', 'day', "DATE(occurred_at)")):
+                cursor.execute(
+                    f"INSERT INTO {table} ({period}, file_id, downloads) "
+                    f"SELECT {expression}, file_id, SUM(downloads) FROM eventos_download "
+                    f"WHERE id > %s AND id <= %s GROUP BY 1, 2 "
+                    f"ON DUPLICATE KEY UPDATE downloads = downloads + VALUES(downloads)",
+                    (last_id, upper)
+                )
+            cursor.execute(
+                "UPDATE agregacoes_downloads SET last_event_id = %s, "
+                "last_event_at = (SELECT MAX(occurred_at) FROM eventos_download WHERE id > %s AND id <= %s) "
+                "WHERE name = %s",
+                (upper, last_id, upper, ROLLUP_NAME)
+            )
+            conn.commit()
+            return upper - last_id
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def purge(self, conn, limit=10000):
+        """Apaga, em lotes, eventos já agregados e horas antigas fora da retenção."""
+        cursor = conn.cursor()
+        removed = 0
+        try:
+            cursor.execute("SELECT last_event_id FROM agregacoes_downloads WHERE name = %s", (ROLLUP_NAME,))
+            row = cursor.fetchone()
+            if row is None:
+                return 0
+            events_before = _utcnow() - timedelta(days=self.event_retention_days)
+            hours_before = _utcnow() - timedelta(days=self.hourly_retention_days)
+            for sql, params in (
+                    ("DELETE FROM eventos_download WHERE id <= %s AND occurred_at < %s ORDER BY id LIMIT %s",
+                     (row['last_event_id'], events_before, limit)),
+                    ("DELETE FROM downloads_por_hora WHERE bucket < %s ORDER BY bucket LIMIT %s",
+                     (hours_before, limit))):
+                cursor.execute(sql, params)
+                removed += cursor.rowcount
+                conn.commit()
+            return removed
+        finally:
+            cursor.close()
+
+    def catch_up(self, stop_event=None):
+        """Agrega até alcançar os eventos mais recentes e aplica a retenção."""
+        total = 0
+        with pooled_connection() as conn:
+            while stop_event is None or not stop_event.is_set():
+                consumed = self.run_once(conn)
+                total += consumed
+                if consumed < self.batch_size:
+                    break
+            while self.purge(conn) and (stop_event is None or not stop_event.is_set()):
+                pass
+        return total
+
+
+def rollup_status(cursor):
+    cursor.execute("SELECT last_event_id, last_event_at, updated_at FROM agregacoes_downloads WHERE name = %s",
+                   (ROLLUP_NAME,))
+    return cursor.fetchone()
+
+def top(cursor, dimension, window, limit=10):
+    """Ranking de `dimension` (file, equipment, manufacturer) por downloads na janela."""
+    if dimension not in DIMENSIONS:
+        raise AnalyticsError(f"Parâmetro 'by' inválido. Use {', '.join(DIMENSIONS)}.")
+    column, joins = DIMENSIONS[dimension]
+    table, period, start, granularity = _source(window)
+    cursor.execute(
+        f"SELECT {column} AS id, SUM(d.downloads) AS downloads FROM {table} d {joins} "
+        f"WHERE d.{period} >= %s AND {column} IS NOT NULL "
+        f"GROUP BY {column} ORDER BY downloads DESC, id LIMIT %s",
+        (start, limit)
+    )
+    ranking = [{'id': row['id'], 'downloads': int(row['downloads'])} for row in cursor.fetchall()]
+    if ranking:
+        ids = [item['id'] for item in ranking]
+        cursor.execute(_LABELS[dimension].format(', '.join(['%s'] * len(ids))), ids)
+        details = {row['id']: row for row in cursor.fetchall()}
+        for item in ranking:
+            item.update({key: value for key, value in details.get(item['id'], {}).items() if key != 'id'})
+    return {'by': dimension, 'granularity': granularity, 'since': start, 'items': ranking}
+
+def series(cursor, file_id, window):
+    """Downloads de um arquivo por hora (janelas de até 72h) ou por dia."""
+    table, period, start, granularity = _source(window)
+    cursor.execute(
+        f"SELECT {period} AS period, downloads FROM {table} WHERE file_id = %s AND {period} >= %s ORDER BY {period}",
+        (file_id, start)
+    )
+    points = [{'period': row['period'], 'downloads': int(row['downloads'])} for row in cursor.fetchall()]
+    return {'file_id': file_id, 'granularity': granularity, 'since': start, 'points': points}
+
+
+download_rollup = DownloadRollup(
+    batch_size=Config.DOWNLOAD_ROLLUP_BATCH_SIZE,
+    event_retention_days=Config.DOWNLOAD_EVENTS_RETENTION_DAYS,
+    hourly_retention_days=Config.DOWNLOAD_HOURLY_RETENTION_DAYS,
+)
+
+
+def _rollup_loop(stop_event):
+    stop_event.wait(random.uniform(0, Config.DOWNLOAD_ROLLUP_INTERVAL))
+    while not stop_event.is_set():
+        try:
+            consumed = download_rollup.catch_up(stop_event)
+            if consumed:
+                logger.info(f"{consumed} eventos de download agregados.")
+        except Exception as e:
+            logger.error(f"Erro ao agregar eventos de download: {e}", exc_info=True)
+        stop_event.wait(Config.DOWNLOAD_ROLLUP_INTERVAL)
+
+def init_app(app):
+    """Inicia a agregação periódica dos eventos (DOWNLOAD_EVENTS_ENABLED)."""
+    if not Config.DOWNLOAD_EVENTS_ENABLED or Config.DOWNLOAD_ROLLUP_INTERVAL <= 0:
+        return
+    threading.Thread(target=_rollup_loop, args=(threading.Event(),), name='download-rollup', daemon=True).start()
@@ -0,0 +1,257 @@
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from config import Config
+from database import pooled_connection
+from cache import response_cache
+import stats_summary
+
+logger = logging.getLogger('api_jatoba.downloads')
+
+
+class DownloadCounter:
+    """Agregador write-behind dos incrementos de `arquivos.download_count`.
+
+    Os incrementos são somados em memória por arquivo e gravados em lote,
+    com um único `UPDATE ... CASE` por grupo de IDs, a cada `flush_interval`
+    segundos ou quando `flush_threshold` downloads ficam pendentes. Assim a
+    linha de um firmware popular recebe um UPDATE por intervalo, e não um
+    por download. Os contadores lidos do banco ficam atrasados no máximo
+    um intervalo.
+
+    Com `record_events`, os downloads também são contados por arquivo e por
+    segundo (UTC) e gravados em `eventos_download`, numa transação separada
+    da dos contadores: falhas no histórico não atrasam `download_count`. O
+    buffer do histórico guarda no máximo `max_event_buckets` pares
+    (arquivo, segundo); o excedente é descartado e contado em
+    `dropped_events`. download_analytics.py agrega esses eventos por hora e
+    por dia.
+    """
+
+    def __init__(self, flush_interval=5.0, flush_threshold=1000, batch_size=500, record_events=True,
+                 max_event_buckets=100000):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.batch_size = batch_size
+        self.record_events = record_events
+        self.max_event_buckets = max_event_buckets
+        self._events = {}  # (file_id, segundo UTC) -> downloads pendentes no histórico
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._pending_total = 0
+        # Incrementos retirados por um flush e ainda não confirmados no banco
+        self._in_flight = {}
+        # Ímpar enquanto um flush confirma os contadores; muda a cada confirmação (ver read_total)
+        self._generation = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.flushed_total = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.failed_event_flushes = 0
+        self.dropped_events = 0
+
+    def _ensure_started(self):
+        # O processo pode ter sido criado por fork (workers do gunicorn) depois da importação.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='download-counter', daemon=True)
+            self._thread.start()
+
+    def add(self, file_id, count=1):
+        """Registra downloads de um arquivo e retorna quantos estão pendentes para ele."""
+        self._ensure_started()
+        with self._lock:
+            pending = self._pending.get(file_id, 0) + count
+            self._pending[file_id] = pending
+            self._pending_total += count
+            if self.record_events:
+                second = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+                self._add_events_locked({(file_id, second): count})
+            if self._pending_total >= self.flush_threshold:
+                self._wakeup.set()
+        return pending
+
+    def _add_events_locked(self, events):
+        for key, count in events.items():
+            if key in self._events or len(self._events) < self.max_event_buckets:
+                self._events[key] = self._events.get(key, 0) + count
+            else:
+                self.dropped_events += count
+
+    def read_total(self, file_id, read_stored, attempts=3):
+        """Contagem atual de um arquivo: a gravada, lida por `read_stored()`, mais a não gravada deste processo.
+
+        Repete a leitura se um flush confirmou contadores enquanto ela era
+        feita (o valor gravado e o pendente seriam de momentos diferentes).
+        Após `attempts` tentativas, retorna a última soma, que pode estar
+        aproximada. Retorna None se `read_stored` retornar None.
+        """
+        for _ in range(attempts):
+            with self._lock:
+                before = self._generation
+            stored = read_stored()
+            if stored is None:
+                return None
+            with self._lock:
+                unflushed = self._pending.get(file_id, 0) + self._in_flight.get(file_id, 0)
+                if self._generation == before and before % 2 == 0:
+                    break
+        return stored + unflushed
+
+    def pending(self, file_id=None):
+        with self._lock:
+            if file_id is None:
+                return self._pending_total
+            return self._pending.get(file_id, 0)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Erro ao gravar contadores de download: {e}", exc_info=True)
+
+    def _settle(self, restore=None):
+        """Encerra a gravação dos contadores; `restore`: incrementos que falharam, devolvidos ao buffer."""
+        with self._lock:
+            for file_id, count in (restore or {}).items():
+                self._pending[file_id] = self._pending.get(file_id, 0) + count
+                self._pending_total += count
+            self._in_flight = {}
+            if self._generation % 2:
+                self._generation += 1
+
+    def flush(self):
+        """Grava os incrementos pendentes no banco. Retorna o número de downloads gravados."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending and not self._events:
+                    return 0
+                increments, events = self._pending, self._events
+                self._pending, self._events = {}, {}
+                self._pending_total = 0
+                self._in_flight = increments
+
+            try:
+                return self._flush_counters(increments) if increments else 0
+            finally:
+                # Independente do resultado dos contadores (e vice-versa)
+                if events:
+                    self._flush_events(events)
+
+    def _flush_counters(self, increments):
+        # IDs ordenados: processos diferentes travam as linhas na mesma ordem.
+        file_ids = sorted(increments)
+        applied = 0
+        try:
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for start in range(0, len(file_ids), self.batch_size):
+                        batch = file_ids[start:start + self.batch_size]
+                        cases = ' '.join(['WHEN %s THEN %s'] * len(batch))
+                        placeholders = ', '.join(['%s'] * len(batch))
+                        params = [value for file_id in batch for value in (file_id, increments[file_id])]
+                        cursor.execute(
+                            f"UPDATE arquivos SET download_count = download_count + CASE id {cases} ELSE 0 END "
+                            f"WHERE id IN ({placeholders})",
+                            params + batch
+                        )
+                        if cursor.rowcount == len(batch):
+                            applied += sum(increments[file_id] for file_id in batch)
+                        else:
+                            # Algum arquivo foi excluído: só conta os downloads dos que existem
+                            cursor.execute(f"SELECT id FROM arquivos WHERE id IN ({placeholders})", batch)
+                            applied += sum(increments[row['id']] for row in cursor.fetchall())
+                    stats_summary.adjust(cursor, {'downloads': applied})
+                    with self._lock:
+                        self._generation += 1
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except Exception:
+            self.failed_flushes += 1
+            self._settle(restore=increments)
+            raise
+        self._settle()
+
+        total = sum(increments.values())
+        self.flushed_total += total
+        self.flush_count += 1
+        response_cache.invalidate_items('files', file_ids)
+        logger.info(f"Gravados {total} downloads de {len(file_ids)} arquivos.")
+        return total
+
+    def _flush_events(self, events):
+        """Grava o histórico numa transação própria; em caso de erro, devolve ao buffer (limitado)."""
+        rows = sorted(events.items())
+        try:
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for start in range(0, len(rows), self.batch_size):
+                        # Log somente de inserção; as agregações ficam com download_analytics
+                        batch = rows[start:start + self.batch_size]
+                        cursor.execute(
+                            "INSERT INTO eventos_download (file_id, occurred_at, downloads) VALUES "
+                            + ', '.join(['(%s, %s, %s)'] * len(batch)),
+                            [value for (file_id, second), count in batch for value in (file_id, second, count)]
+                        )
+                    conn.commit()
+                finally:
+                    cursor.close()
+        except Exception as e:
+            self.failed_event_flushes += 1
+            with self._lock:
+                self._add_events_locked(events)
+            logger.error(f"Erro ao gravar o histórico de downloads ({len(rows)} pares arquivo/segundo "
+                         f"mantidos para a próxima tentativa): {e}", exc_info=True)
+
+    def stop(self):
+        """Interrompe a thread e grava o que estiver pendente (chamado no encerramento)."""
+        self._stopped.set()
+        self._wakeup.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Erro ao gravar contadores de download no encerramento: {e}", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_downloads': self._pending_total,
+                'pending_files': len(self._pending),
+                'flushed_downloads': self.flushed_total,
+                'flushes': self.flush_count,
+                'failed_flushes': self.failed_flushes,
+                'pending_event_buckets': len(self._events),
+                'failed_event_flushes': self.failed_event_flushes,
+                'dropped_events': self.dropped_events,
+                'flush_interval': self.flush_interval,
+                'flush_threshold': self.flush_threshold,
+            }
+
+
+download_counter = DownloadCounter(
+    flush_interval=Config.DOWNLOAD_FLUSH_INTERVAL,
+    flush_threshold=Config.DOWNLOAD_FLUSH_THRESHOLD,
+    batch_size=Config.DOWNLOAD_FLUSH_BATCH_SIZE,
+    record_events=Config.DOWNLOAD_EVENTS_ENABLED,
+    max_event_buckets=Config.DOWNLOAD_EVENTS_MAX_BUCKETS,
+)
+
+atexit.register(download_counter.stop)
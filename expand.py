@@ -0,0 +1,106 @@
+"""Recursos relacionados embutidos nas listagens (`?expand=`).
+
+`expand=manufacturer` em /equipments/ ou `expand=equipment.manufacturer` em
+/files/ inclui no próprio item o registro referenciado pelo id, evitando uma
+requisição do cliente por item. Cada relação é resolvida com uma única
+consulta `WHERE id IN (...)` para a página inteira, qualquer que seja o
+número de itens. Como as respostas passam a depender de outras tabelas, a
+chave de cache inclui as versões dos namespaces expandidos.
+"""
+from flask import request
+
+from config import Config
+
+# Tabela -> {relação: (coluna com o id, tabela relacionada)}
+RELATIONS = {
+    'equipamentos': {'manufacturer': ('manufacturer_id', 'fabricantes')},
+    'arquivos': {'equipment': ('equipment_id', 'equipamentos')},
+}
+
+# Colunas de cada tabela quando embutida em outro recurso
+COLUMNS = {
+    'fabricantes': "id, name, logo_url, created_at, updated_at",
+    'equipamentos': "id, name, model, manufacturer_id, image_url, created_at, updated_at",
+}
+
+# Namespace de cache de cada tabela (o mesmo usado nas invalidações das rotas)
+NAMESPACES = {
+    'fabricantes': 'manufacturers',
+    'equipamentos': 'equipments',
+    'arquivos': 'files',
+}
+
+
+class ExpandError(ValueError):
+    """Parâmetro `expand` inválido (deve resultar em HTTP 400)."""
+
+
+def parse_expand(args, table):
+    """Lê `expand` (caminhos separados por vírgula) e retorna a árvore de relações.
+
+    'equipment.manufacturer' -> {'equipment': {'manufacturer': {}}}. Retorna
+    {} se o parâmetro não foi informado.
+    """
+    tree = {}
+    for path in (args.get('expand') or '').split(','):
+        path = path.strip()
+        if not path:
+            continue
+        names = path.split('.')
+        if len(names) > Config.EXPAND_MAX_DEPTH:
+            raise ExpandError(f"'expand' aceita no máximo {Config.EXPAND_MAX_DEPTH} níveis ('{path}').")
+        node, current = tree, table
+        for name in names:
+            relation = RELATIONS.get(current, {}).get(name)
+            if relation is None:
+                accepted = ', '.join(RELATIONS.get(current, {})) or 'nenhuma'
+                raise ExpandError(f"Relação '{name}' inválida em 'expand' (aceitas: {accepted}).")
+            node = node.setdefault(name, {})
+            current = relation[1]
+    return tree
+
+def related_namespaces(table):
+    """Função para `response_cache.cached(related=...)`: namespaces expandidos na requisição atual."""
+    def namespaces():
+        try:
+            tree = parse_expand(request.args, table)
+        except ExpandError:
+            return []  # A view responde 400, que não é armazenado
+        found = []
+
+        def walk(node, current):
+            for name, children in node.items():
+                related = RELATIONS[current][name][1]
+                found.append(NAMESPACES[related])
+                walk(children, related)
+        walk(tree, table)
+        return sorted(set(found))
+    return namespaces
+
+def key_columns(table, tree):
+    """Colunas de `table` que precisam ser lidas para resolver as relações de `tree`."""
+    return tuple(RELATIONS[table][name][0] for name in tree)
+
+def apply_expand(cursor, table, rows, tree):
+    """Embute as relações de `tree` em `rows` (None se o registro não existe).
+
+    Faz uma consulta por relação expandida. Retorna todos os registros
+    embutidos, para compor os validadores (ETag/Last-Modified) da resposta.
+    """
+    embedded = []
+    for name, children in tree.items():
+        column, related = RELATIONS[table][name]
+        ids = sorted({row[column] for row in rows if row.get(column) is not None})
+        found = {}
+        if ids:
+            cursor.execute(
+                f"SELECT {COLUMNS[related]} FROM {related} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                ids
+            )
+            found = {row['id']: row for row in cursor.fetchall()}
+            embedded.extend(found.values())
+            if children:
+                embedded.extend(apply_expand(cursor, related, list(found.values()), children))
+        for row in rows:
+            row[name] = found.get(row.get(column))
+    return embedded
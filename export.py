@@ -0,0 +1,115 @@
+import csv
+import io
+import logging
+
+from flask import Response, current_app
+from pymysql import Error
+
+from config import Config
+from database import pool, TimedSSDictCursor
+
+logger = logging.getLogger('api_jatoba.export')
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+class ExportError(ValueError):
+    """Parâmetros de exportação inválidos (devem resultar em HTTP 400)."""
+
+
+def parse_export_format(args):
+    """Lê o parâmetro `format` (padrão: ndjson) e valida contra os formatos suportados."""
+    fmt = (args.get('format') or 'ndjson').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError("Formato de exportação inválido. Use 'ndjson' ou 'csv'.")
+    return fmt
+
+def _serialize_ndjson(rows, dumps):
+    return ''.join(dumps(row) + '\n' for row in rows)
+
+def _serialize_csv(rows, columns, buffer, writer):
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
+
+def stream_export(sql_query, params, columns, fmt, filename):
+    """Executa a query com um cursor não bufferizado e transmite as linhas na resposta.
+
+    A conexão é emprestada do pool só para a exportação (não é a conexão da
+    requisição) e devolvida quando a resposta é fechada pelo servidor WSGI,
+    mesmo que o corpo nunca seja lido (HEAD). Se a transmissão não chegar ao
+    fim (cliente desconectado, HEAD), a conexão é descartada em vez de drenar
+    o restante do resultado no servidor.
+    """
+    conn = pool.acquire()
+    try:
+        cursor = conn.cursor(TimedSSDictCursor)
+        if Config.EXPORT_NET_WRITE_TIMEOUT:
+            # Clientes lentos seguram o resultado no servidor; evita que o MariaDB aborte o envio.
+            cursor.execute("SET SESSION net_write_timeout = %s", (Config.EXPORT_NET_WRITE_TIMEOUT,))
+        cursor.execute(sql_query, params)
+    except Exception:
+        pool.discard(conn)
+        raise
+
+    dumps = current_app.json.dumps
+    batch_size = Config.EXPORT_BATCH_SIZE
+    state = {'completed': False, 'total': 0, 'closed': False}
+
+    def generate():
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            state['total'] += len(rows)
+            if fmt == 'csv':
+                yield _serialize_csv(rows, columns, buffer, writer)
+            else:
+                yield _serialize_ndjson(rows, dumps)
+        if fmt == 'csv':
+            yield _serialize_csv([], columns, buffer, writer)
+        state['completed'] = True
+        logger.info(f"Exportação '{filename}' concluída: {state['total']} linhas transmitidas.")
+
+    def close():
+        # Chamado pelo Response.close(), depois de fechar o gerador; uma vez só
+        if state['closed']:
+            return
+        state['closed'] = True
+        if state['completed']:
+            cursor.close()
+            if Config.EXPORT_NET_WRITE_TIMEOUT:
+                # A conexão volta ao pool: as próximas requisições não herdam o timeout da exportação
+                reset_cursor = conn.cursor()
+                try:
+                    reset_cursor.execute("SET SESSION net_write_timeout = DEFAULT")
+                except Error as e:
+                    logger.warning(f"Não foi possível restaurar net_write_timeout após a exportação: {e}")
+                    pool.discard(conn)
+                    return
+                finally:
+                    reset_cursor.close()
+            pool.release(conn)
+        else:
+            logger.warning(f"Exportação '{filename}' interrompida após {state['total']} linhas; conexão descartada.")
+            cursor.abandon()
+            pool.discard(conn)
+
+    extension = 'csv' if fmt == 'csv' else 'ndjson'
+    response = Response(
+        generate(),
+        content_type=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}.{extension}"'},
+    )
+    response.call_on_close(close)
+    return response
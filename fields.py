@@ -0,0 +1,45 @@
+"""Projeção de campos nas respostas GET (`?fields=id,name`).
+
+Os campos pedidos são validados contra as colunas que o endpoint já
+retorna e viram a lista do SELECT: colunas não pedidas (como as URLs)
+não são lidas, transferidas nem serializadas. As colunas que o servidor
+usa internamente (id para a paginação, updated_at para o ETag, chaves para
+o expand) são lidas mesmo sem terem sido pedidas e retiradas da resposta.
+"""
+
+
+class FieldsError(ValueError):
+    """Parâmetro `fields` inválido (deve resultar em HTTP 400)."""
+
+
+def parse_fields(args, allowed):
+    """Lê `fields` da query string. Retorna os campos pedidos ou None (todos)."""
+    raw_fields = args.get('fields')
+    if raw_fields is None:
+        return None
+    fields = list(dict.fromkeys(field.strip() for field in raw_fields.split(',') if field.strip()))
+    if not fields:
+        raise FieldsError("Parâmetro 'fields' vazio.")
+    invalid = [field for field in fields if field not in allowed]
+    if invalid:
+        raise FieldsError(f"Campos inválidos em 'fields': {', '.join(invalid)} (aceitos: {', '.join(allowed)}).")
+    return fields
+
+def select_columns(allowed, fields, required=()):
+    """Lista do SELECT: os campos pedidos mais os `required`, na ordem de `allowed`."""
+    if fields is None:
+        return ', '.join(allowed)
+    wanted = set(fields) | set(required)
+    return ', '.join(column for column in allowed if column in wanted)
+
+def project(rows, fields, keep=()):
+    """Retira das linhas (dicionários; None é ignorado) as colunas lidas só para uso interno."""
+    if fields is None:
+        return rows
+    wanted = set(fields) | set(keep)
+    for row in rows:
+        if row is None:
+            continue
+        for key in [key for key in row if key not in wanted]:
+            del row[key]
+    return rows
@@ -0,0 +1,190 @@
+import mimetypes
+import os
+import secrets
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+from config import Config
+from blob_store import repr_digest
+import metrics
+
+
+class _BoundedFile:
+    """Arquivo aberto limitado a um trecho, para o `wsgi.file_wrapper` do servidor.
+
+    Servidores como gunicorn e uWSGI usam `fileno()`, a posição atual e o
+    Content-Length para enviar o trecho com `sendfile` (cópia zero); os
+    demais leem via `read()`, que nunca passa do fim do trecho.
+    """
+
+    def __init__(self, fileobj, start, length):
+        fileobj.seek(start)
+        self._file = fileobj
+        self._remaining = length
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _content_disposition(download_name, disposition='attachment'):
+    try:
+        download_name.encode('ascii')
+        return f'{disposition}; filename="{download_name}"'
+    except UnicodeEncodeError:
+        fallback = download_name.encode('ascii', 'ignore').decode('ascii') or 'download'
+        return f'{disposition}; filename="{fallback}"; filename*=UTF-8\'\'{quote(download_name)}'
+
+def _resolve_ranges(size):
+    """Converte o cabeçalho Range em trechos [início, fim) satisfazíveis.
+
+    Retorna None quando a resposta deve ser o arquivo completo e [] quando
+    nenhum trecho pedido é satisfazível (416).
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes' or not rng.ranges:
+        return None
+    if len(rng.ranges) > Config.DOWNLOAD_MAX_RANGES:
+        return None
+    resolved = []
+    for begin, end in rng.ranges:
+        if begin < 0:
+            start, stop = max(0, size + begin), size
+        else:
+            start, stop = begin, size if end is None else min(end, size)
+        if start < stop:
+            resolved.append((start, stop))
+    return resolved
+
+def _if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if not if_range.etag and not if_range.date:
+        return True
+    if if_range.etag:
+        return if_range.etag == etag
+    return if_range.date is not None and last_modified <= if_range.date
+
+def _offload_response(file_path, download_name, mimetype, sha256=None, disposition='attachment'):
+    """Delega a transmissão ao proxy da frente (nginx ou Apache/lighttpd)."""
+    response = Response(status=200, mimetype=mimetype)
+    response.headers['Content-Disposition'] = _content_disposition(download_name, disposition)
+    if sha256:
+        response.headers['Repr-Digest'] = repr_digest(sha256)
+    if Config.FILE_OFFLOAD == 'x-accel-redirect':
+        relative = os.path.relpath(file_path, Config.UPLOAD_FOLDER).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = Config.FILE_OFFLOAD_INTERNAL_PREFIX.rstrip('/') + '/' + quote(relative)
+    else:
+        response.headers['X-Sendfile'] = file_path
+    return response
+
+def _is_offloadable(file_path):
+    if Config.FILE_OFFLOAD not in ('x-accel-redirect', 'x-sendfile'):
+        return False
+    upload_root = os.path.join(Config.UPLOAD_FOLDER, '')
+    return os.path.abspath(file_path).startswith(upload_root)
+
+def _multipart_ranges(file_path, ranges, size, mimetype, boundary):
+    """Gera o corpo multipart/byteranges lendo cada trecho com os.pread."""
+    buffer_size = Config.DOWNLOAD_BUFFER_SIZE
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        for start, stop in ranges:
+            yield (
+                f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+            ).encode('ascii')
+            offset = start
+            while offset < stop:
+                data = os.pread(fd, min(buffer_size, stop - offset), offset)
+                if not data:
+                    return
+                offset += len(data)
+                yield data
+        yield f"\r\n--{boundary}--\r\n".encode('ascii')
+    finally:
+        os.close(fd)
+
+def _multipart_length(ranges, size, mimetype, boundary):
+    total = 0
+    for start, stop in ranges:
+        total += len(
+            f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+        ) + (stop - start)
+    return total + len(f"\r\n--{boundary}--\r\n")
+
+def send_file_ranged(file_path, download_name, sha256=None, as_attachment=True):
+    """Responde com o arquivo, atendendo Range (um ou vários trechos), If-Range e If-None-Match.
+
+    Com `sha256` (arquivos no armazenamento por conteúdo), o hash é a ETag e
+    vai também em Repr-Digest, para o cliente verificar o download. Imagens
+    exibidas pelo cliente usam `as_attachment=False` (Content-Disposition inline).
+
+    Retorna (response, full_or_first_chunk): o segundo valor indica se a
+    resposta inclui o início do arquivo, para que o download seja contado
+    uma vez, e não a cada retomada.
+    """
+    stat = os.stat(file_path)
+    size = stat.st_size
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    disposition = 'attachment' if as_attachment else 'inline'
+
+    if _is_offloadable(file_path):
+        metrics.DOWNLOAD_BYTES.inc(size, mode='offload')
+        return _offload_response(file_path, download_name, mimetype, sha256, disposition), True
+
+    etag = sha256 or f"{stat.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+
+    if request.if_none_match and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response, False
+
+    ranges = _resolve_ranges(size) if _if_range_matches(etag, last_modified) else None
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': _content_disposition(download_name, disposition),
+    }
+    if sha256:
+        headers['Repr-Digest'] = repr_digest(sha256)
+
+    if ranges == []:
+        response = Response(status=416, headers=headers)
+        response.headers['Content-Range'] = f"bytes */{size}"
+        return response, False
+
+    if ranges is None or len(ranges) == 1:
+        start, stop = ranges[0] if ranges else (0, size)
+        body = wrap_file(request.environ, _BoundedFile(open(file_path, 'rb'), start, stop - start),
+                         Config.DOWNLOAD_BUFFER_SIZE)
+        response = Response(body, status=206 if ranges else 200, mimetype=mimetype,
+                            headers=headers, direct_passthrough=True)
+        response.content_length = stop - start
+        if ranges:
+            response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+    else:
+        boundary = secrets.token_hex(16)
+        response = Response(_multipart_ranges(file_path, ranges, size, mimetype, boundary), status=206,
+                            content_type=f"multipart/byteranges; boundary={boundary}",
+                            headers=headers, direct_passthrough=True)
+        response.content_length = _multipart_length(ranges, size, mimetype, boundary)
+        start = ranges[0][0]
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    metrics.DOWNLOAD_BYTES.inc(response.content_length, mode='direct')
+    return response, start == 0
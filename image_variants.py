@@ -0,0 +1,307 @@
+"""Variantes redimensionadas (miniatura, média e WebP) dos logos e imagens de equipamentos.
+
+Depois do upload, a geração é enfileirada num pool de threads; a requisição
+responde sem esperar. As variantes ficam ao lado do original
+(`<original>.<variante>.<ext>`) e são registradas em `logo_variants` /
+`image_variants` da linha, só se o original ainda for o mesmo.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, redirect, request
+from config import Config
+from database import pooled_connection
+from cache import response_cache
+from file_transfer import send_file_ranged
+import storage_layout
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow é opcional: sem ele as imagens são servidas só no tamanho original
+    Image = None
+
+logger = logging.getLogger('api_jatoba.images')
+
+# tipo -> (tabela, coluna do original, coluna das variantes, namespace do cache)
+TARGETS = {
+    'logo': ('fabricantes', 'logo_url', 'logo_variants', 'manufacturers'),
+    'image': ('equipamentos', 'image_url', 'image_variants', 'equipments'),
+}
+
+_VARIANT_SUFFIX = re.compile(r'^(?P<source>.+)\.(?P<name>[a-z]+)(?:-webp)?\.(?:jpg|png|webp)$')
+
+
+def _variant_sizes():
+    """Lê IMAGE_VARIANT_SIZES ('thumb:160,medium:640') em [(nome, lado_máximo)]."""
+    sizes = []
+    for item in Config.IMAGE_VARIANT_SIZES.split(','):
+        name, _, size = item.strip().partition(':')
+        if name and size.isdigit():
+            sizes.append((name, int(size)))
+    return sorted(sizes, key=lambda entry: entry[1])
+
+def variant_path(source_path, name, extension):
+    return f"{source_path}.{name}.{extension}"
+
+def source_of(path):
+    """Caminho do original de uma variante, ou None se `path` não for uma variante."""
+    match = _VARIANT_SUFFIX.match(path)
+    if match is None:
+        return None
+    if match.group('name') not in dict(_variant_sizes()):
+        return None
+    return match.group('source')
+
+def _save(image, path, fmt):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    options = {'quality': Config.IMAGE_VARIANT_QUALITY}
+    if fmt == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    elif fmt == 'WEBP':
+        options.update(method=4)
+    elif fmt == 'PNG':
+        options = {'optimize': True}
+    image.save(tmp_path, fmt, **options)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+def generate_variants(source_path):
+    """Gera as variantes de `source_path` e retorna {nome: metadados}.
+
+    Cada tamanho sai no formato da família do original (PNG se houver
+    transparência, JPEG caso contrário) e em WebP. Tamanhos maiores que o
+    original não são gerados: o próprio original já serve.
+    """
+    variants = {}
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        has_alpha = original.mode in ('RGBA', 'LA') or (original.mode == 'P' and 'transparency' in original.info)
+        base = original.convert('RGBA' if has_alpha else 'RGB')
+        for name, size in _variant_sizes():
+            if max(base.size) <= size:
+                continue
+            resized = base.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            outputs = [(name, 'PNG' if has_alpha else 'JPEG', 'png' if has_alpha else 'jpg')]
+            if Config.IMAGE_VARIANT_WEBP:
+                outputs.append((f"{name}-webp", 'WEBP', 'webp'))
+            for variant_name, fmt, extension in outputs:
+                path = variant_path(source_path, variant_name, extension)
+                variants[variant_name] = {
+                    'path': path,
+                    'width': resized.width,
+                    'height': resized.height,
+                    'format': fmt.lower(),
+                    'bytes': _save(resized, path, fmt),
+                }
+    return variants
+
+def _discard(variants):
+    for variant in variants.values():
+        storage_layout.remove_stored(variant['path'])
+
+def _record(kind, row_id, source_path, variants):
+    """Grava as variantes na linha se o original ainda for `source_path`."""
+    table, column, variants_column, cache_namespace = TARGETS[kind]
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"UPDATE {table} SET {variants_column} = %s WHERE id = %s AND {column} = %s",
+                (json.dumps(variants), row_id, source_path)
+            )
+            conn.commit()
+            updated = cursor.rowcount > 0
+        finally:
+            cursor.close()
+    if updated:
+        response_cache.invalidate(cache_namespace, row_id)
+    return updated
+
+def process(kind, row_id, source_path):
+    """Gera e registra as variantes de uma imagem (executado no pool)."""
+    try:
+        variants = generate_variants(source_path)
+    except Exception as e:
+        logger.warning(f"Não foi possível gerar variantes de '{source_path}' ({kind} {row_id}): {e}")
+        return None
+    try:
+        if not _record(kind, row_id, source_path, variants):
+            # A imagem foi trocada ou o registro excluído enquanto as variantes eram geradas
+            _discard(variants)
+            logger.info(f"Variantes de '{source_path}' descartadas: {kind} {row_id} mudou.")
+            return None
+    except Exception:
+        _discard(variants)
+        raise
+    logger.info(f"{len(variants)} variantes geradas para {kind} {row_id}.")
+    return variants
+
+
+class VariantWorkerPool:
+    """Pool de threads para a geração das variantes, criado sob demanda em cada processo."""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.submitted = 0
+        self.failed = 0
+
+    def _get_executor(self):
+        # Executores não sobrevivem ao fork dos workers do gunicorn: recria no processo filho
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-variants')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, kind, row_id, source_path):
+        try:
+            process(kind, row_id, source_path)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.error(f"Erro ao processar variantes de {kind} {row_id}: {e}", exc_info=True)
+
+    def submit(self, kind, row_id, source_path):
+        """Enfileira a geração das variantes; não bloqueia a requisição."""
+        if Image is None or not Config.IMAGE_VARIANTS_ENABLED:
+            return False
+        self._get_executor().submit(self._run, kind, row_id, source_path)
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': Image is not None and Config.IMAGE_VARIANTS_ENABLED,
+                    'workers': self.workers, 'submitted': self.submitted, 'failed': self.failed}
+
+
+variant_pool = VariantWorkerPool(workers=Config.IMAGE_VARIANT_WORKERS)
+
+
+def requeue(kind, row_id, source_path):
+    """Enfileira as variantes de um original trocado pela URL (PUT, importação em lote).
+
+    Só para arquivos guardados pela API; URLs externas não têm variantes.
+    """
+    if not source_path or not storage_layout.is_managed(source_path) or not os.path.isfile(source_path):
+        return False
+    return variant_pool.submit(kind, row_id, source_path)
+
+
+def parse_variants(value):
+    if not value:
+        return {}
+    if isinstance(value, (bytes, str)):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return {}
+    return value
+
+def pick(source_path, variants, size=None, webp=False):
+    """Escolhe o arquivo a servir: a menor variante com lado >= `size`.
+
+    Sem `size`, ou se nenhuma variante for grande o bastante, serve o
+    original. Com `webp` (cliente aceita WebP), prefere as variantes WebP;
+    sem ele, nunca as escolhe.
+    """
+    if size is None:
+        return source_path
+    fitting = [variant for variant in variants.values() if max(variant['width'], variant['height']) >= size]
+    preferred = [variant for variant in fitting if variant['format'] == 'webp'] if webp else []
+    candidates = preferred or [variant for variant in fitting if variant['format'] != 'webp']
+    if not candidates:
+        return source_path
+    return min(candidates, key=lambda variant: (max(variant['width'], variant['height']), variant['bytes']))['path']
+
+def public_variants(value):
+    """Variantes para a resposta JSON, sem os caminhos internos."""
+    return {name: {key: item for key, item in variant.items() if key != 'path'}
+            for name, variant in parse_variants(value).items()}
+
+def remove_all(source_path, variants_value):
+    """Remove o original e as variantes de um registro excluído."""
+    removed = storage_layout.remove_stored(source_path)
+    for variant in parse_variants(variants_value).values():
+        storage_layout.remove_stored(variant['path'])
+    return removed
+
+def parse_size(args):
+    """Lê `?size=` (lado mínimo desejado, em pixels); lança ValueError se inválido."""
+    size = args.get('size')
+    if size is None or size == '':
+        return None
+    if not size.isdigit() or int(size) <= 0:
+        raise ValueError("'size' deve ser um inteiro positivo (pixels)")
+    return int(size)
+
+def serve(source_path, variants_value, size=None):
+    """Resposta de GET .../logo e .../image, com negociação de WebP pelo Accept."""
+    if source_path.startswith(('http://', 'https://')):
+        # Imagens hospedadas fora da API (dados antigos): o cliente busca na origem
+        return redirect(source_path)
+    webp = request.args.get('format') == 'webp' or 'image/webp' in request.accept_mimetypes.values()
+    path = pick(source_path, parse_variants(variants_value), size, webp)
+    if not storage_layout.is_managed(path) or not os.path.isfile(path):
+        return jsonify({"message": "Arquivo de imagem não encontrado no servidor"}), 404
+    response, _ = send_file_ranged(path, os.path.basename(path), as_attachment=False)
+    response.vary.add('Accept')
+    return response
+
+
+def backfill(kinds=tuple(TARGETS), batch_size=200):
+    """Gera as variantes das imagens que ainda não as têm (execução síncrona)."""
+    total = 0
+    for kind in kinds:
+        table, column, variants_column, _ = TARGETS[kind]
+        after_id = 0
+        while True:
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(
+                        f"SELECT id, {column} AS url FROM {table} "
+                        f"WHERE id > %s AND {column} IS NOT NULL AND {variants_column} IS NULL ORDER BY id LIMIT %s",
+                        (after_id, batch_size)
+                    )
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+            for row in rows:
+                if storage_layout.is_managed(row['url']) and os.path.isfile(row['url']):
+                    if process(kind, row['id'], row['url']) is not None:
+                        total += 1
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gera variantes para logos e imagens já enviados.")
+    parser.add_argument('--only', choices=sorted(TARGETS), default=None)
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    from logger import app_logger  # Configura os handlers de log
+    if Image is None:
+        print("Pillow não está instalado (pip install Pillow).", file=sys.stderr)
+        return 1
+    total = backfill((args.only,) if args.only else tuple(TARGETS), args.batch_size)
+    logger.info(f"Variantes geradas para {total} imagens.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""Serialização JSON das respostas (app.json).
+
+Usa o orjson quando instalado (`pip install orjson`), várias vezes mais
+rápido que o `json` da biblioteca padrão nas listagens de dicionários do
+DictCursor, e volta ao `json` sem ele ou para valores que o orjson não
+aceita (inteiros acima de 64 bits, por exemplo). Os dois caminhos geram o
+mesmo JSON: UTF-8 sem escapes, chaves ordenadas e datas no formato de
+JSON_DATETIME_FORMAT.
+
+    http  'Thu, 01 Jan 2026 00:00:00 GMT', como o jsonify do Flask (padrão)
+    iso   '2026-01-01T00:00:00+00:00', serializado nativamente pelo orjson
+
+O tempo gasto entra no componente `serialize` do log de acesso. Arrays
+grandes podem ser enviados em partes (`stream`), sem montar o corpo
+inteiro em memória.
+"""
+import time
+from datetime import date, datetime, timezone
+from itertools import islice
+
+from flask import current_app, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+from access_log import add_timing
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional: sem ele usa o json da biblioteca padrão
+    orjson = None
+
+DATETIME_FORMATS = ('http', 'iso')
+
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _http_default(o):
+    """Como o `default` do Flask, mas formata as datas sem passar pelo email.utils (bem mais lento)."""
+    if isinstance(o, date):
+        if not isinstance(o, datetime):
+            o = datetime(o.year, o.month, o.day)
+        elif o.tzinfo is not None:
+            o = o.astimezone(timezone.utc)
+        return (f"{_DAYS[o.weekday()]}, {o.day:02d} {_MONTHS[o.month - 1]} {o.year:04d} "
+                f"{o.hour:02d}:{o.minute:02d}:{o.second:02d} GMT")
+    return DefaultJSONProvider.default(o)
+
+def _iso_default(o):
+    if isinstance(o, datetime):
+        # Os TIMESTAMPs vêm do PyMySQL sem fuso; como no formato http, são tratados como UTC
+        return (o if o.tzinfo else o.replace(tzinfo=timezone.utc)).isoformat()
+    if isinstance(o, date):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Provider JSON do Flask com o orjson como caminho rápido."""
+
+    ensure_ascii = False  # Como o orjson; menor que os escapes \uXXXX
+
+    def __init__(self, app, datetime_format='http'):
+        super().__init__(app)
+        if datetime_format not in DATETIME_FORMATS:
+            raise ValueError(f"JSON_DATETIME_FORMAT inválido: {datetime_format!r} (use 'http' ou 'iso').")
+        self.datetime_format = datetime_format
+        self.default = _iso_default if datetime_format == 'iso' else _http_default
+
+    @property
+    def backend(self):
+        return 'orjson' if orjson is not None else 'json'
+
+    def _orjson_option(self, indent):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.datetime_format == 'iso':
+            option |= orjson.OPT_NAIVE_UTC
+        else:
+            # Datas vão para self.default, que gera o formato http do Flask
+            option |= orjson.OPT_PASSTHROUGH_DATETIME
+        return option
+
+    def dump_bytes(self, obj, indent=False):
+        """Serializa `obj` em bytes UTF-8 (o corpo das respostas)."""
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._orjson_option(indent))
+            except orjson.JSONEncodeError:
+                pass  # Tipo ou valor fora do suporte do orjson: o json decide (ou falha igual ao jsonify)
+        if indent:
+            return super().dumps(obj, indent=2).encode('utf-8')
+        return super().dumps(obj, separators=(',', ':')).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            if orjson is not None and set(kwargs) <= {'indent', 'separators'}:
+                return self.dump_bytes(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_timing('serialize', time.perf_counter() - start)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            try:
+                return orjson.loads(s)
+            except orjson.JSONDecodeError:
+                pass  # Deixa o json levantar o erro com a mensagem habitual
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        start = time.perf_counter()
+        try:
+            body = self.dump_bytes(obj, indent=indent)
+        finally:
+            add_timing('serialize', time.perf_counter() - start)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+    def stream(self, head, items, key='items', chunk_size=500):
+        """Resposta com `{**head, key: items}` gerada em partes de `chunk_size` itens.
+
+        `items` pode ser qualquer iterável (inclusive um gerador). O campo
+        `key` vem depois dos demais, fora da ordenação das chaves.
+        """
+        def generate():
+            opening = self.dump_bytes(head)[:-1]
+            yield opening + (b',' if head else b'') + self.dump_bytes(key) + b':['
+            iterator = iter(items)
+            first = True
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                start = time.perf_counter()
+                data = self.dump_bytes(chunk)[1:-1]
+                add_timing('serialize', time.perf_counter() - start)
+                yield data if first else b',' + data
+                first = False
+            yield b']}\n'
+
+        return self._app.response_class(stream_with_context(generate()), mimetype=self.mimetype)
+
+
+def jsonify_large(body, key):
+    """jsonify de `body`, enviado em partes se `body[key]` tiver JSON_STREAM_MIN_ITEMS itens ou mais."""
+    items = body[key]
+    if Config.JSON_STREAM_MIN_ITEMS <= 0 or len(items) < Config.JSON_STREAM_MIN_ITEMS:
+        return jsonify(body)
+    head = {name: value for name, value in body.items() if name != key}
+    return current_app.json.stream(head, items, key)
+
+
+def init_app(app):
+    """Substitui o provider JSON padrão do Flask (JSON_DATETIME_FORMAT define o formato das datas)."""
+    app.json = JSONProvider(app, datetime_format=Config.JSON_DATETIME_FORMAT)
@@ -1,27 +1,196 @@
+import atexit
+import gzip
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import shutil
+import threading
+import time
+from flask import g, has_request_context
 from config import Config
 
-def setup_logging():
-    # Cria o diretório para o log se não existir (se LOG_FILE incluir subdiretórios)
-    log_dir = os.path.dirname(Config.LOG_FILE)
+# Loggers das mensagens repetidas a cada requisição/conexão, sujeitas a amostragem
+SAMPLED_LOGGERS = ('api_jatoba.requests', 'api_jatoba.database')
+
+
+class SamplingFilter(logging.Filter):
+    """Amostra e limita as mensagens de alta frequência; WARNING ou acima sempre passam.
+
+    Cada mensagem dos loggers em `loggers` é mantida com probabilidade
+    `rate` e, depois disso, até `per_second` mensagens por segundo
+    (0 = sem limite). Os descartes são contados e informados na próxima
+    mensagem mantida.
+    """
+
+    def __init__(self, loggers=SAMPLED_LOGGERS, rate=1.0, per_second=0):
+        super().__init__()
+        self.prefixes = tuple(loggers)
+        self.rate = rate
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._window = 0
+        self._window_count = 0
+        self.dropped = 0
+
+    def _sampled(self, name):
+        return any(name == prefix or name.startswith(prefix + '.') for prefix in self.prefixes)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self._sampled(record.name):
+            return True
+        if self.rate < 1.0 and random.random() >= self.rate:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            if self.per_second:
+                window = int(time.monotonic())
+                if window != self._window:
+                    self._window, self._window_count = window, 0
+                if self._window_count >= self.per_second:
+                    self.dropped += 1
+                    return False
+                self._window_count += 1
+            if self.dropped:
+                record.msg = f"{record.msg} [{self.dropped} mensagens semelhantes omitidas]"
+                self.dropped = 0
+        return True
+
+
+class RequestIdFilter(logging.Filter):
+    """Inclui em cada registro o `request_id` da requisição em andamento ('-' fora dela)."""
+
+    def filter(self, record):
+        record.request_id = (g.get('request_id') if has_request_context() else None) or '-'
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Entrega os registros à thread de escrita sem bloquear quem loga.
+
+    Com a fila cheia, mensagens abaixo de ERROR são descartadas (e contadas);
+    erros esperam até `error_timeout` segundos por espaço. A thread de escrita
+    é recriada no processo filho quando há fork (workers do gunicorn).
+    """
+
+    def __init__(self, handlers, maxsize=10000, error_timeout=1.0):
+        super().__init__(queue.Queue(maxsize))
+        self.target_handlers = handlers
+        self.maxsize = maxsize
+        self.error_timeout = error_timeout
+        self.listener = None
+        self.dropped = 0
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self.listener is not None and self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Processo filho: a fila e a thread herdadas do pai não servem mais
+                self.queue = queue.Queue(self.maxsize)
+            self.listener = logging.handlers.QueueListener(self.queue, *self.target_handlers,
+                                                           respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        with self._start_lock:
+            if self.listener is not None and self._pid == os.getpid():
+                self.listener.stop()
+                self.listener = None
+
+    def enqueue(self, record):
+        if record.levelno >= logging.ERROR:
+            try:
+                self.queue.put(record, timeout=self.error_timeout)
+                return
+            except queue.Full:
+                pass
+        else:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                pass
+        with self._start_lock:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        super().emit(record)
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+def _gzip_rotator(source, dest):
+    # Executado na thread de escrita: não atrasa as requisições
+    with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+def _file_handler(path):
+    """Arquivo de log com rotação por horário (LOG_ROTATE_WHEN) ou por tamanho (LOG_MAX_BYTES)."""
+    log_dir = os.path.dirname(path)
     if log_dir and not os.path.exists(log_dir):
         os.makedirs(log_dir)
+    if Config.LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=Config.LOG_ROTATE_WHEN, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+    elif Config.LOG_MAX_BYTES:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+    else:
+        return logging.FileHandler(path, encoding='utf-8')
+    if Config.LOG_COMPRESS:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+def _setup_access_log():
+    """Log de acesso (access_log.py): linhas JSON em arquivo próprio, fora do log da aplicação."""
+    handler = _file_handler(Config.ACCESS_LOG_FILE)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    queue_handler = NonBlockingQueueHandler([handler], maxsize=Config.LOG_QUEUE_SIZE)
+    queue_handler.start()
+    atexit.register(queue_handler.stop)
+    access_logger = logging.getLogger('api_jatoba.access')
+    access_logger.addHandler(queue_handler)
+    access_logger.setLevel(logging.INFO)
+    access_logger.propagate = False
+
+def setup_logging():
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s') # Formato da mensagem
+    handlers = [
+        _file_handler(Config.LOG_FILE), # Salva logs em arquivo
+        logging.StreamHandler() # Exibe logs no console
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # O logger raiz só enfileira; a escrita em arquivo/console fica numa thread própria
+    queue_handler = NonBlockingQueueHandler(handlers, maxsize=Config.LOG_QUEUE_SIZE)
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(rate=Config.LOG_SAMPLE_RATE, per_second=Config.LOG_RATE_LIMIT))
+    queue_handler.start()
+    atexit.register(queue_handler.stop) # Esvazia a fila no encerramento
 
-    # Configura o logger raiz
     logging.basicConfig(
         level=getattr(logging, Config.LOG_LEVEL), # Define o nível do log (INFO, DEBUG, ERROR, etc.)
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', # Formato da mensagem
-        handlers=[
-            logging.FileHandler(Config.LOG_FILE, encoding='utf-8'), # Salva logs em arquivo
-            logging.StreamHandler() # Exibe logs no console
-        ]
+        handlers=[queue_handler]
     )
     # Define o nível do logger do PyMySQL para evitar logs excessivos de debug da biblioteca
     logging.getLogger('pymysql').setLevel(logging.WARNING)
     logging.getLogger('werkzeug').setLevel(logging.WARNING) # Evita logs excessivos do servidor Flask
+    if Config.ACCESS_LOG_ENABLED:
+        _setup_access_log()
 
     return logging.getLogger('api_jatoba') # Retorna um logger específico para nossa API
 
 # Inicializa o logger para a aplicação
-app_logger = setup_logging()
\ No newline at end of file
+app_logger = setup_logging()
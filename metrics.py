@@ -0,0 +1,337 @@
+"""Métricas no formato de texto do Prometheus, expostas em GET /metrics.
+
+Os valores são somados sem lock no caminho da requisição: cada thread grava
+no seu próprio dicionário e a coleta soma todos eles. Com vários processos
+(workers do gunicorn), cada um grava periodicamente um retrato em
+METRICS_DIR/<pid>.json e o /metrics soma os arquivos; contadores de
+processos encerrados continuam somados, os gauges deles não. Esvazie
+METRICS_DIR a cada reinício do servidor.
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, g, request
+
+from config import Config
+
+logger = logging.getLogger('api_jatoba.metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels.get(label, '')) for label in self.labelnames))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.shard()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge somado entre threads e processos vivos (ex.: requisições em andamento)."""
+
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.shard()
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        values = self.registry.shard()
+        key = self._key(labels)
+        # [contagem por bucket (não acumulada) ..., +Inf, soma]
+        state = values.get(key)
+        if state is None:
+            state = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        state[index] += 1
+        state[-1] += value
+
+
+def _merge(target, source):
+    for key, value in source.items():
+        current = target.get(key)
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            target[key] = [a + b for a, b in zip(current, value)]
+        else:
+            target[key] = current + value
+
+
+class MetricsRegistry:
+    """Métricas do processo; os valores ficam em um dicionário por thread."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []  # (thread, valores)
+        self._retired = {}  # valores de threads já encerradas
+        self._pid = os.getpid()
+        self._writer = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def _reset_after_fork(self):
+        # Processo filho: os valores herdados são do pai, que os publica por conta própria
+        with self._lock:
+            if self._pid != os.getpid():
+                self._shards = []
+                self._retired = {}
+                self._writer = None
+                self._pid = os.getpid()
+
+    def shard(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            if self._pid != os.getpid():
+                self._reset_after_fork()
+            local.values = {}
+            local.pid = os.getpid()
+            with self._lock:
+                self._shards.append((threading.current_thread(), local.values))
+                if len(self._shards) % 256 == 0:
+                    self._fold_finished_locked()
+            self._ensure_writer()
+        return local.values
+
+    def _fold_finished_locked(self):
+        # Threads encerradas (ex.: uma por requisição no servidor de desenvolvimento) viram um só total
+        alive = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+            else:
+                _merge(self._retired, values.copy())
+        self._shards = alive
+
+    def collect(self):
+        """Soma os valores de todas as threads deste processo."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        totals = {}
+        with self._lock:
+            self._fold_finished_locked()
+            _merge(totals, self._retired)
+            shards = [values for _, values in self._shards]
+        for values in shards:
+            _merge(totals, values.copy())
+        return totals
+
+    # --- Vários processos -------------------------------------------------
+
+    def _snapshot_path(self, pid):
+        return os.path.join(Config.METRICS_DIR, f"{pid}.json")
+
+    def write_snapshot(self):
+        if not Config.METRICS_DIR:
+            return
+        os.makedirs(Config.METRICS_DIR, exist_ok=True)
+        data = {'pid': os.getpid(), 'values': [[name, list(labels), value]
+                                               for (name, labels), value in self.collect().items()]}
+        path = self._snapshot_path(os.getpid())
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as snapshot:
+            json.dump(data, snapshot)
+        os.replace(tmp_path, path)
+
+    def _ensure_writer(self):
+        if not Config.METRICS_DIR or self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is not None:
+                return
+            self._writer = threading.Thread(target=self._write_loop, name='metrics-writer', daemon=True)
+            self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.warning(f"Não foi possível gravar o retrato das métricas: {e}")
+
+    @staticmethod
+    def _pid_alive(pid):
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def collect_all(self):
+        """Soma deste processo com os retratos dos demais (METRICS_DIR)."""
+        totals = self.collect()
+        if not Config.METRICS_DIR or not os.path.isdir(Config.METRICS_DIR):
+            return totals
+        for entry in os.scandir(Config.METRICS_DIR):
+            if not entry.name.endswith('.json') or entry.name == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as snapshot:
+                    data = json.load(snapshot)
+            except (OSError, ValueError):
+                continue
+            alive = self._pid_alive(data.get('pid', 0))
+            values = {}
+            for name, labels, value in data['values']:
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                values[(name, tuple(labels))] = value
+            _merge(totals, values)
+        return totals
+
+    # --- Exposição --------------------------------------------------------
+
+    def render(self):
+        totals = self.collect_all()
+        by_metric = {}
+        for (name, labels), value in totals.items():
+            by_metric.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_metric.get(name, [])):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+_SQL_TARGET = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)`?', re.IGNORECASE)
+
+@lru_cache(maxsize=2048)
+def query_name(sql):
+    """Nome estável de uma query para os rótulos: '<comando>_<tabela>' (ex.: 'select_arquivos')."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    words = sql.lstrip(' (\n\t').split(None, 1)
+    if not words:
+        return 'unknown'
+    verb = words[0].lower()
+    match = _SQL_TARGET.search(sql)
+    return f"{verb}_{match.group(1).lower()}" if match else verb
+
+
+registry = MetricsRegistry()
+
+REQUESTS = Counter(registry, 'http_requests_total', "Requisições atendidas.", ('endpoint', 'method', 'status'))
+REQUEST_LATENCY = Histogram(registry, 'http_request_duration_seconds', "Duração das requisições (até o envio do corpo).",
+                            ('endpoint', 'method'))
+IN_FLIGHT = Gauge(registry, 'http_requests_in_flight', "Requisições em andamento.")
+DB_ACQUIRE = Histogram(registry, 'db_connection_acquire_seconds', "Tempo para obter uma conexão do pool.",
+                       buckets=QUERY_BUCKETS)
+DB_QUERY = Histogram(registry, 'db_query_duration_seconds', "Duração das queries por nome.", ('query',),
+                     buckets=QUERY_BUCKETS)
+DB_ROWS = Counter(registry, 'db_query_rows_total', "Linhas lidas ou afetadas por query.", ('query',))
+DB_SLOW_QUERIES = Counter(registry, 'db_slow_queries_total', "Queries acima de SLOW_QUERY_THRESHOLD_MS.", ('query',))
+UPLOAD_BYTES = Counter(registry, 'upload_bytes_total', "Bytes recebidos em uploads.", ('kind',))
+DOWNLOAD_BYTES = Counter(registry, 'download_bytes_total', "Bytes de arquivos servidos.", ('mode',))
+
+
+def observe_query(sql, seconds, rows=0):
+    name = query_name(sql)
+    DB_QUERY.observe(seconds, query=name)
+    if rows:
+        DB_ROWS.inc(rows, query=name)
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    IN_FLIGHT.inc()
+
+def _finish_request(response):
+    started = g.get('metrics_started')
+    if started is None:
+        # Outro before_request respondeu antes deste: a requisição não foi contada como em andamento
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    method, status = request.method, response.status_code
+
+    def record():
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=method)
+        REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+        IN_FLIGHT.dec()
+
+    response.call_on_close(record)
+    return response
+
+def metrics_view():
+    return Response(registry.render(), mimetype='text/plain', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def init_app(app):
+    """Registra a coleta por requisição e o endpoint GET /metrics (METRICS_ENABLED)."""
+    if not Config.METRICS_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+
+
+atexit.register(lambda: registry.write_snapshot() if Config.METRICS_DIR else None)
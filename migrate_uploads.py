@@ -0,0 +1,303 @@
+"""Migra os uploads do layout plano (tudo na raiz de UPLOAD_FOLDER) para o layout atual.
+
+Uso:
+    python migrate_uploads.py [--only logos,images,files] [--batch-size 200] [--workers 4]
+                              [--start-after ID] [--dry-run]
+
+- logos/imagens vão para <namespace>/<ab>/<cd>/<nome> segundo STORAGE_LAYOUT;
+- arquivos sem sha256 entram no armazenamento por conteúdo (BLOB_FOLDER), com deduplicação.
+
+Pode rodar com a API no ar: cada arquivo ganha primeiro um hard link no
+destino, a URL é trocada no banco em lotes (só se ainda for a mesma, para
+não sobrescrever uploads feitos durante a migração) e o caminho antigo só é
+removido depois do commit, quando nenhuma linha o referencia mais (várias
+linhas podem apontar para o mesmo arquivo). Interromper e executar de novo
+é seguro: linhas já migradas não são mais selecionadas e links deixados por
+uma execução interrompida são reaproveitados.
+"""
+import argparse
+import errno
+import logging
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import Config
+from logger import app_logger  # Configura os handlers de log
+from database import pooled_connection
+from cache import response_cache
+from search_engine import escape_like
+import blob_store
+import storage_layout
+
+logger = logging.getLogger('api_jatoba.migrate')
+
+# tipo -> (tabela, coluna da URL, namespace de armazenamento, namespace do cache)
+TARGETS = {
+    'logos': ('fabricantes', 'logo_url', 'logos', 'manufacturers'),
+    'images': ('equipamentos', 'image_url', 'images', 'equipments'),
+    'files': ('arquivos', 'file_url', None, 'files'),
+}
+
+
+class MigrationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'migrated': 0, 'deduplicated': 0, 'missing': 0, 'changed': 0, 'failed': 0}
+        self.last_id = {}
+
+    def add(self, name, count=1):
+        with self._lock:
+            self.counters[name] += count
+
+    def batch_done(self, kind, last_id):
+        with self._lock:
+            self.last_id[kind] = max(self.last_id.get(kind, 0), last_id)
+
+
+def _place(source, target):
+    """Cria `target` com o conteúdo de `source` sem invalidar o original.
+
+    Usa hard link (instantâneo, mesmo inode); entre sistemas de arquivos
+    diferentes, copia para um temporário e renomeia. Retorna True se o
+    destino foi criado agora, False se já era o mesmo arquivo.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+        return True
+    except FileExistsError:
+        if os.path.samefile(source, target):
+            return False
+        raise
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.ENOTSUP):
+            raise
+    tmp_path = f"{target}.{os.getpid()}.tmp"
+    shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+    return True
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _plan_rows(kind, rows, stats):
+    """Define a origem e o destino de cada linha, fora de qualquer transação.
+
+    Para arquivos isso inclui calcular o SHA-256, de modo que os bloqueios
+    no banco durem só as trocas de URL.
+    """
+    _, _, namespace, _ = TARGETS[kind]
+    plan = []
+    hashes = {}  # linhas que compartilham o arquivo leem o conteúdo uma vez só
+    for row in rows:
+        source = row['url']
+        try:
+            if kind == 'files':
+                if not os.path.isfile(source):
+                    stats.add('missing')
+                    logger.warning(f"[{kind}] ID {row['id']}: arquivo '{source}' não encontrado; mantido como está.")
+                    continue
+                if source not in hashes:
+                    hashes[source] = blob_store.hash_file(source)
+                sha256, size = hashes[source]
+                plan.append({'id': row['id'], 'source': source, 'target': blob_store.blob_path(sha256),
+                             'sha256': sha256, 'size': size})
+            else:
+                target = storage_layout.storage_path(namespace, os.path.basename(source))
+                if os.path.abspath(source) == target:
+                    continue
+                # Uma execução anterior pode ter movido o arquivo e caído antes do commit
+                if not os.path.isfile(source) and not os.path.isfile(target):
+                    stats.add('missing')
+                    logger.warning(f"[{kind}] ID {row['id']}: arquivo '{source}' não encontrado; mantido como está.")
+                    continue
+                plan.append({'id': row['id'], 'source': source, 'target': target})
+        except OSError as e:
+            stats.add('failed')
+            logger.error(f"[{kind}] ID {row['id']}: erro ao ler '{source}': {e}")
+    if kind == 'files':
+        # Mesma ordem de bloqueio das linhas de blobs em todos os workers
+        plan.sort(key=lambda item: item['sha256'])
+    return plan
+
+def _unreferenced(cursor, kind, sources):
+    """Dos caminhos antigos, retorna os que nenhuma linha da tabela ainda usa."""
+    table, column, _, _ = TARGETS[kind]
+    sources = list(sources)
+    placeholders = ', '.join(['%s'] * len(sources))
+    cursor.execute(f"SELECT DISTINCT {column} AS url FROM {table} WHERE {column} IN ({placeholders})", sources)
+    referenced = {row['url'] for row in cursor.fetchall()}
+    return [source for source in sources if source not in referenced]
+
+def _migrate_row(cursor, kind, item, stats):
+    """Move uma linha dentro da transação do lote. Retorna True se a URL foi trocada."""
+    table, column, _, _ = TARGETS[kind]
+    source, target = item['source'], item['target']
+    created = False
+    cursor.execute("SAVEPOINT migrate_row")
+    try:
+        if kind == 'files':
+            cursor.execute(
+                "INSERT INTO blobs (sha256, size, ref_count) VALUES (%s, %s, 1) "
+                "ON DUPLICATE KEY UPDATE ref_count = ref_count + 1",
+                (item['sha256'], item['size'])
+            )
+            if os.path.isfile(target):
+                stats.add('deduplicated')
+            else:
+                created = _place(source, target)
+            cursor.execute(
+                "UPDATE arquivos SET file_url = %s, sha256 = %s, file_size = %s "
+                "WHERE id = %s AND file_url = %s AND sha256 IS NULL",
+                (target, item['sha256'], item['size'], item['id'], source)
+            )
+        else:
+            if os.path.isfile(source):
+                created = _place(source, target)
+            cursor.execute(
+                f"UPDATE {table} SET {column} = %s WHERE id = %s AND {column} = %s",
+                (target, item['id'], source)
+            )
+        if cursor.rowcount == 0:
+            # A linha mudou desde a leitura (upload ou edição pela API): mantém a versão nova
+            cursor.execute("ROLLBACK TO SAVEPOINT migrate_row")
+            if created:
+                _discard(target)
+            stats.add('changed')
+            return False
+        item['created'] = created
+        return True
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT migrate_row")
+        if created:
+            _discard(target)
+        raise
+
+def migrate_batch(kind, rows, dry_run, stats):
+    plan = _plan_rows(kind, rows, stats)
+    if dry_run or not plan:
+        stats.add('migrated', len(plan))
+        return
+    _, _, _, cache_namespace = TARGETS[kind]
+    migrated = []
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for item in plan:
+                try:
+                    if _migrate_row(cursor, kind, item, stats):
+                        migrated.append(item)
+                except OSError as e:
+                    stats.add('failed')
+                    logger.error(f"[{kind}] ID {item['id']}: erro ao copiar '{item['source']}' para '{item['target']}': {e}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            for item in migrated:
+                if item['created']:
+                    _discard(item['target'])
+            raise
+        finally:
+            cursor.close()
+        if not migrated:
+            return
+
+        # O caminho antigo só sai depois que o banco aponta para o novo e se
+        # nenhuma outra linha (deste lote ou de outro worker) ainda o usa
+        sources = {item['source'] for item in migrated if item['source'] != item['target']}
+        stale = []
+        if sources:
+            cursor = conn.cursor()
+            try:
+                stale = _unreferenced(cursor, kind, sources)
+            finally:
+                cursor.close()
+
+    for source in stale:
+        _discard(source)
+    response_cache.invalidate_items(cache_namespace, [item['id'] for item in migrated])
+    stats.add('migrated', len(migrated))
+
+def _fetch_batch(kind, after_id, batch_size):
+    table, column, namespace, _ = TARGETS[kind]
+    if kind == 'files':
+        condition, params = "sha256 IS NULL", []
+    else:
+        # Só o que ainda não está no namespace do layout atual
+        prefix = os.path.join(Config.UPLOAD_FOLDER, namespace, '')
+        condition, params = f"{column} NOT LIKE %s", [escape_like(prefix) + '%']
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT id, {column} AS url FROM {table} "
+                f"WHERE id > %s AND {column} IS NOT NULL AND {column} <> '' AND {condition} ORDER BY id LIMIT %s",
+                [after_id] + params + [batch_size]
+            )
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+def migrate(kind, batch_size, workers, start_after, dry_run, stats):
+    """Lê as linhas por keyset e distribui os lotes entre os workers."""
+    after_id = start_after
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'migrate-{kind}') as executor:
+        while True:
+            rows = _fetch_batch(kind, after_id, batch_size)
+            if not rows:
+                break
+            after_id = rows[-1]['id']
+            future = executor.submit(migrate_batch, kind, rows, dry_run, stats)
+            future.last_id = after_id
+            pending.add(future)
+            # Limita os lotes em memória a dois por worker
+            while len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(kind, done, stats)
+        done, _ = wait(pending)
+        _collect(kind, done, stats)
+
+def _collect(kind, futures, stats):
+    for future in futures:
+        try:
+            future.result()
+            stats.batch_done(kind, future.last_id)
+        except Exception as e:
+            stats.add('failed')
+            logger.error(f"[{kind}] Lote até o ID {future.last_id} falhou e será refeito na próxima execução: {e}",
+                         exc_info=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migra os uploads para o layout de armazenamento atual.")
+    parser.add_argument('--only', default=','.join(TARGETS),
+                        help="Tipos a migrar, separados por vírgula (logos, images, files).")
+    parser.add_argument('--batch-size', type=int, default=200, help="Linhas por transação.")
+    parser.add_argument('--workers', type=int, default=4, help="Lotes processados em paralelo.")
+    parser.add_argument('--start-after', type=int, default=0, help="Retoma a partir deste ID.")
+    parser.add_argument('--dry-run', action='store_true', help="Só lista o que seria migrado.")
+    args = parser.parse_args(argv)
+
+    kinds = [kind.strip() for kind in args.only.split(',') if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in TARGETS]
+    if unknown:
+        parser.error(f"Tipos desconhecidos: {', '.join(unknown)}")
+
+    stats = MigrationStats()
+    for kind in kinds:
+        logger.info(f"Migrando {kind} (layout '{storage_layout.layout.name}', lotes de {args.batch_size}, "
+                    f"{args.workers} workers{', simulação' if args.dry_run else ''}).")
+        migrate(kind, args.batch_size, args.workers, args.start_after, args.dry_run, stats)
+        logger.info(f"{kind}: concluído até o ID {stats.last_id.get(kind, args.start_after)}.")
+    logger.info(f"Migração finalizada: {stats.counters}")
+    return 1 if stats.counters['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+-- Índices compostos para a paginação por keyset (id) combinada aos filtros das listagens.
+-- Sem eles, "WHERE manufacturer_id = ? AND id > ? ORDER BY id LIMIT n" percorre a tabela inteira.
+
+CREATE INDEX idx_equipamentos_manufacturer_id ON equipamentos (manufacturer_id, id);
+
+CREATE INDEX idx_arquivos_equipment_id ON arquivos (equipment_id, id);
+
+CREATE INDEX idx_arquivos_type ON arquivos (type, id);
@@ -0,0 +1,11 @@
+-- Índices para a busca em /search.
+-- FULLTEXT atende às consultas com termos de pelo menos innodb_ft_min_token_size (3 por padrão)
+-- caracteres; consultas mais curtas caem no modo de prefixo (LIKE 'q%'), atendido pelos índices B-tree.
+-- Em MySQL 8 é possível usar "WITH PARSER ngram" nos índices FULLTEXT; o MariaDB não oferece esse parser.
+
+ALTER TABLE fabricantes ADD FULLTEXT INDEX ft_fabricantes_name (name);
+
+ALTER TABLE equipamentos ADD FULLTEXT INDEX ft_equipamentos_name_model (name, model);
+
+-- O índice UNIQUE(name, model, manufacturer_id) já atende ao prefixo em name; model precisa do próprio índice.
+CREATE INDEX idx_equipamentos_model ON equipamentos (model);
@@ -0,0 +1,16 @@
+-- Armazenamento endereçado por conteúdo: cada conteúdo distinto é gravado uma vez
+-- em BLOB_FOLDER/<ab>/<cd>/<sha256> e pode ser referenciado por vários registros de arquivos.
+-- ref_count é mantido pela API na mesma transação que insere/exclui o registro em arquivos.
+
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 CHAR(64) CHARACTER SET ascii NOT NULL PRIMARY KEY,
+    size BIGINT NOT NULL,
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Registros antigos ficam com sha256 NULL e continuam apontando para o caminho em file_url.
+ALTER TABLE arquivos
+    ADD COLUMN sha256 CHAR(64) CHARACTER SET ascii NULL AFTER file_size,
+    ADD INDEX idx_arquivos_sha256 (sha256),
+    ADD CONSTRAINT fk_arquivos_blob FOREIGN KEY (sha256) REFERENCES blobs(sha256);
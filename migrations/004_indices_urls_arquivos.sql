@@ -0,0 +1,10 @@
+-- Índices para a varredura de órfãos (storage_gc.py), que consulta as URLs em lote com IN (...).
+-- As colunas são TEXT, então o índice precisa de prefixo (erro 1170 sem ele): 512 caracteres utf8mb4 =
+-- 2048 bytes, dentro do limite de 3072 bytes do InnoDB (ROW_FORMAT=DYNAMIC). O IN (...) compara o
+-- valor inteiro, usando o índice para localizar as linhas.
+
+CREATE INDEX idx_arquivos_file_url ON arquivos (file_url(512));
+
+CREATE INDEX idx_fabricantes_logo_url ON fabricantes (logo_url(512));
+
+CREATE INDEX idx_equipamentos_image_url ON equipamentos (image_url(512));
@@ -0,0 +1,7 @@
+-- Variantes redimensionadas (miniatura, média, WebP) geradas após o upload de logos e imagens.
+-- JSON: {"thumb": {"path": ..., "width": ..., "height": ..., "format": "jpeg", "bytes": ...}, ...}
+-- NULL indica que as variantes ainda não foram geradas (python image_variants.py as gera para dados antigos).
+
+ALTER TABLE fabricantes ADD COLUMN logo_variants JSON NULL AFTER logo_url;
+
+ALTER TABLE equipamentos ADD COLUMN image_variants JSON NULL AFTER image_url;
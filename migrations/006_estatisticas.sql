@@ -0,0 +1,10 @@
+-- Contadores materializados de GET /admin/stats (stats_summary.py).
+-- Ajustados pela API na mesma transação de cada inclusão/exclusão e recalculados
+-- periodicamente a partir das tabelas reais; reconciled_at NULL força o recálculo.
+
+CREATE TABLE IF NOT EXISTS estatisticas (
+    name VARCHAR(64) CHARACTER SET ascii NOT NULL PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0,
+    reconciled_at TIMESTAMP NULL DEFAULT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
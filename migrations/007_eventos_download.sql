@@ -0,0 +1,37 @@
+-- Histórico de downloads (download_analytics.py).
+-- eventos_download é só de inserção (lotes do contador write-behind) e guarda os eventos
+-- por DOWNLOAD_EVENTS_RETENTION_DAYS; as consultas usam apenas as tabelas agregadas.
+-- Sem FK para arquivos: excluir um arquivo não apaga nem trava o histórico.
+
+CREATE TABLE IF NOT EXISTS eventos_download (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    file_id INT NOT NULL,
+    occurred_at DATETIME NOT NULL, -- UTC
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS downloads_por_hora (
+    bucket DATETIME NOT NULL, -- início da hora, UTC
+    file_id INT NOT NULL,
+    downloads INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, file_id),
+    INDEX idx_downloads_hora_arquivo (file_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS downloads_por_dia (
+    day DATE NOT NULL, -- UTC
+    file_id INT NOT NULL,
+    downloads INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, file_id),
+    INDEX idx_downloads_dia_arquivo (file_id, day)
+);
+
+-- Marca d'água da agregação: eventos com id <= last_event_id já estão nas tabelas acima.
+CREATE TABLE IF NOT EXISTS agregacoes_downloads (
+    name VARCHAR(64) CHARACTER SET ascii NOT NULL PRIMARY KEY,
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    last_event_at DATETIME NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+INSERT IGNORE INTO agregacoes_downloads (name, last_event_id) VALUES ('downloads', 0);
@@ -0,0 +1,5 @@
+-- Cada linha de eventos_download passa a ser a contagem de downloads de um arquivo num
+-- segundo (UTC), não um download: o contador agrega os eventos antes de gravá-los.
+-- As linhas já existentes valem um download cada.
+
+ALTER TABLE eventos_download ADD COLUMN downloads INT NOT NULL DEFAULT 1 AFTER occurred_at;
@@ -0,0 +1,103 @@
+import base64
+import json
+from config import Config
+
+
+class PaginationError(ValueError):
+    """Parâmetros de paginação inválidos (devem resultar em HTTP 400)."""
+
+
+def encode_cursor(last_id):
+    """Gera o cursor opaco que aponta para o registro seguinte a `last_id`."""
+    payload = json.dumps({"id": last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Decodifica um cursor gerado por `encode_cursor` e retorna o último ID visto."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        last_id = data['id']
+    except (ValueError, KeyError, TypeError):
+        raise PaginationError("Cursor 'after' inválido.")
+    if not isinstance(last_id, int) or isinstance(last_id, bool) or last_id < 0:
+        raise PaginationError("Cursor 'after' inválido.")
+    return last_id
+
+def parse_pagination_args(args):
+    """Lê `limit` e `after` da query string, aplicando o tamanho máximo de página.
+
+    Retorna uma tupla (limit, after_id), onde after_id é None na primeira página.
+    """
+    raw_limit = args.get('limit')
+    if raw_limit is None or raw_limit == '':
+        limit = Config.PAGE_SIZE_DEFAULT
+    else:
+        try:
+            limit = int(raw_limit)
+        except ValueError:
+            raise PaginationError("Parâmetro 'limit' deve ser um número inteiro.")
+        if limit < 1:
+            raise PaginationError("Parâmetro 'limit' deve ser maior que zero.")
+    limit = min(limit, Config.PAGE_SIZE_MAX)
+
+    after = args.get('after')
+    after_id = decode_cursor(after) if after else None
+    return limit, after_id
+
+def apply_keyset(sql_query, conditions, params, after_id, limit):
+    """Completa a query com o filtro de keyset, a ordenação por ID e o LIMIT.
+
+    Busca um registro além do limite para saber se existe uma próxima página.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after_id is not None:
+        conditions.append("id > %s")
+        params.append(after_id)
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " ORDER BY id LIMIT %s"
+    params.append(limit + 1)
+    return sql_query, tuple(params)
+
+def build_page(rows, limit):
+    """Monta o corpo da resposta paginada a partir das linhas retornadas."""
+    items = list(rows[:limit])
+    next_cursor = encode_cursor(items[-1]['id']) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor, "limit": limit}
+
+def parse_id_list(args):
+    """Lê `ids` (ex.: '3,1,2') da query string.
+
+    Retorna os IDs na ordem pedida, sem repetições, ou None se o parâmetro
+    não foi informado.
+    """
+    raw_ids = args.get('ids')
+    if raw_ids is None:
+        return None
+    ids = []
+    for part in raw_ids.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise PaginationError("Parâmetro 'ids' deve ser uma lista de inteiros separados por vírgula.")
+        ids.append(int(part))
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise PaginationError("Parâmetro 'ids' vazio.")
+    if len(ids) > Config.BATCH_IDS_MAX:
+        raise PaginationError(f"Máximo de {Config.BATCH_IDS_MAX} IDs por consulta.")
+    return ids
+
+def apply_id_list(sql_query, conditions, params, ids):
+    """Completa a query com o filtro `id IN (...)` e os demais filtros da listagem."""
+    conditions = list(conditions) + [f"id IN ({', '.join(['%s'] * len(ids))})"]
+    return f"{sql_query} WHERE {' AND '.join(conditions)}", tuple(params) + tuple(ids)
+
+def build_batch(rows, ids):
+    """Corpo da busca por lista de IDs: um item por ID pedido, na mesma ordem (null se não existe)."""
+    by_id = {row['id']: row for row in rows}
+    return {"items": [by_id.get(item_id) for item_id in ids],
+            "missing": [item_id for item_id in ids if item_id not in by_id]}
@@ -1,51 +1,128 @@
 from flask import Blueprint, request, jsonify
-from database import get_db_connection, close_db_connection
+from database import get_db_connection, close_db_connection, pool
+from cache import response_cache
+from download_counter import download_counter
+import storage_gc
+import stats_summary
+import download_analytics
 import logging
 
 admin_bp = Blueprint('admin', __name__)
 logger = logging.getLogger('api_jatoba.admin') # Logger específico para admin
 
 # GET /admin/stats - Estatísticas gerais do sistema
+# Lidas dos contadores materializados (stats_summary); ?fresh=1 recalcula a partir das tabelas.
 @admin_bp.route('/stats', methods=['GET'])
 def get_system_stats():
-    logger.info("Iniciando obtenção de estatísticas gerais do sistema.")
+    fresh = request.args.get('fresh', '').lower() in ('1', 'true', 'yes')
+    logger.info(f"Iniciando obtenção de estatísticas gerais do sistema{' (recálculo completo)' if fresh else ''}.")
     conn = get_db_connection()
     if conn is None:
         logger.error("Falha ao obter conexão com o banco de dados para estatísticas.")
         return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
-    
-    cursor = conn.cursor()
-    stats = {}
+
     try:
-        cursor.execute("SELECT COUNT(*) FROM fabricantes")
-        stats['total_manufacturers'] = cursor.fetchone()[0]
-        logger.debug(f"Total de fabricantes: {stats['total_manufacturers']}.")
-
-        cursor.execute("SELECT COUNT(*) FROM equipamentos")
-        stats['total_equipments'] = cursor.fetchone()[0]
-        logger.debug(f"Total de equipamentos: {stats['total_equipments']}.")
-
-        cursor.execute("SELECT COUNT(*) FROM arquivos")
-        stats['total_files'] = cursor.fetchone()[0]
-        logger.debug(f"Total de arquivos: {stats['total_files']}.")
-
-        cursor.execute("SELECT SUM(download_count) FROM arquivos")
-        stats['total_downloads'] = cursor.fetchone()[0] or 0
-        logger.debug(f"Total de downloads: {stats['total_downloads']}.")
-
-        cursor.execute("SELECT type, COUNT(*) FROM arquivos GROUP BY type")
-        stats['files_by_type'] = dict(cursor.fetchall())
-        logger.debug(f"Arquivos por tipo: {stats['files_by_type']}.")
-        
+        stats = stats_summary.read(conn, fresh=fresh)
+        # Inclui os downloads ainda não gravados pelo contador write-behind deste processo
+        stats['pending_downloads'] = download_counter.pending()
+        stats['total_downloads'] += stats['pending_downloads']
         logger.info("Estatísticas gerais obtidas com sucesso.")
         return jsonify(stats), 200
     except Exception as e:
         logger.error(f"Erro ao obter estatísticas: {e}", exc_info=True)
         return jsonify({"message": "Erro ao obter estatísticas", "error": str(e)}), 500
+    finally:
+        close_db_connection(conn)
+
+# GET /admin/stats/downloads/top - Arquivos, equipamentos ou fabricantes mais baixados numa janela
+@admin_bp.route('/stats/downloads/top', methods=['GET'])
+def get_top_downloads():
+    try:
+        window = download_analytics.parse_window(request.args.get('window'))
+        limit = int(request.args.get('limit', 10))
+        if not 1 <= limit <= 100:
+            raise download_analytics.AnalyticsError("Parâmetro 'limit' deve estar entre 1 e 100.")
+        dimension = request.args.get('by', 'file')
+    except ValueError as e:
+        message = str(e) if isinstance(e, download_analytics.AnalyticsError) else "Parâmetro 'limit' deve ser um inteiro."
+        return jsonify({"message": message}), 400
+
+    logger.info(f"Obtendo ranking de downloads por {dimension} ({request.args.get('window', '7d')}).")
+    conn = get_db_connection()
+    if conn is None:
+        logger.error("Falha ao obter conexão com o banco de dados para o ranking de downloads.")
+        return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
+
+    cursor = conn.cursor()
+    try:
+        result = download_analytics.top(cursor, dimension, window, limit)
+        result['rollup'] = download_analytics.rollup_status(cursor)
+        return jsonify(result), 200
+    except download_analytics.AnalyticsError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erro ao obter ranking de downloads: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao obter ranking de downloads", "error": str(e)}), 500
+    finally:
+        cursor.close()
+        close_db_connection(conn)
+
+# GET /admin/stats/downloads/files/:id - Série de downloads de um arquivo (por hora ou por dia)
+@admin_bp.route('/stats/downloads/files/<int:id>', methods=['GET'])
+def get_file_download_series(id):
+    try:
+        window = download_analytics.parse_window(request.args.get('window'))
+    except download_analytics.AnalyticsError as e:
+        return jsonify({"message": str(e)}), 400
+
+    conn = get_db_connection()
+    if conn is None:
+        logger.error(f"Falha ao obter conexão com o banco de dados para a série de downloads do arquivo {id}.")
+        return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
+
+    cursor = conn.cursor()
+    try:
+        result = download_analytics.series(cursor, id, window)
+        result['rollup'] = download_analytics.rollup_status(cursor)
+        return jsonify(result), 200
+    except Exception as e:
+        logger.error(f"Erro ao obter série de downloads do arquivo {id}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao obter série de downloads", "error": str(e)}), 500
     finally:
         cursor.close()
         close_db_connection(conn)
 
+# GET /admin/db-pool - Estatísticas do pool de conexões
+@admin_bp.route('/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    logger.info("Obtendo estatísticas do pool de conexões.")
+    return jsonify(pool.stats()), 200
+
+# GET /admin/downloads - Estado do contador write-behind de downloads
+@admin_bp.route('/downloads', methods=['GET'])
+def get_download_counter_stats():
+    logger.info("Obtendo estado do contador de downloads.")
+    return jsonify(download_counter.stats()), 200
+
+# GET /admin/cache - Contadores do cache de respostas
+@admin_bp.route('/cache', methods=['GET'])
+def get_cache_stats():
+    logger.info("Obtendo estatísticas do cache de respostas.")
+    return jsonify(response_cache.stats()), 200
+
+# DELETE /admin/cache - Esvazia o cache de respostas
+@admin_bp.route('/cache', methods=['DELETE'])
+def clear_cache():
+    response_cache.clear()
+    logger.info("Cache de respostas esvaziado.")
+    return jsonify({"message": "Cache esvaziado com sucesso"}), 200
+
+# GET /admin/storage-gc - Último relatório e progresso da varredura de arquivos órfãos
+@admin_bp.route('/storage-gc', methods=['GET'])
+def get_storage_gc_report():
+    logger.info("Obtendo relatório da varredura de arquivos órfãos.")
+    return jsonify(storage_gc.StorageScanner().report()), 200
+
 # Para os endpoints de usuário, estou mantendo os logs como placeholders,
 # pois a tabela 'users' não foi definida.
 # GET /admin/users - Listar usuários (admin only)
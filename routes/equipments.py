@@ -1,18 +1,80 @@
 import os
 from flask import Blueprint, request, jsonify, current_app
-from database import get_db_connection, close_db_connection
+from database import get_db_connection, close_db_connection, release_request_connection
+from pagination import PaginationError, parse_pagination_args, apply_keyset, build_page, parse_id_list, apply_id_list, build_batch
+from export import ExportError, parse_export_format, stream_export
+from expand import ExpandError, parse_expand, apply_expand, key_columns, related_namespaces
+from fields import FieldsError, parse_fields, select_columns, project
+import bulk_import
+import json_provider
+import suggest_index
+from cache import response_cache
+from conditional import is_conditional, not_modified, with_validators, item_validators, rows_validators, probe_list_validators
 from werkzeug.utils import secure_filename
+import storage_layout
+import image_variants
+import stats_summary
 import logging
 
 equipments_bp = Blueprint('equipments', __name__)
 logger = logging.getLogger('api_jatoba.equipments') # Logger específico para equipamentos
 
-# GET /equipments - Listar todos os equipamentos
+# Campos aceitos em ?fields= (colunas da listagem e do registro individual)
+LIST_FIELDS = ('id', 'name', 'model', 'manufacturer_id', 'image_url', 'created_at', 'updated_at')
+ITEM_FIELDS = ('id', 'name', 'model', 'manufacturer_id', 'image_url', 'image_variants', 'created_at', 'updated_at')
+# Lidas sempre: id (paginação e ordem do ?ids=) e updated_at (ETag)
+REQUIRED_FIELDS = ('id', 'updated_at')
+
+def _build_filters(args):
+    """Monta as condições SQL dos filtros aceitos na listagem de equipamentos."""
+    conditions = []
+    params = []
+    manufacturer_id = args.get('manufacturer_id')
+    if manufacturer_id:
+        conditions.append("manufacturer_id = %s")
+        params.append(manufacturer_id)
+    return conditions, params
+
+def _get_equipments_by_ids(cursor, ids, conditions, params, expand, fields):
+    """Busca por ?ids=: uma consulta para todos os IDs, com a resposta na ordem pedida."""
+    columns = select_columns(ITEM_FIELDS, fields, REQUIRED_FIELDS + key_columns('equipamentos', expand))
+    sql_query, query_params = apply_id_list(
+        f"SELECT {columns} FROM equipamentos",
+        conditions, params, ids
+    )
+    cursor.execute(sql_query, query_params)
+    rows = cursor.fetchall()
+    embedded = apply_expand(cursor, 'equipamentos', rows, expand)
+    validators = rows_validators('equipamentos', rows + embedded)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        logger.info("Busca de equipamentos por lista de IDs não modificada (304).")
+        return unchanged
+    for row in rows:
+        if 'image_variants' in row:
+            row['image_variants'] = image_variants.public_variants(row['image_variants'])
+    logger.info(f"Busca por lista de IDs: {len(rows)} de {len(ids)} equipamentos encontrados.")
+    body = build_batch(rows, ids)
+    project(body['items'], fields, keep=expand)
+    return with_validators(jsonify(body), *validators), 200
+
+# GET /equipments - Listar equipamentos (paginado por ?limit=&after=)
 # GET /equipments?manufacturer_id=:id - Listar equipamentos por fabricante
+# GET /equipments?expand=manufacturer - Incluir o fabricante de cada equipamento
+# GET /equipments?ids=1,2,3 - Buscar vários equipamentos de uma vez
 @equipments_bp.route('/', methods=['GET'])
+@response_cache.cached('equipments', related=related_namespaces('equipamentos'))
 def get_all_equipments():
     manufacturer_id = request.args.get('manufacturer_id')
     logger.info(f"Iniciando listagem de equipamentos. Filtro por fabricante_id: {manufacturer_id if manufacturer_id else 'Nenhum'}.")
+    try:
+        ids = parse_id_list(request.args)
+        limit, after_id = parse_pagination_args(request.args)
+        expand = parse_expand(request.args, 'equipamentos')
+        fields = parse_fields(request.args, ITEM_FIELDS if ids is not None else LIST_FIELDS)
+    except (PaginationError, ExpandError, FieldsError) as e:
+        logger.warning(f"Listagem de equipamentos com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
     
     conn = get_db_connection()
     if conn is None:
@@ -22,17 +84,36 @@ def get_all_equipments():
     cursor = conn.cursor()
     
     try:
-        if manufacturer_id:
-            cursor.execute(
-                "SELECT id, name, model, manufacturer_id, image_url, created_at, updated_at FROM equipamentos WHERE manufacturer_id = %s",
-                (manufacturer_id,)
-            )
-        else:
-            cursor.execute("SELECT id, name, model, manufacturer_id, image_url, created_at, updated_at FROM equipamentos")
-        
-        equipments = cursor.fetchall()
-        logger.info(f"Listados {len(equipments)} equipamentos.")
-        return jsonify(equipments), 200
+        conditions, params = _build_filters(request.args)
+        if ids is not None:
+            return _get_equipments_by_ids(cursor, ids, conditions, params, expand, fields)
+        if is_conditional() and not expand:
+            # Com expand os validadores dependem dos registros embutidos e são calculados abaixo
+            probe_sql, probe_params = apply_keyset("SELECT id, updated_at FROM equipamentos", conditions, params, after_id, limit)
+            unchanged = not_modified(*probe_list_validators(cursor, 'equipamentos', probe_sql, probe_params))
+            if unchanged:
+                logger.info("Listagem de equipamentos não modificada (304).")
+                return unchanged
+
+        columns = select_columns(LIST_FIELDS, fields, REQUIRED_FIELDS + key_columns('equipamentos', expand))
+        sql_query, params = apply_keyset(
+            f"SELECT {columns} FROM equipamentos",
+            conditions, params, after_id, limit
+        )
+        cursor.execute(sql_query, params)
+        rows = cursor.fetchall()
+        page = build_page(rows, limit)
+        validators = rows_validators('equipamentos', rows)
+        if expand:
+            embedded = apply_expand(cursor, 'equipamentos', page['items'], expand)
+            validators = rows_validators('equipamentos', rows + embedded)
+            unchanged = not_modified(*validators)
+            if unchanged:
+                logger.info("Listagem de equipamentos não modificada (304).")
+                return unchanged
+        project(page['items'], fields, keep=expand)
+        logger.info(f"Listados {len(page['items'])} equipamentos.")
+        return with_validators(jsonify(page), *validators), 200
     except Exception as e:
         logger.error(f"Erro ao listar equipamentos: {e}", exc_info=True)
         return jsonify({"message": "Erro ao listar equipamentos", "error": str(e)}), 500
@@ -40,10 +121,52 @@ def get_all_equipments():
         cursor.close()
         close_db_connection(conn)
 
+# GET /equipments/export?format=ndjson|csv - Exportação completa em streaming (aceita os filtros da listagem)
+@equipments_bp.route('/export', methods=['GET'])
+def export_equipments():
+    try:
+        fmt = parse_export_format(request.args)
+        columns = parse_fields(request.args, LIST_FIELDS) or list(LIST_FIELDS)
+    except (ExportError, FieldsError) as e:
+        logger.warning(f"Exportação de equipamentos com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
+    logger.info(f"Iniciando exportação de equipamentos em {fmt}.")
+    conditions, params = _build_filters(request.args)
+    sql_query = f"SELECT {', '.join(columns)} FROM equipamentos"
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " ORDER BY id"
+    try:
+        return stream_export(sql_query, tuple(params), columns, fmt, 'equipamentos')
+    except Exception as e:
+        logger.error(f"Erro ao exportar equipamentos: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao exportar equipamentos", "error": str(e)}), 500
+
+# POST /equipments/bulk - Importação em lote (array JSON ou NDJSON)
+@equipments_bp.route('/bulk', methods=['POST'])
+def bulk_import_equipments():
+    try:
+        body, status = bulk_import.run('equipments')
+    except bulk_import.BulkImportError as e:
+        logger.warning(f"Importação em lote de equipamentos recusada: {e}")
+        return jsonify({"message": str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Erro na importação em lote de equipamentos: {e}", exc_info=True)
+        return jsonify({"message": "Erro na importação em lote de equipamentos", "error": str(e)}), 500
+    return json_provider.jsonify_large(body, 'results'), status
+
 # GET /equipments/:id - Obter equipamento específico
 @equipments_bp.route('/<int:id>', methods=['GET'])
+@response_cache.cached('equipments', item_arg='id')
 def get_equipment_by_id(id):
     logger.info(f"Buscando equipamento com ID: {id}.")
+    try:
+        fields = parse_fields(request.args, ITEM_FIELDS)
+    except FieldsError as e:
+        logger.warning(f"Busca do equipamento {id} com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
     conn = get_db_connection()
     if conn is None:
         logger.error(f"Falha ao obter conexão com o banco de dados para buscar equipamento {id}.")
@@ -51,11 +174,19 @@ def get_equipment_by_id(id):
     
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, name, model, manufacturer_id, image_url, created_at, updated_at FROM equipamentos WHERE id = %s", (id,))
+        cursor.execute(f"SELECT {select_columns(ITEM_FIELDS, fields, REQUIRED_FIELDS)} FROM equipamentos WHERE id = %s", (id,))
         equipment = cursor.fetchone()
         if equipment:
-            logger.info(f"Equipamento ID {id} encontrado: {equipment['name']}.")
-            return jsonify(equipment), 200
+            validators = item_validators('equipamentos', equipment)
+            unchanged = not_modified(*validators)
+            if unchanged:
+                logger.info(f"Equipamento ID {id} não modificado (304).")
+                return unchanged
+            logger.info(f"Equipamento ID {id} encontrado: {equipment.get('name', '-')}.")
+            if 'image_variants' in equipment:
+                equipment['image_variants'] = image_variants.public_variants(equipment['image_variants'])
+            project([equipment], fields)
+            return with_validators(jsonify(equipment), *validators), 200
         logger.warning(f"Equipamento ID {id} não encontrado.")
         return jsonify({"message": "Equipamento não encontrado"}), 404
     except Exception as e:
@@ -90,8 +221,11 @@ def create_equipment():
             "INSERT INTO equipamentos (name, model, manufacturer_id, image_url) VALUES (%s, %s, %s, %s)",
             (name, model, manufacturer_id, image_url)
         )
-        conn.commit()
         new_id = cursor.lastrowid
+        stats_summary.adjust(cursor, {'equipamentos': 1})
+        conn.commit()
+        suggest_index.index_equipment(new_id, name, model, manufacturer_id)
+        response_cache.invalidate('equipments')
         logger.info(f"Equipamento '{name} ({model})' criado com sucesso, ID: {new_id}.")
         return jsonify({"message": "Equipamento criado com sucesso", "id": new_id}), 201
     except Exception as e:
@@ -118,14 +252,23 @@ def update_equipment(id):
     
     cursor = conn.cursor()
     try:
+        cursor.execute("SELECT image_url FROM equipamentos WHERE id = %s", (id,))
+        previous = cursor.fetchone()
+        # As variantes só valem para a imagem atual: descartadas se a URL mudar (o SET é
+        # avaliado da esquerda para a direita, então o IF ainda vê a URL anterior)
         cursor.execute(
-            "UPDATE equipamentos SET name = %s, model = %s, manufacturer_id = %s, image_url = %s WHERE id = %s",
-            (name, model, manufacturer_id, image_url, id)
+            "UPDATE equipamentos SET name = %s, model = %s, manufacturer_id = %s, "
+            "image_variants = IF(image_url <=> %s, image_variants, NULL), image_url = %s WHERE id = %s",
+            (name, model, manufacturer_id, image_url, image_url, id)
         )
         conn.commit()
         if cursor.rowcount == 0:
             logger.warning(f"Equipamento ID {id} não encontrado para atualização.")
             return jsonify({"message": "Equipamento não encontrado para atualização"}), 404
+        suggest_index.index_equipment(id, name, model, manufacturer_id)
+        response_cache.invalidate('equipments', id)
+        if previous and previous['image_url'] != image_url:
+            image_variants.requeue('image', id, image_url)
         logger.info(f"Equipamento ID {id} atualizado com sucesso.")
         return jsonify({"message": "Equipamento atualizado com sucesso"}), 200
     except Exception as e:
@@ -146,11 +289,19 @@ def delete_equipment(id):
     
     cursor = conn.cursor()
     try:
+        cursor.execute("SELECT image_url, image_variants FROM equipamentos WHERE id = %s", (id,))
+        row = cursor.fetchone()
         cursor.execute("DELETE FROM equipamentos WHERE id = %s", (id,))
+        deleted = cursor.rowcount
+        stats_summary.adjust(cursor, {'equipamentos': -deleted})
         conn.commit()
-        if cursor.rowcount == 0:
+        if deleted == 0:
             logger.warning(f"Equipamento ID {id} não encontrado para exclusão.")
             return jsonify({"message": "Equipamento não encontrado para exclusão"}), 404
+        suggest_index.remove_equipment(id)
+        if row and image_variants.remove_all(row['image_url'], row['image_variants']):
+            logger.info(f"Arquivo de imagem '{row['image_url']}' do equipamento {id} removido.")
+        response_cache.invalidate('equipments', id)
         logger.info(f"Equipamento ID {id} excluído com sucesso.")
         return jsonify({"message": "Equipamento excluído com sucesso"}), 200
     except Exception as e:
@@ -176,10 +327,10 @@ def upload_equipment_image(id):
     if image:
         original_filename = image.filename
         filename = secure_filename(f"equipment_image_{id}_{original_filename}")
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        file_path = storage_layout.storage_path('images', filename)
         
         try:
-            image.save(file_path)
+            storage_layout.save_upload(image, file_path)
             logger.info(f"Imagem '{original_filename}' salva para equipamento {id} em: {file_path}")
         except Exception as e:
             logger.error(f"Erro ao salvar o arquivo de imagem para equipamento {id}: {str(e)}", exc_info=True)
@@ -196,7 +347,7 @@ def upload_equipment_image(id):
         cursor = conn.cursor()
         try:
             cursor.execute(
-                "UPDATE equipamentos SET image_url = %s WHERE id = %s",
+                "UPDATE equipamentos SET image_url = %s, image_variants = NULL WHERE id = %s",
                 (file_path, id)
             )
             conn.commit()
@@ -206,6 +357,9 @@ def upload_equipment_image(id):
                     logger.warning(f"Equipamento ID {id} não encontrado para associar imagem. Arquivo '{filename}' removido.")
                 return jsonify({"message": "Equipamento não encontrado para associar a imagem"}), 404
             
+            response_cache.invalidate('equipments', id)
+            # Miniaturas e variantes são geradas fora da requisição
+            image_variants.variant_pool.submit('image', id, file_path)
             logger.info(f"URL da imagem para equipamento {id} atualizada no banco de dados para: {file_path}.")
             return jsonify({"message": "Imagem do equipamento uploaded e atualizada com sucesso", "image_url": file_path}), 200
         except Exception as e:
@@ -218,4 +372,33 @@ def upload_equipment_image(id):
             close_db_connection(conn)
     
     logger.error(f"Erro desconhecido no upload da imagem para equipamento ID: {id}.")
-    return jsonify({"message": "Erro desconhecido no upload da imagem"}), 500
\ No newline at end of file
+    return jsonify({"message": "Erro desconhecido no upload da imagem"}), 500
+
+# GET /equipments/:id/image?size=160 - Serve o imagem (a menor variante que atende ao tamanho pedido)
+@equipments_bp.route('/<int:id>/image', methods=['GET'])
+def get_equipment_image(id):
+    try:
+        size = image_variants.parse_size(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    conn = get_db_connection()
+    if conn is None:
+        logger.error(f"Falha ao obter conexão com o banco de dados para servir imagem do equipamento {id}.")
+        return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT image_url, image_variants FROM equipamentos WHERE id = %s", (id,))
+        row = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Erro ao buscar imagem do equipamento {id}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao buscar imagem", "error": str(e)}), 500
+    finally:
+        cursor.close()
+        # Devolve a conexão ao pool antes de transmitir a imagem
+        release_request_connection()
+
+    if not row or not row['image_url']:
+        logger.warning(f"Imagem do equipamento {id} não encontrada.")
+        return jsonify({"message": "Imagem do equipamento não encontrada"}), 404
+    return image_variants.serve(row['image_url'], row['image_variants'], size)
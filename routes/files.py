@@ -1,52 +1,137 @@
 import os
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
-from database import get_db_connection, close_db_connection
+from flask import Blueprint, request, jsonify, current_app
+from database import get_db_connection, close_db_connection, release_request_connection
+from pagination import PaginationError, parse_pagination_args, apply_keyset, build_page, parse_id_list, apply_id_list, build_batch
+from export import parse_export_format, stream_export
+from expand import ExpandError, parse_expand, apply_expand, key_columns, related_namespaces
+from fields import FieldsError, parse_fields, select_columns, project
+import bulk_import
+import json_provider
+from cache import response_cache
+from download_counter import download_counter
+from file_transfer import send_file_ranged
+import chunked_upload
+import blob_store
+import stats_summary
+from conditional import is_conditional, not_modified, with_validators, item_validators, rows_validators, probe_list_validators
 from werkzeug.utils import secure_filename
 import logging
 
 files_bp = Blueprint('files', __name__)
 logger = logging.getLogger('api_jatoba.files') # Logger específico para arquivos
 
-# GET /files - Listar todos os arquivos
+# Campos aceitos em ?fields=
+FILE_FIELDS = ('id', 'name', 'type', 'equipment_id', 'file_url', 'file_size', 'sha256', 'download_count',
+               'uploaded_by', 'created_at', 'updated_at')
+# Lidas sempre: id (paginação e ordem do ?ids=) e updated_at (ETag)
+REQUIRED_FIELDS = ('id', 'updated_at')
+
+def _build_filters(args):
+    """Monta as condições SQL dos filtros aceitos na listagem de arquivos.
+
+    Lança ValueError se o tipo informado for inválido.
+    """
+    equipment_id = args.get('equipment_id')
+    file_type = args.get('type') # 'firmware' ou 'document'
+    conditions = []
+    params = []
+
+    if equipment_id:
+        conditions.append("equipment_id = %s")
+        params.append(equipment_id)
+    
+    if file_type:
+        if file_type not in ['firmware', 'document']:
+            raise ValueError("Tipo de arquivo inválido. Use 'firmware' ou 'document'.")
+        conditions.append("type = %s")
+        params.append(file_type)
+    return conditions, params
+
+def _get_files_by_ids(cursor, ids, conditions, params, expand, fields):
+    """Busca por ?ids=: uma consulta para todos os IDs, com a resposta na ordem pedida."""
+    columns = select_columns(FILE_FIELDS, fields, REQUIRED_FIELDS + key_columns('arquivos', expand))
+    sql_query, query_params = apply_id_list(
+        f"SELECT {columns} FROM arquivos",
+        conditions, params, ids
+    )
+    cursor.execute(sql_query, query_params)
+    rows = cursor.fetchall()
+    embedded = apply_expand(cursor, 'arquivos', rows, expand)
+    validators = rows_validators('arquivos', rows + embedded)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        logger.info("Busca de arquivos por lista de IDs não modificada (304).")
+        return unchanged
+    logger.info(f"Busca por lista de IDs: {len(rows)} de {len(ids)} arquivos encontrados.")
+    body = build_batch(rows, ids)
+    project(body['items'], fields, keep=expand)
+    return with_validators(jsonify(body), *validators), 200
+
+# GET /files - Listar arquivos (paginado por ?limit=&after=)
 # GET /files?equipment_id=:id - Listar arquivos por equipamento
 # GET /files?type=firmware - Listar apenas firmwares
 # GET /files?type=document - Listar apenas documentos
+# GET /files?expand=equipment.manufacturer - Incluir o equipamento (e o fabricante) de cada arquivo
+# GET /files?ids=1,2,3 - Buscar vários arquivos de uma vez
 @files_bp.route('/', methods=['GET'])
+@response_cache.cached('files', related=related_namespaces('arquivos'))
 def get_all_files():
     equipment_id = request.args.get('equipment_id')
-    file_type = request.args.get('type') # 'firmware' ou 'document'
+    file_type = request.args.get('type')
     
     logger.info(f"Iniciando listagem de arquivos. Filtros: equipment_id={equipment_id}, type={file_type}.")
 
+    try:
+        conditions, params = _build_filters(request.args)
+    except ValueError as e:
+        logger.warning(f"Tentativa de listar arquivos com tipo inválido: '{file_type}'.")
+        return jsonify({"message": str(e)}), 400
+    try:
+        ids = parse_id_list(request.args)
+        limit, after_id = parse_pagination_args(request.args)
+        expand = parse_expand(request.args, 'arquivos')
+        fields = parse_fields(request.args, FILE_FIELDS)
+    except (PaginationError, ExpandError, FieldsError) as e:
+        logger.warning(f"Listagem de arquivos com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
     conn = get_db_connection()
     if conn is None:
         logger.error("Falha ao obter conexão com o banco de dados para listar arquivos.")
         return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
     
     cursor = conn.cursor()
-    sql_query = "SELECT id, name, type, equipment_id, file_url, file_size, download_count, uploaded_by, created_at, updated_at FROM arquivos"
-    params = []
-    conditions = []
-
-    if equipment_id:
-        conditions.append("equipment_id = %s")
-        params.append(equipment_id)
-    
-    if file_type:
-        if file_type not in ['firmware', 'document']:
-            logger.warning(f"Tentativa de listar arquivos com tipo inválido: '{file_type}'.")
-            return jsonify({"message": "Tipo de arquivo inválido. Use 'firmware' ou 'document'."}), 400
-        conditions.append("type = %s")
-        params.append(file_type)
-    
-    if conditions:
-        sql_query += " WHERE " + " AND ".join(conditions)
     
     try:
-        cursor.execute(sql_query, tuple(params))
-        files = cursor.fetchall()
-        logger.info(f"Listados {len(files)} arquivos com os filtros aplicados.")
-        return jsonify(files), 200
+        if ids is not None:
+            return _get_files_by_ids(cursor, ids, conditions, params, expand, fields)
+        if is_conditional() and not expand:
+            # Com expand os validadores dependem dos registros embutidos e são calculados abaixo
+            probe_sql, probe_params = apply_keyset("SELECT id, updated_at FROM arquivos", conditions, params, after_id, limit)
+            unchanged = not_modified(*probe_list_validators(cursor, 'arquivos', probe_sql, probe_params))
+            if unchanged:
+                logger.info("Listagem de arquivos não modificada (304).")
+                return unchanged
+
+        columns = select_columns(FILE_FIELDS, fields, REQUIRED_FIELDS + key_columns('arquivos', expand))
+        sql_query, query_params = apply_keyset(
+            f"SELECT {columns} FROM arquivos",
+            conditions, params, after_id, limit
+        )
+        cursor.execute(sql_query, query_params)
+        rows = cursor.fetchall()
+        page = build_page(rows, limit)
+        validators = rows_validators('arquivos', rows)
+        if expand:
+            embedded = apply_expand(cursor, 'arquivos', page['items'], expand)
+            validators = rows_validators('arquivos', rows + embedded)
+            unchanged = not_modified(*validators)
+            if unchanged:
+                logger.info("Listagem de arquivos não modificada (304).")
+                return unchanged
+        project(page['items'], fields, keep=expand)
+        logger.info(f"Listados {len(page['items'])} arquivos com os filtros aplicados.")
+        return with_validators(jsonify(page), *validators), 200
     except Exception as e:
         logger.error(f"Erro ao listar arquivos: {e}", exc_info=True)
         return jsonify({"message": "Erro ao listar arquivos", "error": str(e)}), 500
@@ -54,10 +139,52 @@ def get_all_files():
         cursor.close()
         close_db_connection(conn)
 
+# GET /files/export?format=ndjson|csv - Exportação completa em streaming (aceita os filtros da listagem)
+@files_bp.route('/export', methods=['GET'])
+def export_files():
+    try:
+        fmt = parse_export_format(request.args)
+        conditions, params = _build_filters(request.args)
+        columns = parse_fields(request.args, FILE_FIELDS) or list(FILE_FIELDS)
+    except ValueError as e:
+        logger.warning(f"Exportação de arquivos com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
+    logger.info(f"Iniciando exportação de arquivos em {fmt}.")
+    sql_query = f"SELECT {', '.join(columns)} FROM arquivos"
+    if conditions:
+        sql_query += " WHERE " + " AND ".join(conditions)
+    sql_query += " ORDER BY id"
+    try:
+        return stream_export(sql_query, tuple(params), columns, fmt, 'arquivos')
+    except Exception as e:
+        logger.error(f"Erro ao exportar arquivos: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao exportar arquivos", "error": str(e)}), 500
+
+# POST /files/bulk - Importação em lote (array JSON ou NDJSON)
+@files_bp.route('/bulk', methods=['POST'])
+def bulk_import_files():
+    try:
+        body, status = bulk_import.run('files')
+    except bulk_import.BulkImportError as e:
+        logger.warning(f"Importação em lote de arquivos recusada: {e}")
+        return jsonify({"message": str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Erro na importação em lote de arquivos: {e}", exc_info=True)
+        return jsonify({"message": "Erro na importação em lote de arquivos", "error": str(e)}), 500
+    return json_provider.jsonify_large(body, 'results'), status
+
 # GET /files/:id - Obter arquivo específico
 @files_bp.route('/<int:id>', methods=['GET'])
+@response_cache.cached('files', item_arg='id')
 def get_file_by_id(id):
     logger.info(f"Buscando arquivo com ID: {id}.")
+    try:
+        fields = parse_fields(request.args, FILE_FIELDS)
+    except FieldsError as e:
+        logger.warning(f"Busca do arquivo {id} com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
     conn = get_db_connection()
     if conn is None:
         logger.error(f"Falha ao obter conexão com o banco de dados para buscar arquivo {id}.")
@@ -65,11 +192,17 @@ def get_file_by_id(id):
     
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, name, type, equipment_id, file_url, file_size, download_count, uploaded_by, created_at, updated_at FROM arquivos WHERE id = %s", (id,))
+        cursor.execute(f"SELECT {select_columns(FILE_FIELDS, fields, REQUIRED_FIELDS)} FROM arquivos WHERE id = %s", (id,))
         file_data = cursor.fetchone()
         if file_data:
-            logger.info(f"Arquivo ID {id} encontrado: {file_data['name']}.")
-            return jsonify(file_data), 200
+            validators = item_validators('arquivos', file_data)
+            unchanged = not_modified(*validators)
+            if unchanged:
+                logger.info(f"Arquivo ID {id} não modificado (304).")
+                return unchanged
+            logger.info(f"Arquivo ID {id} encontrado: {file_data.get('name', '-')}.")
+            project([file_data], fields)
+            return with_validators(jsonify(file_data), *validators), 200
         logger.warning(f"Arquivo ID {id} não encontrado.")
         return jsonify({"message": "Arquivo não encontrado"}), 404
     except Exception as e:
@@ -79,20 +212,98 @@ def get_file_by_id(id):
         cursor.close()
         close_db_connection(conn)
 
+def _save_file_record(name, file_type, equipment_id, uploaded_by, sha256, file_size=None, tmp_path=None):
+    """Referencia o blob e grava o registro em `arquivos` numa única transação.
+
+    Com `tmp_path`, o conteúdo recém-recebido vira o blob (ou é descartado se
+    o servidor já o tiver); sem ele, o registro aponta para um blob existente.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        logger.error("Falha ao obter conexão com o banco de dados para salvar metadados do arquivo.")
+        if tmp_path:
+            blob_store.discard_temp(tmp_path)
+            logger.warning(f"Conteúdo temporário do arquivo '{name}' removido após falha na conexão com DB.")
+        return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
+    
+    cursor = conn.cursor()
+    file_path_on_server, created = None, False
+    try:
+        if tmp_path is None:
+            blob = blob_store.describe(cursor, sha256)
+            if blob is None:
+                logger.warning(f"Upload referenciando blob inexistente: {sha256}.")
+                return jsonify({"message": "Conteúdo não encontrado no servidor; envie o arquivo", "sha256": sha256}), 404
+            file_size = blob['size']
+        file_path_on_server, created = blob_store.add_reference(cursor, sha256, file_size, tmp_path)
+        cursor.execute(
+            "INSERT INTO arquivos (name, type, equipment_id, file_url, file_size, sha256, uploaded_by) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (name, file_type, equipment_id, file_path_on_server, file_size, sha256, uploaded_by)
+        )
+        new_id = cursor.lastrowid
+        stats_summary.adjust(cursor, {'arquivos': 1, stats_summary.file_type_key(file_type): 1})
+        conn.commit()
+        response_cache.invalidate('files')
+        logger.info(f"Metadados do arquivo '{name}' salvos com sucesso, ID: {new_id}, blob {sha256}.")
+        return jsonify({
+            "message": "Arquivo uploaded e metadados salvos com sucesso", "id": new_id,
+            "file_url": file_path_on_server, "file_size": file_size, "sha256": sha256, "deduplicated": not created
+        }), 201
+    except blob_store.BlobError as e:
+        conn.rollback()
+        logger.warning(f"Upload referenciando blob {sha256} recusado: {e}")
+        return jsonify({"message": str(e), "sha256": sha256}), e.status
+    except Exception as e:
+        # O blob colocado agora sai antes do rollback, enquanto a linha ainda está travada
+        if created:
+            blob_store.discard_temp(file_path_on_server)
+        elif tmp_path:
+            blob_store.discard_temp(tmp_path)
+        conn.rollback()
+        logger.error(f"Erro ao salvar metadados do arquivo no banco de dados: {str(e)}. Conteúdo do arquivo '{name}' descartado.", exc_info=True)
+        return jsonify({"message": "Erro ao salvar metadados do arquivo no banco de dados", "error": str(e)}), 500
+    finally:
+        cursor.close()
+        close_db_connection(conn)
+
+def _client_digest(value):
+    """SHA-256 informado pelo cliente, em minúsculas; lança ValueError se malformado."""
+    if not value:
+        return None
+    value = value.strip().lower()
+    if not blob_store.is_valid_digest(value):
+        raise ValueError("'sha256' deve ter 64 caracteres hexadecimais")
+    return value
+
+def _optional_id(data, field):
+    """Id opcional do corpo JSON (inteiro positivo); lança ValueError se inválido."""
+    value = data.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ValueError(f"'{field}' deve ser um inteiro positivo")
+    return value
+
 # POST /files - Upload de novo arquivo
 @files_bp.route('/', methods=['POST'])
 def upload_new_file():
     logger.info("Iniciando upload de novo arquivo.")
-    if 'file' not in request.files:
+    try:
+        client_sha256 = _client_digest(request.form.get('sha256'))
+    except ValueError as e:
+        logger.warning(f"Upload de arquivo: {e}")
+        return jsonify({"message": str(e)}), 400
+
+    if 'file' not in request.files and client_sha256 is None:
         logger.warning("Upload de arquivo: Nenhum arquivo na requisição.")
         return jsonify({"message": "Nenhum arquivo na requisição"}), 400
     
-    file = request.files['file']
-    if file.filename == '':
+    file = request.files.get('file')
+    if file is not None and file.filename == '':
         logger.warning("Upload de arquivo: Nenhum arquivo selecionado.")
         return jsonify({"message": "Nenhum arquivo selecionado"}), 400
     
-    name = request.form.get('name') or secure_filename(file.filename)
+    name = request.form.get('name') or (secure_filename(file.filename) if file else None)
     file_type = request.form.get('type')
     equipment_id = request.form.get('equipment_id', type=int)
     uploaded_by = request.form.get('uploaded_by', type=int)
@@ -100,48 +311,185 @@ def upload_new_file():
     if not file_type or file_type not in ['firmware', 'document']:
         logger.warning(f"Upload de arquivo: Tipo inválido ou ausente: '{file_type}'.")
         return jsonify({"message": "Tipo de arquivo inválido ou ausente. Use 'firmware' ou 'document'."}), 400
+
+    if file is None:
+        # Conteúdo já presente no servidor: só o registro é criado, sem reenviar os bytes
+        if not name:
+            logger.warning("Upload por referência sem 'name'.")
+            return jsonify({"message": "Campo 'name' é obrigatório ao referenciar conteúdo existente"}), 400
+        logger.info(f"Upload por referência ao blob {client_sha256}.")
+        return _save_file_record(name, file_type, equipment_id, uploaded_by, client_sha256)
     
-    if file:
-        filename = secure_filename(file.filename)
-        file_path_on_server = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        
-        try:
-            file.save(file_path_on_server)
-            file_size = os.path.getsize(file_path_on_server)
-            logger.info(f"Arquivo '{original_filename}' salvo em: {file_path_on_server}")
-        except Exception as e:
-            logger.error(f"Erro ao salvar o arquivo físico: {str(e)}", exc_info=True)
-            return jsonify({"message": f"Erro ao salvar o arquivo: {str(e)}"}), 500
-        
-        conn = get_db_connection()
-        if conn is None:
-            logger.error("Falha ao obter conexão com o banco de dados para salvar metadados do arquivo.")
-            if os.path.exists(file_path_on_server):
-                os.remove(file_path_on_server)
-                logger.warning(f"Arquivo '{filename}' removido após falha na conexão com DB.")
-            return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
-        
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                "INSERT INTO arquivos (name, type, equipment_id, file_url, file_size, uploaded_by) VALUES (%s, %s, %s, %s, %s, %s)",
-                (name, file_type, equipment_id, file_path_on_server, file_size, uploaded_by)
-            )
-            conn.commit()
-            logger.info(f"Metadados do arquivo '{name}' salvos com sucesso, ID: {cursor.lastrowid}.")
-            return jsonify({"message": "Arquivo uploaded e metadados salvos com sucesso", "id": cursor.lastrowid, "file_url": file_path_on_server}), 201
-        except Exception as e:
-            if os.path.exists(file_path_on_server):
-                os.remove(file_path_on_server)
-                logger.error(f"Erro ao salvar metadados do arquivo no banco de dados: {str(e)}. Arquivo '{filename}' removido.", exc_info=True)
-            return jsonify({"message": "Erro ao salvar metadados do arquivo no banco de dados", "error": str(e)}), 500
-        finally:
-            cursor.close()
-            close_db_connection(conn)
+    try:
+        tmp_path, sha256, file_size = blob_store.write_temp(file.stream)
+        logger.info(f"Arquivo '{file.filename}' recebido ({file_size} bytes, sha256 {sha256}).")
+    except Exception as e:
+        logger.error(f"Erro ao salvar o arquivo físico: {str(e)}", exc_info=True)
+        return jsonify({"message": f"Erro ao salvar o arquivo: {str(e)}"}), 500
+
+    if client_sha256 and client_sha256 != sha256:
+        blob_store.discard_temp(tmp_path)
+        logger.warning(f"Upload de '{file.filename}' com SHA-256 divergente: informado {client_sha256}, recebido {sha256}.")
+        return jsonify({"message": "SHA-256 do conteúdo recebido não confere com o informado", "sha256": sha256}), 422
     
-    logger.error("Erro desconhecido no upload do arquivo.")
-    return jsonify({"message": "Erro desconhecido no upload do arquivo"}), 500
+    return _save_file_record(name, file_type, equipment_id, uploaded_by, sha256, file_size, tmp_path)
+
+
+# POST /files/uploads - Inicia um upload em partes (retomável)
+@files_bp.route('/uploads', methods=['POST'])
+def initiate_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    original_filename = data.get('filename')
+    file_type = data.get('type')
+    total_size = data.get('total_size')
+    logger.info(f"Iniciando upload em partes para '{original_filename}' ({total_size} bytes).")
+
+    if not original_filename or not secure_filename(original_filename):
+        logger.warning("Upload em partes: 'filename' ausente ou inválido.")
+        return jsonify({"message": "Campo 'filename' é obrigatório"}), 400
+    if not file_type or file_type not in ['firmware', 'document']:
+        logger.warning(f"Upload em partes: Tipo inválido ou ausente: '{file_type}'.")
+        return jsonify({"message": "Tipo de arquivo inválido ou ausente. Use 'firmware' ou 'document'."}), 400
+    try:
+        # Validados já na abertura: um valor inválido só seria recusado pelo banco
+        # na conclusão, depois de o cliente enviar o arquivo inteiro
+        client_sha256 = _client_digest(data.get('sha256'))
+        equipment_id = _optional_id(data, 'equipment_id')
+        uploaded_by = _optional_id(data, 'uploaded_by')
+        name = data.get('name') or secure_filename(original_filename)
+        if not isinstance(name, str) or len(name) > 255:
+            raise ValueError("'name' deve ser texto de até 255 caracteres")
+    except ValueError as e:
+        logger.warning(f"Upload em partes: {e}")
+        return jsonify({"message": str(e)}), 400
 
+    metadata = {
+        'filename': original_filename,
+        'name': name,
+        'type': file_type,
+        'equipment_id': equipment_id,
+        'uploaded_by': uploaded_by,
+        'sha256': client_sha256,
+    }
+    try:
+        session = chunked_upload.create_session(metadata, total_size)
+    except chunked_upload.UploadSessionError as e:
+        logger.warning(f"Upload em partes recusado: {e}")
+        return jsonify({"message": str(e)}), e.status
+    except OSError as e:
+        logger.error(f"Erro ao criar sessão de upload: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao criar sessão de upload", "error": str(e)}), 500
+    return jsonify(_session_status(session)), 201
+
+def _session_status(session):
+    return {
+        "upload_id": session['upload_id'],
+        "offset": session['offset'],
+        "total_size": session['total_size'],
+        "complete": session['complete'],
+        "expires_at": session['expires_at'],
+        "max_chunk_size": current_app.config['MAX_CONTENT_LENGTH'],
+    }
+
+# GET /files/uploads/:upload_id - Consulta o progresso (offset para retomar)
+@files_bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_chunked_upload_status(upload_id):
+    try:
+        session = chunked_upload.load_session(upload_id)
+    except chunked_upload.UploadSessionError as e:
+        return jsonify({"message": str(e)}), e.status
+    return jsonify(_session_status(session)), 200
+
+# PUT /files/uploads/:upload_id - Envia um trecho (corpo binário, cabeçalho Upload-Offset ou ?offset=)
+@files_bp.route('/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        logger.warning(f"Trecho do upload {upload_id} sem offset válido.")
+        return jsonify({"message": "Informe o offset do trecho no cabeçalho 'Upload-Offset' ou em '?offset='"}), 400
+
+    try:
+        new_offset = chunked_upload.append_chunk(upload_id, offset, request.stream, request.content_length)
+    except chunked_upload.UploadSessionError as e:
+        logger.warning(f"Trecho recusado no upload {upload_id}: {e}")
+        body = {"message": str(e)}
+        if e.offset is not None:
+            body["offset"] = e.offset
+        return jsonify(body), e.status
+    except OSError as e:
+        logger.error(f"Erro ao gravar trecho do upload {upload_id}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao gravar trecho", "error": str(e)}), 500
+    logger.debug(f"Upload {upload_id}: recebidos bytes até o offset {new_offset}.")
+    return jsonify({"upload_id": upload_id, "offset": new_offset}), 200
+
+# POST /files/uploads/:upload_id/complete - Conclui o upload e cria o registro em arquivos
+@files_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_chunked_upload(upload_id):
+    logger.info(f"Concluindo upload em partes {upload_id}.")
+    tmp_path = None
+    try:
+        tmp_path = blob_store.new_temp_path()
+        # O SHA-256 foi calculado enquanto os trechos chegavam; aqui só é finalizado
+        session, sha256 = chunked_upload.finalize_session(upload_id, tmp_path)
+        file_size = session['total_size']
+    except chunked_upload.UploadSessionError as e:
+        logger.warning(f"Conclusão do upload {upload_id} recusada: {e}")
+        body = {"message": str(e)}
+        if e.offset is not None:
+            body["offset"] = e.offset
+        return jsonify(body), e.status
+    except OSError as e:
+        if tmp_path:
+            blob_store.discard_temp(tmp_path)
+        logger.error(f"Erro ao montar o arquivo do upload {upload_id}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao concluir upload", "error": str(e)}), 500
+
+    if session.get('sha256') and session['sha256'] != sha256:
+        blob_store.discard_temp(tmp_path)
+        logger.warning(f"Upload {upload_id} com SHA-256 divergente: informado {session['sha256']}, recebido {sha256}.")
+        return jsonify({"message": "SHA-256 do conteúdo recebido não confere com o informado", "sha256": sha256}), 422
+
+    logger.info(f"Upload {upload_id} montado ({file_size} bytes, sha256 {sha256}).")
+    return _save_file_record(
+        session['name'], session['type'], session['equipment_id'], session['uploaded_by'],
+        sha256, file_size, tmp_path
+    )
+
+# GET /files/blobs/:sha256 - Verifica se o servidor já tem um conteúdo (HEAD também é aceito)
+@files_bp.route('/blobs/<sha256>', methods=['GET'])
+def get_blob(sha256):
+    sha256 = sha256.lower()
+    if not blob_store.is_valid_digest(sha256):
+        return jsonify({"message": "'sha256' deve ter 64 caracteres hexadecimais"}), 400
+    conn = get_db_connection()
+    if conn is None:
+        logger.error(f"Falha ao obter conexão com o banco de dados para consultar o blob {sha256}.")
+        return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
+    
+    cursor = conn.cursor()
+    try:
+        blob = blob_store.describe(cursor, sha256)
+        if blob is None:
+            return jsonify({"message": "Conteúdo não encontrado no servidor"}), 404
+        return jsonify(blob), 200
+    except Exception as e:
+        logger.error(f"Erro ao consultar o blob {sha256}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao consultar conteúdo", "error": str(e)}), 500
+    finally:
+        cursor.close()
+        close_db_connection(conn)
+
+# DELETE /files/uploads/:upload_id - Cancela um upload em partes
+@files_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    try:
+        chunked_upload.discard_session(upload_id)
+    except chunked_upload.UploadSessionError as e:
+        return jsonify({"message": str(e)}), e.status
+    logger.info(f"Upload em partes {upload_id} cancelado.")
+    return jsonify({"message": "Upload cancelado"}), 200
 
 # PUT /files/:id - Atualizar metadados do arquivo
 @files_bp.route('/<int:id>', methods=['PUT'])
@@ -186,11 +534,22 @@ def update_file_metadata(id):
         sql_query = "UPDATE arquivos SET " + ", ".join(set_clauses) + " WHERE id = %s"
         params.append(id)
 
+        previous_type = None
+        if file_type is not None:
+            # Tipo anterior, para mover o arquivo entre os contadores por tipo
+            cursor.execute("SELECT type FROM arquivos WHERE id = %s FOR UPDATE", (id,))
+            row = cursor.fetchone()
+            previous_type = row['type'] if row else None
         cursor.execute(sql_query, tuple(params))
+        updated = cursor.rowcount
+        if updated and previous_type and previous_type != file_type:
+            stats_summary.adjust(cursor, {stats_summary.file_type_key(previous_type): -1,
+                                          stats_summary.file_type_key(file_type): 1})
         conn.commit()
-        if cursor.rowcount == 0:
+        if updated == 0:
             logger.warning(f"Arquivo ID {id} não encontrado para atualização de metadados.")
             return jsonify({"message": "Arquivo não encontrado para atualização"}), 404
+        response_cache.invalidate('files', id)
         logger.info(f"Metadados do arquivo ID {id} atualizados com sucesso.")
         return jsonify({"message": "Metadados do arquivo atualizados com sucesso"}), 200
     except Exception as e:
@@ -211,8 +570,9 @@ def delete_file(id):
     
     cursor = conn.cursor()
     file_path = None
+    released = None
     try:
-        cursor.execute("SELECT file_url FROM arquivos WHERE id = %s", (id,))
+        cursor.execute("SELECT file_url, sha256, type, download_count FROM arquivos WHERE id = %s FOR UPDATE", (id,))
         file_data = cursor.fetchone()
         
         if not file_data:
@@ -222,10 +582,21 @@ def delete_file(id):
         file_path = file_data['file_url']
         
         cursor.execute("DELETE FROM arquivos WHERE id = %s", (id,))
+        if cursor.rowcount:
+            stats_summary.adjust(cursor, {'arquivos': -1, stats_summary.file_type_key(file_data['type']): -1,
+                                          'downloads': -(file_data['download_count'] or 0)})
+        if file_data['sha256']:
+            # O blob só sai do disco quando a última referência é removida
+            released = blob_store.release_reference(cursor, file_data['sha256'])
         conn.commit()
+        blob_store.purge_released(released)
+        released = None
+        response_cache.invalidate('files', id)
         logger.info(f"Registro do arquivo ID {id} excluído do banco de dados.")
 
-        if file_path and os.path.exists(file_path):
+        if file_data['sha256']:
+            logger.info(f"Referência ao blob {file_data['sha256']} removida.")
+        elif file_path and os.path.exists(file_path):
             try:
                 os.remove(file_path)
                 logger.info(f"Arquivo físico '{file_path}' deletado do sistema de arquivos.")
@@ -236,13 +607,14 @@ def delete_file(id):
         
         return jsonify({"message": "Arquivo excluído com sucesso"}), 200
     except Exception as e:
+        blob_store.restore_released(released)
         logger.error(f"Erro ao excluir arquivo ID {id}: {e}", exc_info=True)
         return jsonify({"message": "Erro ao excluir arquivo", "error": str(e)}), 500
     finally:
         cursor.close()
         close_db_connection(conn)
 
-# GET /files/:id/download - Download do arquivo
+# GET /files/:id/download - Download do arquivo (com suporte a Range e offload para o proxy)
 @files_bp.route('/<int:id>/download', methods=['GET'])
 def download_file(id):
     logger.info(f"Iniciando download para arquivo ID: {id}.")
@@ -253,33 +625,41 @@ def download_file(id):
     
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT name, file_url FROM arquivos WHERE id = %s", (id,))
+        cursor.execute("SELECT name, file_url, sha256 FROM arquivos WHERE id = %s", (id,))
         file_data = cursor.fetchone()
-        
-        if not file_data:
-            logger.warning(f"Arquivo ID {id} não encontrado para download.")
-            return jsonify({"message": "Arquivo não encontrado"}), 404
-        
-        filename = file_data['name']
-        file_path = file_data['file_url']
-        
-        directory = os.path.dirname(file_path)
-        file_basename = os.path.basename(file_path)
-
-        if not os.path.exists(file_path):
-             logger.warning(f"Arquivo físico '{file_path}' para ID {id} não encontrado no servidor.")
-             return jsonify({"message": "Arquivo físico não encontrado no servidor"}), 404
-
-        logger.info(f"Preparando download do arquivo '{filename}' (ID: {id}) de {file_path}.")
-        return send_from_directory(directory, file_basename, as_attachment=True, download_name=filename)
     except Exception as e:
         logger.error(f"Erro ao preparar download do arquivo ID {id}: {e}", exc_info=True)
         return jsonify({"message": "Erro ao preparar download do arquivo", "error": str(e)}), 500
     finally:
         cursor.close()
-        close_db_connection(conn)
+        # Devolve a conexão ao pool antes de transmitir o primeiro byte
+        release_request_connection()
+        
+    if not file_data:
+        logger.warning(f"Arquivo ID {id} não encontrado para download.")
+        return jsonify({"message": "Arquivo não encontrado"}), 404
+    
+    filename = file_data['name']
+    file_path = file_data['file_url']
+
+    if not os.path.isfile(file_path):
+        logger.warning(f"Arquivo físico '{file_path}' para ID {id} não encontrado no servidor.")
+        return jsonify({"message": "Arquivo físico não encontrado no servidor"}), 404
+
+    try:
+        response, includes_start = send_file_ranged(file_path, filename, file_data['sha256'])
+    except OSError as e:
+        logger.error(f"Erro ao abrir o arquivo '{file_path}' para download do ID {id}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao preparar download do arquivo", "error": str(e)}), 500
+
+    # Retomadas (Range a partir do meio do arquivo) não contam como um novo download
+    if includes_start and request.method == 'GET':
+        download_counter.add(id)
+    logger.info(f"Download do arquivo '{filename}' (ID: {id}) iniciado com status {response.status_code}.")
+    return response
 
 # POST /files/:id/download - Incrementar contador de downloads
+# O incremento é agregado em memória e gravado em lote (ver download_counter.py).
 @files_bp.route('/<int:id>/download', methods=['POST'])
 def increment_download_count(id):
     logger.info(f"Incrementando contador de downloads para arquivo ID: {id}.")
@@ -290,23 +670,26 @@ def increment_download_count(id):
     
     cursor = conn.cursor()
     try:
-        cursor.execute(
-            "UPDATE arquivos SET download_count = download_count + 1 WHERE id = %s",
-            (id,)
-        )
-        conn.commit()
-        if cursor.rowcount == 0:
+        def read_stored():
+            conn.commit()  # Cada tentativa lê um snapshot novo
+            cursor.execute("SELECT download_count FROM arquivos WHERE id = %s", (id,))
+            file_data = cursor.fetchone()
+            return file_data['download_count'] if file_data else None
+
+        # Gravado + pendente deste processo, lidos de forma consistente com os flushes
+        current = download_counter.read_total(id, read_stored)
+        if current is None:
             logger.warning(f"Arquivo ID {id} não encontrado para incrementar download.")
             return jsonify({"message": "Arquivo não encontrado para incrementar download"}), 404
         
-        cursor.execute("SELECT download_count FROM arquivos WHERE id = %s", (id,))
-        new_count = cursor.fetchone()
+        pending = download_counter.add(id)
+        new_count = current + 1
         
-        logger.info(f"Contador de downloads para arquivo ID {id} incrementado para: {new_count[0] if new_count else 'N/A'}.")
-        return jsonify({"message": "Contador de downloads incrementado", "new_download_count": new_count[0] if new_count else None}), 200
+        logger.info(f"Contador de downloads para arquivo ID {id} incrementado para: {new_count} ({pending} pendente(s) de gravação).")
+        return jsonify({"message": "Contador de downloads incrementado", "new_download_count": new_count}), 200
     except Exception as e:
         logger.error(f"Erro ao incrementar contador de downloads para arquivo ID {id}: {e}", exc_info=True)
         return jsonify({"message": "Erro ao incrementar contador de downloads", "error": str(e)}), 500
     finally:
         cursor.close()
-        close_db_connection(conn)
\ No newline at end of file
+        close_db_connection(conn)
@@ -1,18 +1,66 @@
 import os
 from flask import Blueprint, request, jsonify, current_app
-from database import get_db_connection, close_db_connection
+from database import get_db_connection, close_db_connection, release_request_connection
+from pagination import PaginationError, parse_pagination_args, apply_keyset, build_page, parse_id_list, apply_id_list, build_batch
+from export import ExportError, parse_export_format, stream_export
+from fields import FieldsError, parse_fields, select_columns, project
+import bulk_import
+import json_provider
+import suggest_index
+from cache import response_cache
+from conditional import is_conditional, not_modified, with_validators, item_validators, rows_validators, probe_list_validators
 from werkzeug.utils import secure_filename
+import storage_layout
+import image_variants
+import stats_summary
 import logging # Importa o módulo logging
 
 manufacturers_bp = Blueprint('manufacturers', __name__)
 # Obtém o logger para este blueprint (o nome pode ser o nome do blueprint ou algo mais específico)
 logger = logging.getLogger('api_jatoba.manufacturers')
 
+# Campos aceitos em ?fields= (colunas da listagem e do registro individual)
+LIST_FIELDS = ('id', 'name', 'logo_url', 'created_at', 'updated_at')
+ITEM_FIELDS = ('id', 'name', 'logo_url', 'logo_variants', 'created_at', 'updated_at')
+# Lidas sempre: id (paginação e ordem do ?ids=) e updated_at (ETag)
+REQUIRED_FIELDS = ('id', 'updated_at')
 
-# GET /manufacturers - Listar todos os fabricantes
+
+def _get_manufacturers_by_ids(cursor, ids, fields):
+    """Busca por ?ids=: uma consulta para todos os IDs, com a resposta na ordem pedida."""
+    sql_query, query_params = apply_id_list(
+        f"SELECT {select_columns(ITEM_FIELDS, fields, REQUIRED_FIELDS)} FROM fabricantes",
+        [], [], ids
+    )
+    cursor.execute(sql_query, query_params)
+    rows = cursor.fetchall()
+    validators = rows_validators('fabricantes', rows)
+    unchanged = not_modified(*validators)
+    if unchanged:
+        logger.info("Busca de fabricantes por lista de IDs não modificada (304).")
+        return unchanged
+    for row in rows:
+        if 'logo_variants' in row:
+            row['logo_variants'] = image_variants.public_variants(row['logo_variants'])
+    logger.info(f"Busca por lista de IDs: {len(rows)} de {len(ids)} fabricantes encontrados.")
+    body = build_batch(rows, ids)
+    project(body['items'], fields)
+    return with_validators(jsonify(body), *validators), 200
+
+# GET /manufacturers - Listar fabricantes (paginado por ?limit=&after=)
+# GET /manufacturers?ids=1,2,3 - Buscar vários fabricantes de uma vez
 @manufacturers_bp.route('/', methods=['GET'])
+@response_cache.cached('manufacturers')
 def get_all_manufacturers():
-    logger.info("Iniciando listagem de todos os fabricantes.")
+    logger.info("Iniciando listagem de fabricantes.")
+    try:
+        ids = parse_id_list(request.args)
+        limit, after_id = parse_pagination_args(request.args)
+        fields = parse_fields(request.args, ITEM_FIELDS if ids is not None else LIST_FIELDS)
+    except (PaginationError, FieldsError) as e:
+        logger.warning(f"Listagem de fabricantes com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
     conn = get_db_connection()
     if conn is None:
         logger.error("Falha ao obter conexão com o banco de dados para listar fabricantes.")
@@ -20,10 +68,26 @@ def get_all_manufacturers():
     
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, name, logo_url, created_at, updated_at FROM fabricantes")
-        manufacturers = cursor.fetchall()
-        logger.info(f"Listados {len(manufacturers)} fabricantes.")
-        return jsonify(manufacturers), 200
+        if ids is not None:
+            return _get_manufacturers_by_ids(cursor, ids, fields)
+        if is_conditional():
+            probe_sql, probe_params = apply_keyset("SELECT id, updated_at FROM fabricantes", [], [], after_id, limit)
+            unchanged = not_modified(*probe_list_validators(cursor, 'fabricantes', probe_sql, probe_params))
+            if unchanged:
+                logger.info("Listagem de fabricantes não modificada (304).")
+                return unchanged
+
+        sql_query, params = apply_keyset(
+            f"SELECT {select_columns(LIST_FIELDS, fields, REQUIRED_FIELDS)} FROM fabricantes",
+            [], [], after_id, limit
+        )
+        cursor.execute(sql_query, params)
+        rows = cursor.fetchall()
+        validators = rows_validators('fabricantes', rows)
+        page = build_page(rows, limit)
+        project(page['items'], fields)
+        logger.info(f"Listados {len(page['items'])} fabricantes.")
+        return with_validators(jsonify(page), *validators), 200
     except Exception as e:
         logger.error(f"Erro ao listar fabricantes: {e}", exc_info=True) # exc_info=True para incluir stack trace
         return jsonify({"message": "Erro ao listar fabricantes", "error": str(e)}), 500
@@ -31,10 +95,50 @@ def get_all_manufacturers():
         cursor.close()
         close_db_connection(conn)
 
+# GET /manufacturers/export?format=ndjson|csv - Exportação completa em streaming
+@manufacturers_bp.route('/export', methods=['GET'])
+def export_manufacturers():
+    try:
+        fmt = parse_export_format(request.args)
+        columns = parse_fields(request.args, LIST_FIELDS) or list(LIST_FIELDS)
+    except (ExportError, FieldsError) as e:
+        logger.warning(f"Exportação de fabricantes com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
+    logger.info(f"Iniciando exportação de fabricantes em {fmt}.")
+    try:
+        return stream_export(
+            f"SELECT {', '.join(columns)} FROM fabricantes ORDER BY id",
+            (), columns, fmt, 'fabricantes'
+        )
+    except Exception as e:
+        logger.error(f"Erro ao exportar fabricantes: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao exportar fabricantes", "error": str(e)}), 500
+
+# POST /manufacturers/bulk - Importação em lote (array JSON ou NDJSON)
+@manufacturers_bp.route('/bulk', methods=['POST'])
+def bulk_import_manufacturers():
+    try:
+        body, status = bulk_import.run('manufacturers')
+    except bulk_import.BulkImportError as e:
+        logger.warning(f"Importação em lote de fabricantes recusada: {e}")
+        return jsonify({"message": str(e)}), e.status
+    except Exception as e:
+        logger.error(f"Erro na importação em lote de fabricantes: {e}", exc_info=True)
+        return jsonify({"message": "Erro na importação em lote de fabricantes", "error": str(e)}), 500
+    return json_provider.jsonify_large(body, 'results'), status
+
 # GET /manufacturers/:id - Obter fabricante específico
 @manufacturers_bp.route('/<int:id>', methods=['GET'])
+@response_cache.cached('manufacturers', item_arg='id')
 def get_manufacturer_by_id(id):
     logger.info(f"Buscando fabricante com ID: {id}.")
+    try:
+        fields = parse_fields(request.args, ITEM_FIELDS)
+    except FieldsError as e:
+        logger.warning(f"Busca do fabricante {id} com parâmetros inválidos: {e}")
+        return jsonify({"message": str(e)}), 400
+
     conn = get_db_connection()
     if conn is None:
         logger.error(f"Falha ao obter conexão com o banco de dados para buscar fabricante {id}.")
@@ -42,11 +146,19 @@ def get_manufacturer_by_id(id):
     
     cursor = conn.cursor()
     try:
-        cursor.execute("SELECT id, name, logo_url, created_at, updated_at FROM fabricantes WHERE id = %s", (id,))
+        cursor.execute(f"SELECT {select_columns(ITEM_FIELDS, fields, REQUIRED_FIELDS)} FROM fabricantes WHERE id = %s", (id,))
         manufacturer = cursor.fetchone()
         if manufacturer:
-            logger.info(f"Fabricante ID {id} encontrado: {manufacturer['name']}.")
-            return jsonify(manufacturer), 200
+            validators = item_validators('fabricantes', manufacturer)
+            unchanged = not_modified(*validators)
+            if unchanged:
+                logger.info(f"Fabricante ID {id} não modificado (304).")
+                return unchanged
+            logger.info(f"Fabricante ID {id} encontrado: {manufacturer.get('name', '-')}.")
+            if 'logo_variants' in manufacturer:
+                manufacturer['logo_variants'] = image_variants.public_variants(manufacturer['logo_variants'])
+            project([manufacturer], fields)
+            return with_validators(jsonify(manufacturer), *validators), 200
         logger.warning(f"Fabricante ID {id} não encontrado.")
         return jsonify({"message": "Fabricante não encontrado"}), 404
     except Exception as e:
@@ -79,8 +191,11 @@ def create_manufacturer():
             "INSERT INTO fabricantes (name, logo_url) VALUES (%s, %s)",
             (name, logo_url)
         )
-        conn.commit()
         new_id = cursor.lastrowid
+        stats_summary.adjust(cursor, {'fabricantes': 1})
+        conn.commit()
+        suggest_index.index_manufacturer(new_id, name)
+        response_cache.invalidate('manufacturers')
         logger.info(f"Fabricante '{name}' criado com sucesso, ID: {new_id}.")
         return jsonify({"message": "Fabricante criado com sucesso", "id": new_id}), 201
     except Exception as e:
@@ -105,14 +220,23 @@ def update_manufacturer(id):
     
     cursor = conn.cursor()
     try:
+        cursor.execute("SELECT logo_url FROM fabricantes WHERE id = %s", (id,))
+        previous = cursor.fetchone()
+        # As variantes só valem para o logo atual: descartadas se a URL mudar (o SET é
+        # avaliado da esquerda para a direita, então o IF ainda vê a URL anterior)
         cursor.execute(
-            "UPDATE fabricantes SET name = %s, logo_url = %s WHERE id = %s",
-            (name, logo_url, id)
+            "UPDATE fabricantes SET name = %s, logo_variants = IF(logo_url <=> %s, logo_variants, NULL), "
+            "logo_url = %s WHERE id = %s",
+            (name, logo_url, logo_url, id)
         )
         conn.commit()
         if cursor.rowcount == 0:
             logger.warning(f"Fabricante ID {id} não encontrado para atualização.")
             return jsonify({"message": "Fabricante não encontrado para atualização"}), 404
+        suggest_index.index_manufacturer(id, name)
+        response_cache.invalidate('manufacturers', id)
+        if previous and previous['logo_url'] != logo_url:
+            image_variants.requeue('logo', id, logo_url)
         logger.info(f"Fabricante ID {id} atualizado com sucesso.")
         return jsonify({"message": "Fabricante atualizado com sucesso"}), 200
     except Exception as e:
@@ -133,11 +257,19 @@ def delete_manufacturer(id):
     
     cursor = conn.cursor()
     try:
+        cursor.execute("SELECT logo_url, logo_variants FROM fabricantes WHERE id = %s", (id,))
+        row = cursor.fetchone()
         cursor.execute("DELETE FROM fabricantes WHERE id = %s", (id,))
+        deleted = cursor.rowcount
+        stats_summary.adjust(cursor, {'fabricantes': -deleted})
         conn.commit()
-        if cursor.rowcount == 0:
+        if deleted == 0:
             logger.warning(f"Fabricante ID {id} não encontrado para exclusão.")
             return jsonify({"message": "Fabricante não encontrado para exclusão"}), 404
+        suggest_index.remove_manufacturer(id)
+        if row and image_variants.remove_all(row['logo_url'], row['logo_variants']):
+            logger.info(f"Arquivo de logo '{row['logo_url']}' do fabricante {id} removido.")
+        response_cache.invalidate('manufacturers', id)
         logger.info(f"Fabricante ID {id} excluído com sucesso.")
         return jsonify({"message": "Fabricante excluído com sucesso"}), 200
     except Exception as e:
@@ -163,10 +295,10 @@ def upload_manufacturer_logo(id):
     if logo:
         original_filename = logo.filename
         filename = secure_filename(f"manufacturer_logo_{id}_{original_filename}")
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        file_path = storage_layout.storage_path('logos', filename)
         
         try:
-            logo.save(file_path)
+            storage_layout.save_upload(logo, file_path)
             logger.info(f"Logo '{original_filename}' salvo para fabricante {id} em: {file_path}")
         except Exception as e:
             logger.error(f"Erro ao salvar o arquivo de logo para fabricante {id}: {str(e)}", exc_info=True)
@@ -184,7 +316,7 @@ def upload_manufacturer_logo(id):
         cursor = conn.cursor()
         try:
             cursor.execute(
-                "UPDATE fabricantes SET logo_url = %s WHERE id = %s",
+                "UPDATE fabricantes SET logo_url = %s, logo_variants = NULL WHERE id = %s",
                 (file_path, id)
             )
             conn.commit()
@@ -195,6 +327,9 @@ def upload_manufacturer_logo(id):
                     logger.warning(f"Fabricante ID {id} não encontrado para associar logo. Arquivo '{filename}' removido.")
                 return jsonify({"message": "Fabricante não encontrado para associar o logo"}), 404
             
+            response_cache.invalidate('manufacturers', id)
+            # Miniaturas e variantes são geradas fora da requisição
+            image_variants.variant_pool.submit('logo', id, file_path)
             logger.info(f"URL do logo para fabricante {id} atualizada no banco de dados para: {file_path}.")
             return jsonify({"message": "Logo do fabricante uploaded e atualizado com sucesso", "logo_url": file_path}), 200
         except Exception as e:
@@ -208,4 +343,33 @@ def upload_manufacturer_logo(id):
             close_db_connection(conn)
     
     logger.error(f"Erro desconhecido no upload do logo para fabricante ID: {id}.")
-    return jsonify({"message": "Erro desconhecido no upload do logo"}), 500
\ No newline at end of file
+    return jsonify({"message": "Erro desconhecido no upload do logo"}), 500
+
+# GET /manufacturers/:id/logo?size=160 - Serve o logo (a menor variante que atende ao tamanho pedido)
+@manufacturers_bp.route('/<int:id>/logo', methods=['GET'])
+def get_manufacturer_logo(id):
+    try:
+        size = image_variants.parse_size(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    conn = get_db_connection()
+    if conn is None:
+        logger.error(f"Falha ao obter conexão com o banco de dados para servir logo do fabricante {id}.")
+        return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
+    
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT logo_url, logo_variants FROM fabricantes WHERE id = %s", (id,))
+        row = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Erro ao buscar logo do fabricante {id}: {e}", exc_info=True)
+        return jsonify({"message": "Erro ao buscar logo", "error": str(e)}), 500
+    finally:
+        cursor.close()
+        # Devolve a conexão ao pool antes de transmitir a imagem
+        release_request_connection()
+
+    if not row or not row['logo_url']:
+        logger.warning(f"Logo do fabricante {id} não encontrado.")
+        return jsonify({"message": "Logo do fabricante não encontrado"}), 404
+    return image_variants.serve(row['logo_url'], row['logo_variants'], size)
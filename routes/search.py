@@ -1,18 +1,34 @@
+import time
 from flask import Blueprint, request, jsonify
+from config import Config
 from database import get_db_connection, close_db_connection
+import suggest_index
+from fields import FieldsError, parse_fields, select_columns, project
+from search_engine import (
+    SearchError, parse_search_args, manufacturers_search_sql, equipments_search_sql,
+    global_search_sql, split_global_results
+)
 import logging
 
 search_bp = Blueprint('search', __name__)
 logger = logging.getLogger('api_jatoba.search') # Logger específico para busca
 
-# GET /search?q=:query - Busca global em equipamentos e fabricantes
+# Campos aceitos em ?fields= (o score é sempre incluído)
+MANUFACTURER_FIELDS = ('id', 'name', 'logo_url')
+EQUIPMENT_FIELDS = ('id', 'name', 'model', 'manufacturer_id', 'image_url')
+GLOBAL_FIELDS = ('id', 'name', 'logo_url', 'model', 'manufacturer_id', 'image_url')
+
+# GET /search?q=:query - Busca global em equipamentos e fabricantes (uma única ida ao banco)
 @search_bp.route('/', methods=['GET'])
 def global_search():
     query = request.args.get('q')
     logger.info(f"Iniciando busca global com query: '{query}'.")
-    if not query:
-        logger.warning("Busca global: Parâmetro 'q' ausente.")
-        return jsonify({"message": "Parâmetro de busca 'q' é obrigatório"}), 400
+    try:
+        query, limit, offset = parse_search_args(request.args)
+        fields = parse_fields(request.args, GLOBAL_FIELDS)
+    except (SearchError, FieldsError) as e:
+        logger.warning(f"Busca global: {e}")
+        return jsonify({"message": str(e)}), 400
 
     conn = get_db_connection()
     if conn is None:
@@ -20,28 +36,31 @@ def global_search():
         return jsonify({"message": "Erro de conexão ao banco de dados"}), 500
     
     cursor = conn.cursor()
-    results = {}
     
     try:
-        # Busca em fabricantes
-        cursor.execute(
-            "SELECT id, name, logo_url FROM fabricantes WHERE name LIKE %s",
-            (f"%{query}%",)
-        )
-        manufacturers_found = cursor.fetchall()
-        results['manufacturers'] = manufacturers_found
-        logger.info(f"Busca global: Encontrados {len(manufacturers_found)} fabricantes para '{query}'.")
-
-        # Busca em equipamentos
-        cursor.execute(
-            "SELECT id, name, model, manufacturer_id, image_url FROM equipamentos WHERE name LIKE %s OR model LIKE %s",
-            (f"%{query}%", f"%{query}%")
+        # Uma linha a mais por tipo indica se há próxima página
+        mode, sql_query, params = global_search_sql(query, limit + 1, fields, offset)
+        cursor.execute(sql_query, params)
+        manufacturers_found, equipments_found = split_global_results(cursor.fetchall())
+        next_offset = {
+            "manufacturers": offset + limit if len(manufacturers_found) > limit else None,
+            "equipments": offset + limit if len(equipments_found) > limit else None,
+        }
+        manufacturers_found, equipments_found = manufacturers_found[:limit], equipments_found[:limit]
+        project(manufacturers_found, fields, keep=('score',))
+        project(equipments_found, fields, keep=('score',))
+        logger.info(
+            f"Busca global ({mode}): Encontrados {len(manufacturers_found)} fabricantes e "
+            f"{len(equipments_found)} equipamentos para '{query}'."
         )
-        equipments_found = cursor.fetchall()
-        results['equipments'] = equipments_found
-        logger.info(f"Busca global: Encontrados {len(equipments_found)} equipamentos para '{query}'.")
-
-        return jsonify(results), 200
+        return jsonify({
+            "manufacturers": manufacturers_found,
+            "equipments": equipments_found,
+            "mode": mode,
+            "limit": limit,
+            "offset": offset,
+            "next_offset": next_offset,
+        }), 200
     except Exception as e:
         logger.error(f"Erro na busca global para '{query}': {e}", exc_info=True)
         return jsonify({"message": "Erro na busca global", "error": str(e)}), 500
@@ -49,14 +68,30 @@ def global_search():
         cursor.close()
         close_db_connection(conn)
 
+def _run_paginated_search(cursor, mode, sql_query, params, limit, offset):
+    """Executa uma busca ranqueada e monta a página de resultados."""
+    cursor.execute(sql_query + " LIMIT %s OFFSET %s", tuple(params) + (limit + 1, offset))
+    rows = cursor.fetchall()
+    has_more = len(rows) > limit
+    return {
+        "items": rows[:limit],
+        "mode": mode,
+        "limit": limit,
+        "offset": offset,
+        "next_offset": offset + limit if has_more else None,
+    }
+
 # GET /search/manufacturers?q=:query - Busca específica em fabricantes
 @search_bp.route('/manufacturers', methods=['GET'])
 def search_manufacturers():
     query = request.args.get('q')
     logger.info(f"Iniciando busca em fabricantes com query: '{query}'.")
-    if not query:
-        logger.warning("Busca em fabricantes: Parâmetro 'q' ausente.")
-        return jsonify({"message": "Parâmetro de busca 'q' é obrigatório"}), 400
+    try:
+        query, limit, offset = parse_search_args(request.args)
+        fields = parse_fields(request.args, MANUFACTURER_FIELDS)
+    except (SearchError, FieldsError) as e:
+        logger.warning(f"Busca em fabricantes: {e}")
+        return jsonify({"message": str(e)}), 400
 
     conn = get_db_connection()
     if conn is None:
@@ -65,13 +100,10 @@ def search_manufacturers():
     
     cursor = conn.cursor()
     try:
-        cursor.execute(
-            "SELECT id, name, logo_url FROM fabricantes WHERE name LIKE %s",
-            (f"%{query}%",)
-        )
-        manufacturers = cursor.fetchall()
-        logger.info(f"Busca em fabricantes: Encontrados {len(manufacturers)} resultados para '{query}'.")
-        return jsonify(manufacturers), 200
+        mode, sql_query, params = manufacturers_search_sql(query, select_columns(MANUFACTURER_FIELDS, fields))
+        page = _run_paginated_search(cursor, mode, sql_query, params, limit, offset)
+        logger.info(f"Busca em fabricantes ({mode}): Encontrados {len(page['items'])} resultados para '{query}'.")
+        return jsonify(page), 200
     except Exception as e:
         logger.error(f"Erro na busca de fabricantes para '{query}': {e}", exc_info=True)
         return jsonify({"message": "Erro na busca de fabricantes", "error": str(e)}), 500
@@ -84,9 +116,12 @@ def search_manufacturers():
 def search_equipments():
     query = request.args.get('q')
     logger.info(f"Iniciando busca em equipamentos com query: '{query}'.")
-    if not query:
-        logger.warning("Busca em equipamentos: Parâmetro 'q' ausente.")
-        return jsonify({"message": "Parâmetro de busca 'q' é obrigatório"}), 400
+    try:
+        query, limit, offset = parse_search_args(request.args)
+        fields = parse_fields(request.args, EQUIPMENT_FIELDS)
+    except (SearchError, FieldsError) as e:
+        logger.warning(f"Busca em equipamentos: {e}")
+        return jsonify({"message": str(e)}), 400
 
     conn = get_db_connection()
     if conn is None:
@@ -95,16 +130,39 @@ def search_equipments():
     
     cursor = conn.cursor()
     try:
-        cursor.execute(
-            "SELECT id, name, model, manufacturer_id, image_url FROM equipamentos WHERE name LIKE %s OR model LIKE %s",
-            (f"%{query}%", f"%{query}%")
-        )
-        equipments = cursor.fetchall()
-        logger.info(f"Busca em equipamentos: Encontrados {len(equipments)} resultados para '{query}'.")
-        return jsonify(equipments), 200
+        mode, sql_query, params = equipments_search_sql(query, select_columns(EQUIPMENT_FIELDS, fields))
+        page = _run_paginated_search(cursor, mode, sql_query, params, limit, offset)
+        logger.info(f"Busca em equipamentos ({mode}): Encontrados {len(page['items'])} resultados para '{query}'.")
+        return jsonify(page), 200
     except Exception as e:
         logger.error(f"Erro na busca de equipamentos para '{query}': {e}", exc_info=True)
         return jsonify({"message": "Erro na busca de equipamentos", "error": str(e)}), 500
     finally:
         cursor.close()
-        close_db_connection(conn)
\ No newline at end of file
+        close_db_connection(conn)
+
+# GET /search/suggest?q=:query - Sugestões de autocompletar a partir do índice em memória
+@search_bp.route('/suggest', methods=['GET'])
+def suggest():
+    query = request.args.get('q', '')
+    kind = request.args.get('kind')
+    if not query.strip():
+        logger.warning("Sugestões: Parâmetro 'q' ausente.")
+        return jsonify({"message": "Parâmetro de busca 'q' é obrigatório"}), 400
+    if kind and kind not in (suggest_index.KIND_MANUFACTURER, suggest_index.KIND_EQUIPMENT):
+        logger.warning(f"Sugestões: tipo inválido '{kind}'.")
+        return jsonify({"message": "Parâmetro 'kind' inválido. Use 'manufacturer' ou 'equipment'."}), 400
+    try:
+        limit = min(max(int(request.args.get('limit') or Config.SUGGEST_LIMIT_DEFAULT), 1), Config.SUGGEST_LIMIT_MAX)
+    except ValueError:
+        return jsonify({"message": "Parâmetro 'limit' deve ser um número inteiro."}), 400
+
+    started = time.perf_counter()
+    items = suggest_index.index.suggest(query, limit=limit, kind=kind or None)
+    took_ms = (time.perf_counter() - started) * 1000
+    logger.debug(f"Sugestões para '{query}': {len(items)} itens em {took_ms:.2f}ms.")
+    return jsonify({
+        "items": items,
+        "ready": suggest_index.index.ready,
+        "took_ms": round(took_ms, 3),
+    }), 200
@@ -0,0 +1,125 @@
+import re
+from config import Config
+
+# Palavras como o parser do FULLTEXT as separa: operadores da sintaxe booleana
+# e pontuação ("S.A.", "x-y") ficam de fora
+_WORD = re.compile(r'\w+')
+
+MODE_FULLTEXT = 'fulltext'
+MODE_PREFIX = 'prefix'
+
+MANUFACTURER_COLUMNS = "id, name, logo_url"
+EQUIPMENT_COLUMNS = "id, name, model, manufacturer_id, image_url"
+
+
+class SearchError(ValueError):
+    """Parâmetros de busca inválidos (devem resultar em HTTP 400)."""
+
+
+def parse_search_args(args):
+    """Lê `q`, `limit` e `offset` da query string.
+
+    Retorna (query, limit, offset); o limite é restrito a SEARCH_PAGE_SIZE_MAX.
+    """
+    query = (args.get('q') or '').strip()
+    if not query:
+        raise SearchError("Parâmetro de busca 'q' é obrigatório")
+    try:
+        limit = int(args.get('limit') or Config.SEARCH_PAGE_SIZE_DEFAULT)
+        offset = int(args.get('offset') or 0)
+    except ValueError:
+        raise SearchError("Parâmetros 'limit' e 'offset' devem ser números inteiros.")
+    if limit < 1 or offset < 0:
+        raise SearchError("Parâmetros 'limit' e 'offset' devem ser positivos.")
+    return query, min(limit, Config.SEARCH_PAGE_SIZE_MAX), offset
+
+def build_boolean_query(query):
+    """Converte o texto digitado em uma expressão FULLTEXT em modo booleano.
+
+    O texto é dividido nos caracteres que não formam palavras, e cada termo
+    vira obrigatório e com curinga de prefixo (`+termo*`). Termos menores
+    que o tamanho mínimo indexado são ignorados pelo FULLTEXT, então são
+    descartados aqui; se nenhum sobrar, retorna None e a busca deve usar o
+    modo de prefixo.
+    """
+    terms = _WORD.findall(query)
+    terms = [term for term in terms if len(term) >= Config.SEARCH_MIN_TOKEN_SIZE]
+    if not terms:
+        return None
+    return ' '.join(f'+{term}*' for term in terms)
+
+def escape_like(value):
+    """Escapa os curingas do LIKE para buscas por prefixo literal."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def manufacturers_search_sql(query, columns=MANUFACTURER_COLUMNS):
+    """Retorna (modo, sql, params) da busca de fabricantes, sem LIMIT/OFFSET."""
+    boolean_query = build_boolean_query(query)
+    if boolean_query:
+        return MODE_FULLTEXT, (
+            f"SELECT {columns}, MATCH(name) AGAINST (%s IN BOOLEAN MODE) AS score "
+            "FROM fabricantes WHERE MATCH(name) AGAINST (%s IN BOOLEAN MODE) "
+            "ORDER BY score DESC, id"
+        ), [boolean_query, boolean_query]
+    # Consultas curtas: prefixo sobre o índice UNIQUE de name
+    return MODE_PREFIX, (
+        f"SELECT {columns}, IF(name = %s, 2, 1) AS score "
+        "FROM fabricantes WHERE name LIKE %s "
+        "ORDER BY score DESC, name, id"
+    ), [query, escape_like(query) + '%']
+
+def equipments_search_sql(query, columns=EQUIPMENT_COLUMNS):
+    """Retorna (modo, sql, params) da busca de equipamentos, sem LIMIT/OFFSET."""
+    boolean_query = build_boolean_query(query)
+    if boolean_query:
+        return MODE_FULLTEXT, (
+            f"SELECT {columns}, MATCH(name, model) AGAINST (%s IN BOOLEAN MODE) AS score "
+            "FROM equipamentos WHERE MATCH(name, model) AGAINST (%s IN BOOLEAN MODE) "
+            "ORDER BY score DESC, id"
+        ), [boolean_query, boolean_query]
+    # Consultas curtas: prefixo sobre os índices de name e model (index merge)
+    prefix = escape_like(query) + '%'
+    return MODE_PREFIX, (
+        f"SELECT {columns}, IF(name = %s OR model = %s, 2, 1) AS score "
+        "FROM equipamentos WHERE name LIKE %s OR model LIKE %s "
+        "ORDER BY score DESC, name, id"
+    ), [query, query, prefix, prefix]
+
+def global_search_sql(query, limit, fields=None, offset=0):
+    """Une as duas buscas em uma única query (UNION ALL), resolvida em uma ida ao banco.
+
+    Cada ramo tem seu próprio LIMIT/OFFSET (o mesmo `offset` nos dois); as colunas são alinhadas e a coluna
+    `kind` indica a origem de cada linha. Com `fields`, as colunas não
+    pedidas (exceto id e name, usados na ordenação) são lidas como NULL.
+    """
+    def column(name, expression, alias):
+        return f"{expression} AS {alias}" if fields is None or name in fields else f"NULL AS {alias}"
+
+    mode, manufacturers_sql, manufacturers_params = manufacturers_search_sql(
+        query, "'manufacturer' AS kind, id, name, NULL AS model, NULL AS manufacturer_id, "
+               + column('logo_url', 'logo_url', 'image_url')
+    )
+    _, equipments_sql, equipments_params = equipments_search_sql(
+        query, "'equipment' AS kind, id, name, " + ', '.join(
+            column(name, name, name) for name in ('model', 'manufacturer_id', 'image_url'))
+    )
+    sql = f"({manufacturers_sql} LIMIT %s OFFSET %s) UNION ALL ({equipments_sql} LIMIT %s OFFSET %s)"
+    params = manufacturers_params + [limit, offset] + equipments_params + [limit, offset]
+    return mode, sql, tuple(params)
+
+def split_global_results(rows):
+    """Separa as linhas do UNION ALL em fabricantes e equipamentos."""
+    manufacturers = []
+    equipments = []
+    for row in rows:
+        if row['kind'] == 'manufacturer':
+            manufacturers.append({
+                'id': row['id'], 'name': row['name'], 'logo_url': row['image_url'], 'score': row['score']
+            })
+        else:
+            equipments.append({
+                'id': row['id'], 'name': row['name'], 'model': row['model'],
+                'manufacturer_id': row['manufacturer_id'], 'image_url': row['image_url'], 'score': row['score']
+            })
+    return manufacturers, equipments
@@ -0,0 +1,118 @@
+"""Log de queries lentas, alimentado pelos cursores instrumentados de database.py.
+
+Statements acima de SLOW_QUERY_THRESHOLD_MS vão para o logger
+`api_jatoba.slow_queries` com o SQL normalizado (literais e listas de
+placeholders colapsados) e só o tipo/tamanho dos parâmetros, nunca os
+valores. Uma fração dos SELECTs lentos (SLOW_QUERY_EXPLAIN_RATE) também
+registra o EXPLAIN, no máximo uma vez por statement normalizado a cada
+SLOW_QUERY_EXPLAIN_INTERVAL segundos.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+import pymysql
+
+from config import Config
+import metrics
+
+logger = logging.getLogger('api_jatoba.slow_queries')
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|%\(\w+\)s')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES = re.compile(r'(\(\?, \.\.\.\)|\(\?\))(?:\s*,\s*\1)+')
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """SQL sem valores: `WHERE id IN (%s, %s, %s)` vira `WHERE id IN (?, ...)`."""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACES.sub(' ', sql).strip()
+    sql = _LIST.sub('(?, ...)', sql)
+    return _VALUES.sub(r'\1, ...', sql)
+
+def _describe(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+def redact_params(args):
+    """Tipos (e tamanhos) dos parâmetros, sem os valores."""
+    if args is None:
+        return None
+    if isinstance(args, dict):
+        return {key: _describe(value) for key, value in args.items()}
+    if isinstance(args, (list, tuple)):
+        if len(args) > 20:
+            return [_describe(value) for value in args[:20]] + [f"... +{len(args) - 20}"]
+        return [_describe(value) for value in args]
+    return _describe(args)
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=200, explain_rate=0.0, explain_interval=300):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._last_explain = {}  # SQL normalizado -> instante do último EXPLAIN
+
+    def _should_explain(self, normalized):
+        if self.explain_rate <= 0 or not normalized.upper().startswith('SELECT'):
+            return False
+        if random.random() >= self.explain_rate:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_explain.get(normalized, float('-inf')) < self.explain_interval:
+                return False
+            if len(self._last_explain) > 1024:
+                self._last_explain.clear()
+            self._last_explain[normalized] = now
+        return True
+
+    def _explain(self, connection, query, args):
+        # Cursor comum (não instrumentado), na mesma conexão e transação da query original
+        cursor = connection.cursor(pymysql.cursors.DictCursor)
+        try:
+            cursor.execute("EXPLAIN " + query, args)
+            return cursor.fetchall()
+        except pymysql.Error as e:
+            return f"indisponível: {e}"
+        finally:
+            cursor.close()
+
+    def record(self, query, args, elapsed, rows, connection=None):
+        """Avalia um statement concluído; `connection` permite o EXPLAIN (cursores bufferizados)."""
+        if self.threshold <= 0 or elapsed < self.threshold:
+            return False
+        normalized = normalize_sql(query)
+        name = metrics.query_name(query)
+        metrics.DB_SLOW_QUERIES.inc(query=name)
+        message = (f"Query lenta [{name}] {elapsed * 1000:.1f} ms, {rows} linhas: {normalized} "
+                   f"params={json.dumps(redact_params(args))}")
+        if connection is not None and self._should_explain(normalized):
+            plan = self._explain(connection, query, args)
+            message += f" explain={json.dumps(plan, default=str)}"
+        logger.warning(message)
+        return True
+
+
+slow_query_log = SlowQueryLog(
+    threshold_ms=Config.SLOW_QUERY_THRESHOLD_MS,
+    explain_rate=Config.SLOW_QUERY_EXPLAIN_RATE,
+    explain_interval=Config.SLOW_QUERY_EXPLAIN_INTERVAL,
+)
@@ -0,0 +1,146 @@
+"""Contadores materializados para GET /admin/stats (tabela `estatisticas`).
+
+Os handlers que criam/excluem registros e o contador de downloads ajustam os
+totais na mesma transação da alteração (`adjust`), então a leitura é uma
+consulta a poucas linhas, independente do tamanho de `arquivos`. Uma thread
+reconcilia periodicamente os totais com as tabelas reais (`reconcile`),
+corrigindo desvios de alterações feitas fora da API.
+"""
+import logging
+import random
+import threading
+
+from config import Config
+from database import pooled_connection
+
+logger = logging.getLogger('api_jatoba.stats')
+
+# Contadores fixos; os por tipo de arquivo são 'arquivos:<tipo>'
+KEYS = ('fabricantes', 'equipamentos', 'arquivos', 'downloads')
+FILE_TYPE_PREFIX = 'arquivos:'
+
+
+def file_type_key(file_type):
+    return f"{FILE_TYPE_PREFIX}{file_type}"
+
+def adjust(cursor, deltas):
+    """Soma `deltas` ({nome: incremento}) aos contadores, na transação do chamador.
+
+    As linhas são travadas sempre na mesma ordem (nomes ordenados). Um
+    contador ainda inexistente é criado sem `reconciled_at`, o que força a
+    reconciliação na próxima leitura.
+    """
+    changes = sorted((name, delta) for name, delta in deltas.items() if delta)
+    if not changes:
+        return
+    placeholders = ', '.join(['(%s, %s)'] * len(changes))
+    cursor.execute(
+        f"INSERT INTO estatisticas (name, value) VALUES {placeholders} "
+        "ON DUPLICATE KEY UPDATE value = value + VALUES(value)",
+        [value for change in changes for value in change]
+    )
+
+def _compute(cursor):
+    """Agregados completos a partir das tabelas reais (duas consultas)."""
+    cursor.execute(
+        "SELECT (SELECT COUNT(*) FROM fabricantes) AS fabricantes, "
+        "(SELECT COUNT(*) FROM equipamentos) AS equipamentos"
+    )
+    values = {name: int(total) for name, total in cursor.fetchone().items()}
+    cursor.execute("SELECT type, COUNT(*) AS total, COALESCE(SUM(download_count), 0) AS downloads "
+                   "FROM arquivos GROUP BY type")
+    values['arquivos'] = values['downloads'] = 0
+    for row in cursor.fetchall():
+        values[file_type_key(row['type'])] = int(row['total'])
+        values['arquivos'] += int(row['total'])
+        values['downloads'] += int(row['downloads'])
+    return values
+
+def reconcile(conn, min_age=0):
+    """Recalcula todos os contadores e grava os valores reais. Retorna os valores ou None.
+
+    As linhas de `estatisticas` são travadas antes da contagem: ajustes de
+    transações ainda abertas esperam e são aplicados sobre o valor
+    recalculado, sem se perder. Com `min_age`, não faz nada se outro
+    processo reconciliou há menos de `min_age` segundos.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT name, TIMESTAMPDIFF(SECOND, reconciled_at, NOW()) AS age "
+            "FROM estatisticas ORDER BY name FOR UPDATE"
+        )
+        current = {row['name']: row['age'] for row in cursor.fetchall()}
+        if min_age and current and all(age is not None and age < min_age for age in current.values()):
+            conn.rollback()
+            return None
+        values = _compute(cursor)
+        for name in current:
+            # Tipos de arquivo que deixaram de existir
+            values.setdefault(name, 0)
+        placeholders = ', '.join(['(%s, %s, NOW())'] * len(values))
+        cursor.execute(
+            f"INSERT INTO estatisticas (name, value, reconciled_at) VALUES {placeholders} "
+            "ON DUPLICATE KEY UPDATE value = VALUES(value), reconciled_at = VALUES(reconciled_at)",
+            [value for item in sorted(values.items()) for value in item]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    logger.info(f"Estatísticas reconciliadas: {values}")
+    return values
+
+def read(conn, fresh=False):
+    """Contadores no formato de GET /admin/stats, com a idade da última reconciliação."""
+    if fresh:
+        reconcile(conn)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT name, value, reconciled_at, TIMESTAMPDIFF(SECOND, reconciled_at, NOW()) AS age "
+            "FROM estatisticas"
+        )
+        rows = cursor.fetchall()
+        conn.commit()  # Encerra o snapshot de leitura
+    finally:
+        cursor.close()
+    if not fresh and (not rows or any(row['reconciled_at'] is None for row in rows)
+                      or not set(KEYS) <= {row['name'] for row in rows}):
+        # Tabela nova ou contador criado por um ajuste: recalcula uma vez
+        return read(conn, fresh=True)
+
+    values = {row['name']: int(row['value']) for row in rows}
+    oldest = max(rows, key=lambda row: row['age'])
+    return {
+        'total_manufacturers': values['fabricantes'],
+        'total_equipments': values['equipamentos'],
+        'total_files': values['arquivos'],
+        'total_downloads': values['downloads'],
+        'files_by_type': {name[len(FILE_TYPE_PREFIX):]: value for name, value in sorted(values.items())
+                          if name.startswith(FILE_TYPE_PREFIX) and value},
+        'reconciled_at': oldest['reconciled_at'],
+        'stale_seconds': oldest['age'],
+        'recomputed': fresh,
+    }
+
+
+def _reconcile_loop(stop_event):
+    interval = Config.STATS_RECONCILE_INTERVAL
+    # Atraso aleatório: os workers iniciados juntos não reconciliam ao mesmo tempo
+    stop_event.wait(random.uniform(0, interval))
+    while not stop_event.is_set():
+        try:
+            with pooled_connection() as conn:
+                reconcile(conn, min_age=interval / 2)
+        except Exception as e:
+            logger.error(f"Erro ao reconciliar as estatísticas: {e}", exc_info=True)
+        stop_event.wait(interval)
+
+def init_app(app):
+    """Inicia a reconciliação periódica (STATS_RECONCILE_INTERVAL > 0)."""
+    if Config.STATS_RECONCILE_INTERVAL <= 0:
+        return
+    threading.Thread(target=_reconcile_loop, args=(threading.Event(),), name='stats-reconcile', daemon=True).start()
@@ -0,0 +1,441 @@
+"""Varredura de consistência entre as pastas de upload e o banco.
+
+Encontra arquivos órfãos (nenhum registro aponta para eles) e registros
+pendentes (apontam para um arquivo que não existe). Roda em segundo plano
+(GC_ENABLED) ou pela linha de comando:
+
+    python storage_gc.py [--mode report|quarantine] [--batch-size 500]
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+from config import Config
+from database import pooled_connection
+import blob_store
+import chunked_upload
+import image_variants
+import storage_layout
+
+logger = logging.getLogger('api_jatoba.storage_gc')
+
+# Colunas que referenciam arquivos armazenados
+URL_COLUMNS = (('arquivos', 'file_url'), ('fabricantes', 'logo_url'), ('equipamentos', 'image_url'))
+
+# Uploads genéricos (/upload) não têm registro no banco: nunca são órfãos
+UNTRACKED_NAMESPACES = ('generic',)
+
+SAMPLE_LIMIT = 100
+
+
+def _tracked_paths(cursor, paths):
+    """Dos caminhos informados, os que algum registro referencia (uma consulta por lote).
+
+    Variantes de imagens (miniaturas, WebP) contam como referenciadas quando o original é.
+    """
+    owners = {path: image_variants.source_of(path) for path in paths}
+    lookup = sorted(set(paths) | {owner for owner in owners.values() if owner})
+    placeholders = ', '.join(['%s'] * len(lookup))
+    sql = " UNION ALL ".join(
+        f"SELECT {column} AS url FROM {table} WHERE {column} IN ({placeholders})"
+        for table, column in URL_COLUMNS
+    )
+    cursor.execute(sql, lookup * len(URL_COLUMNS))
+    found = {row['url'] for row in cursor.fetchall()}
+    return {path for path in paths if path in found or owners[path] in found}
+
+def _state_dir():
+    path = os.path.join(Config.UPLOAD_FOLDER, '.gc')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class StorageScanner:
+    """Varredura incremental com checkpoint em disco.
+
+    Cada passo processa até `batch_size` arquivos (em ordem estável de
+    diretórios e nomes) e consulta o banco uma vez por lote, com `IN (...)`
+    sobre as três colunas de URL. A posição é gravada em UPLOAD_FOLDER/.gc
+    ao fim de cada passo, de modo que uma varredura interrompida (deploy,
+    reinício do worker) continua de onde parou. `io_rate` limita os
+    arquivos examinados por segundo.
+    """
+
+    def __init__(self, mode='report', batch_size=500, io_rate=200, grace_period=3600):
+        if mode not in ('report', 'quarantine'):
+            raise ValueError("mode deve ser 'report' ou 'quarantine'")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.io_rate = io_rate
+        self.grace_period = grace_period
+        self.state_path = os.path.join(_state_dir(), 'state.json')
+        self.lock_path = os.path.join(_state_dir(), 'lock')
+        self.quarantine_root = os.path.join(Config.UPLOAD_FOLDER, '.quarantine')
+
+    # --- checkpoint -------------------------------------------------------
+
+    def _new_pass(self):
+        return {
+            'phase': 'files',
+            'root': 0,
+            'position': None,
+            'row_cursor': {},
+            'started_at': time.time(),
+            'counters': {'scanned_files': 0, 'orphans': 0, 'orphan_bytes': 0, 'quarantined': 0,
+                         'legacy_orphans': 0, 'scanned_rows': 0, 'dangling_rows': 0, 'dangling_blobs': 0},
+            'orphans': [],
+            'dangling': [],
+        }
+
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as state_file:
+                return json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return {'current': None, 'last_report': None}
+
+    def _save_state(self, state):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as state_file:
+            json.dump(state, state_file)
+        os.replace(tmp_path, self.state_path)
+
+    # --- percurso das pastas ------------------------------------------------
+
+    def _roots(self):
+        """Pastas varridas, com o rótulo usado na quarentena."""
+        roots = [('', Config.UPLOAD_FOLDER)]
+        if not Config.BLOB_FOLDER.startswith(os.path.join(Config.UPLOAD_FOLDER, '')):
+            roots.append(('blobs', Config.BLOB_FOLDER))
+        return roots
+
+    def _iter_files(self, root, after):
+        """Arquivos sob `root` em ordem estável, a partir do primeiro depois de `after`.
+
+        As posições são tuplas de componentes do caminho relativo; comparar
+        tuplas segue a mesma ordem do percurso em profundidade com nomes
+        ordenados, o que permite pular subárvores inteiras já varridas.
+        """
+        after = tuple(after) if after else None
+
+        def walk(directory, prefix):
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except FileNotFoundError:
+                return
+            for entry in entries:
+                position = prefix + (entry.name,)
+                if entry.is_dir(follow_symlinks=False):
+                    # Pastas internas (.chunked, .tmp, .gc, .quarantine) e namespaces sem registro
+                    if entry.name.startswith('.') or (not prefix and entry.name in UNTRACKED_NAMESPACES):
+                        continue
+                    if after and position < after[:len(position)]:
+                        continue
+                    yield from walk(entry.path, position)
+                elif entry.is_file(follow_symlinks=False):
+                    if after and position <= after:
+                        continue
+                    yield position, entry
+        yield from walk(root, ())
+
+    # --- consultas em lote --------------------------------------------------
+
+    def _known_blobs(self, cursor, digests):
+        if not digests:
+            return set()
+        placeholders = ', '.join(['%s'] * len(digests))
+        cursor.execute(f"SELECT sha256 FROM blobs WHERE sha256 IN ({placeholders})", list(digests))
+        return {row['sha256'] for row in cursor.fetchall()}
+
+    def _is_blob(self, path):
+        return (path.startswith(os.path.join(Config.BLOB_FOLDER, ''))
+                and blob_store.is_valid_digest(os.path.basename(path))
+                and path == blob_store.blob_path(os.path.basename(path)))
+
+    # --- quarentena ---------------------------------------------------------
+
+    def _quarantine(self, conn, label, root, path):
+        """Move o órfão para .quarantine/, preservando o caminho relativo (restaurável)."""
+        cursor = conn.cursor()
+        try:
+            if self._is_blob(path):
+                # Trava a chave do blob: um upload do mesmo conteúdo espera a movimentação terminar
+                cursor.execute("SELECT sha256 FROM blobs WHERE sha256 = %s FOR UPDATE", (os.path.basename(path),))
+                still_orphan = cursor.fetchone() is None
+            else:
+                still_orphan = not _tracked_paths(cursor, [path])
+            if still_orphan and os.path.isfile(path):
+                target = os.path.join(self.quarantine_root, label, os.path.relpath(path, root))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+                logger.info(f"Órfão movido para a quarentena: {path}")
+            conn.commit()
+            return still_orphan
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    # --- fases ----------------------------------------------------------------
+
+    def _files_step(self, state):
+        current = state['current']
+        roots = self._roots()
+        batch = []
+        while current['root'] < len(roots) and len(batch) < self.batch_size:
+            label, root = roots[current['root']]
+            for position, entry in self._iter_files(root, current['position']):
+                batch.append((label, root, position, entry))
+                current['position'] = list(position)
+                if len(batch) >= self.batch_size:
+                    break
+            else:
+                current['root'] += 1
+                current['position'] = None
+        if not batch:
+            current['phase'] = 'rows'
+            return 0
+
+        now = time.time()
+        candidates = []
+        for label, root, position, entry in batch:
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            # Arquivos recentes podem pertencer a uma requisição ainda em andamento
+            if now - stat.st_mtime < self.grace_period:
+                continue
+            candidates.append((label, root, entry.path, stat.st_size, len(position) == 1 and not label))
+        current['counters']['scanned_files'] += len(batch)
+        if not candidates:
+            return len(batch)
+
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                paths = [candidate[2] for candidate in candidates]
+                tracked = _tracked_paths(cursor, paths)
+                blobs = self._known_blobs(cursor, [os.path.basename(path) for path in paths if self._is_blob(path)])
+            finally:
+                cursor.close()
+                # Encerra a leitura para a quarentena enxergar os commits feitos desde então
+                conn.rollback()
+
+            counters = current['counters']
+            for label, root, path, size, at_root in candidates:
+                if path in tracked or (self._is_blob(path) and os.path.basename(path) in blobs):
+                    continue
+                counters['orphans'] += 1
+                counters['orphan_bytes'] += size
+                if len(current['orphans']) < SAMPLE_LIMIT:
+                    current['orphans'].append(path)
+                if at_root:
+                    # Na raiz ficam uploads genéricos do layout plano, que nunca tiveram registro
+                    counters['legacy_orphans'] += 1
+                    continue
+                if self.mode == 'quarantine' and self._quarantine(conn, label, root, path):
+                    counters['quarantined'] += 1
+        return len(batch)
+
+    def _rows_step(self, state):
+        current = state['current']
+        row_cursor = current['row_cursor']
+        tables = [(table, column) for table, column in URL_COLUMNS] + [('blobs', 'sha256')]
+        pending = [(table, column) for table, column in tables if row_cursor.get(table) != 'done']
+        if not pending:
+            current['phase'] = 'done'
+            return 0
+        table, column = pending[0]
+        key = 'sha256' if table == 'blobs' else 'id'
+        after = row_cursor.get(table, '' if table == 'blobs' else 0)
+
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    f"SELECT {key} AS row_key, {column} AS url FROM {table} "
+                    f"WHERE {key} > %s ORDER BY {key} LIMIT %s",
+                    (after, self.batch_size)
+                )
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        counters = current['counters']
+        for row in rows:
+            if table == 'blobs':
+                path = blob_store.blob_path(row['url'])
+            else:
+                path = row['url']
+                # URLs externas ou fora das pastas de upload não são verificáveis aqui
+                if not storage_layout.is_managed(path):
+                    continue
+            if not os.path.isfile(path):
+                counters['dangling_blobs' if table == 'blobs' else 'dangling_rows'] += 1
+                if len(current['dangling']) < SAMPLE_LIMIT:
+                    current['dangling'].append({'table': table, 'key': row['row_key'], 'url': path})
+        counters['scanned_rows'] += len(rows)
+        row_cursor[table] = rows[-1]['row_key'] if len(rows) == self.batch_size else 'done'
+        return len(rows)
+
+    def _refcount_mismatches(self):
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT b.sha256, b.ref_count, COUNT(a.id) AS actual FROM blobs b "
+                    "LEFT JOIN arquivos a ON a.sha256 = b.sha256 "
+                    "GROUP BY b.sha256, b.ref_count HAVING b.ref_count <> COUNT(a.id) LIMIT %s",
+                    (SAMPLE_LIMIT,)
+                )
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    def _finish_pass(self, state):
+        current = state['current']
+        # Limpa também sobras de uploads em partes e temporários de blobs
+        chunked_upload.purge_expired()
+        tmp_dir = os.path.join(Config.BLOB_FOLDER, '.tmp')
+        removed_tmp = 0
+        if os.path.isdir(tmp_dir):
+            cutoff = time.time() - max(self.grace_period, Config.UPLOAD_SESSION_TTL)
+            for entry in os.scandir(tmp_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    blob_store.discard_temp(entry.path)
+                    removed_tmp += 1
+        report = {
+            'mode': self.mode,
+            'started_at': current['started_at'],
+            'finished_at': time.time(),
+            **current['counters'],
+            'removed_temp_files': removed_tmp,
+            'orphan_samples': current['orphans'],
+            'dangling_samples': current['dangling'],
+            'refcount_mismatches': self._refcount_mismatches(),
+        }
+        state['last_report'] = report
+        state['current'] = None
+        logger.info(
+            f"Varredura concluída: {report['scanned_files']} arquivos, {report['orphans']} órfãos "
+            f"({report['quarantined']} em quarentena), {report['dangling_rows']} registros e "
+            f"{report['dangling_blobs']} blobs sem arquivo, {len(report['refcount_mismatches'])} contagens divergentes."
+        )
+        return report
+
+    def step(self):
+        """Executa um passo da varredura. Retorna True quando a varredura completa terminou.
+
+        Retorna None se outro processo já estiver varrendo.
+        """
+        started = time.monotonic()
+        with open(self.lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            state = self.load_state()
+            if state.get('current') is None:
+                state['current'] = self._new_pass()
+            examined = 0
+            if state['current']['phase'] == 'files':
+                examined = self._files_step(state)
+            elif state['current']['phase'] == 'rows':
+                examined = self._rows_step(state)
+            finished = state['current']['phase'] == 'done'
+            if finished:
+                self._finish_pass(state)
+            self._save_state(state)
+        if not finished and self.io_rate > 0:
+            # Limita a taxa de arquivos/linhas examinados para não disputar I/O com a API
+            time.sleep(max(0.0, examined / self.io_rate - (time.monotonic() - started)))
+        return finished
+
+    def run_pass(self, stop_event=None):
+        """Executa passos até concluir a varredura em andamento. Retorna o relatório.
+
+        Retorna None se outro processo estiver varrendo ou se `stop_event` for acionado.
+        """
+        while stop_event is None or not stop_event.is_set():
+            finished = self.step()
+            if finished is None:
+                return None
+            if finished:
+                return self.load_state()['last_report']
+        return None
+
+    def report(self):
+        state = self.load_state()
+        current = state.get('current')
+        return {
+            'last_report': state.get('last_report'),
+            'in_progress': None if current is None else {
+                'phase': current['phase'],
+                'started_at': current['started_at'],
+                **current['counters'],
+            },
+        }
+
+
+def is_tracked(path):
+    """Indica se algum registro aponta para `path` (usado antes de excluir um upload avulso)."""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            return bool(_tracked_paths(cursor, [path]))
+        finally:
+            cursor.close()
+
+def _build_scanner(mode=None, batch_size=None):
+    return StorageScanner(
+        mode=mode or Config.GC_MODE,
+        batch_size=batch_size or Config.GC_BATCH_SIZE,
+        io_rate=Config.GC_IO_RATE,
+        grace_period=Config.GC_GRACE_PERIOD,
+    )
+
+def _gc_loop(stop_event):
+    scanner = _build_scanner()
+    while not stop_event.is_set():
+        try:
+            scanner.run_pass(stop_event)
+        except Exception as e:
+            logger.error(f"Erro na varredura de arquivos órfãos: {e}", exc_info=True)
+        stop_event.wait(Config.GC_INTERVAL)
+
+def init_app(app):
+    """Inicia a varredura periódica em segundo plano (GC_ENABLED).
+
+    Com vários workers, o lock em UPLOAD_FOLDER/.gc garante um só varrendo por vez.
+    """
+    if not Config.GC_ENABLED:
+        return
+    threading.Thread(target=_gc_loop, args=(threading.Event(),), name='storage-gc', daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procura arquivos órfãos e registros sem arquivo.")
+    parser.add_argument('--mode', choices=('report', 'quarantine'), default=None,
+                        help="report só relata; quarantine move os órfãos para UPLOAD_FOLDER/.quarantine.")
+    parser.add_argument('--batch-size', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from logger import app_logger  # Configura os handlers de log
+    report = _build_scanner(args.mode, args.batch_size).run_pass()
+    if report is None:
+        print("Outra varredura está em andamento.", file=sys.stderr)
+        return 1
+    print(json.dumps(report, indent=2, default=str))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+from config import Config
+import metrics
+
+# Subpastas de UPLOAD_FOLDER por tipo de conteúdo (os blobs de arquivos ficam em BLOB_FOLDER)
+NAMESPACES = ('logos', 'images', 'generic')
+
+
+class FlatLayout:
+    """Layout original: todos os arquivos direto na raiz de UPLOAD_FOLDER."""
+
+    name = 'flat'
+
+    def relative_path(self, namespace, filename, key=None):
+        return filename
+
+
+class HashedLayout:
+    """Subpasta do namespace mais `depth` níveis de `width` caracteres hexadecimais.
+
+    A chave padrão é o SHA-1 do nome do arquivo, usado só para espalhar os
+    arquivos entre os diretórios; o armazenamento por conteúdo passa o
+    próprio SHA-256 como chave.
+    """
+
+    name = 'hashed'
+
+    def __init__(self, depth=2, width=2):
+        self.depth = depth
+        self.width = width
+
+    def fanout(self, key):
+        return [key[level * self.width:(level + 1) * self.width] for level in range(self.depth)]
+
+    def relative_path(self, namespace, filename, key=None):
+        if key is None:
+            key = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(namespace, *self.fanout(key), filename)
+
+
+LAYOUTS = {'flat': FlatLayout, 'hashed': HashedLayout}
+
+def build_layout(name, depth=2, width=2):
+    if name not in LAYOUTS:
+        raise ValueError(f"Layout de armazenamento desconhecido: '{name}'. Use {', '.join(sorted(LAYOUTS))}.")
+    if name == 'hashed':
+        return HashedLayout(depth, width)
+    return LAYOUTS[name]()
+
+
+layout = build_layout(Config.STORAGE_LAYOUT, Config.STORAGE_FANOUT_DEPTH, Config.STORAGE_FANOUT_WIDTH)
+
+# Blobs usam sempre a mesma distribuição: mudá-la alteraria endereços já gravados
+CONTENT_LAYOUT = HashedLayout(depth=2, width=2)
+
+
+def storage_path(namespace, filename, target=None):
+    """Caminho absoluto de `filename` no namespace, segundo o layout configurado (ou `target`)."""
+    return os.path.join(Config.UPLOAD_FOLDER, (target or layout).relative_path(namespace, filename))
+
+def content_path(sha256):
+    """Caminho do blob de conteúdo `sha256` em BLOB_FOLDER (ab/cd/abcd...)."""
+    return os.path.join(Config.BLOB_FOLDER, *CONTENT_LAYOUT.fanout(sha256), sha256)
+
+def legacy_path(filename):
+    """Onde o arquivo estaria no layout plano anterior."""
+    return os.path.join(Config.UPLOAD_FOLDER, filename)
+
+def save_upload(file_storage, path):
+    """Salva um upload do Flask em `path`, criando os diretórios intermediários."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    file_storage.save(path)
+    metrics.UPLOAD_BYTES.inc(os.path.getsize(path), kind=namespace_of(path))
+    return path
+
+def namespace_of(path):
+    """Namespace de um caminho em UPLOAD_FOLDER ('logos', 'images', 'generic'), ou 'legacy'."""
+    relative = os.path.relpath(path, Config.UPLOAD_FOLDER).split(os.sep)
+    return relative[0] if len(relative) > 1 and relative[0] in NAMESPACES else 'legacy'
+
+def is_managed(path):
+    """Indica se `path` está dentro das pastas de upload (URLs externas e caminhos arbitrários não)."""
+    if not path:
+        return False
+    path = os.path.abspath(path)
+    return any(path.startswith(os.path.join(root, '')) for root in (Config.UPLOAD_FOLDER, Config.BLOB_FOLDER))
+
+def remove_stored(path):
+    """Remove um logo/imagem/upload cujo registro foi excluído. Retorna True se removeu.
+
+    Ignora caminhos fora das pastas de upload (as URLs podem ser definidas
+    livremente via PUT) e blobs, que só saem pela contagem de referências.
+    """
+    if not is_managed(path) or os.path.abspath(path).startswith(os.path.join(Config.BLOB_FOLDER, '')):
+        return False
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
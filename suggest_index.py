@@ -0,0 +1,258 @@
+import bisect
+import heapq
+import logging
+import math
+import threading
+import time
+import unicodedata
+
+from config import Config
+from database import pooled_connection
+
+logger = logging.getLogger('api_jatoba.suggest')
+
+KIND_MANUFACTURER = 'manufacturer'
+KIND_EQUIPMENT = 'equipment'
+
+
+def normalize(text):
+    """Remove acentos, pontuação e espaços: "Q-9000" e "q 9000" viram "q9000"."""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(ch for ch in decomposed if ch.isalnum()).lower()
+
+def trigrams(normalized):
+    """Trigramas com preenchimento no início, para favorecer prefixos."""
+    padded = '$$' + normalized
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Índice em memória de trigramas e prefixos para sugestões tolerantes a erros.
+
+    Cada entrada (tipo, id) tem um ou mais termos (nome, modelo). Consultas
+    curtas usam busca binária sobre os termos ordenados; as demais são
+    ranqueadas pela similaridade de Jaccard entre trigramas, com bônus para
+    prefixo e substring.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._terms = {}  # term_id -> (chave, texto normalizado, trigramas)
+        self._postings = {}  # trigrama -> set(term_id)
+        self._sorted = []  # [(texto normalizado, term_id)] para busca por prefixo
+        self._entries = {}  # chave -> (payload, [term_id])
+        self._next_term_id = 0
+        self._journal = None  # alterações recebidas durante uma reconstrução
+        self.ready = False
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add_term(self, key, text):
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        term_id = self._next_term_id
+        self._next_term_id += 1
+        grams = trigrams(normalized)
+        self._terms[term_id] = (key, normalized, grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(term_id)
+        bisect.insort(self._sorted, (normalized, term_id))
+        return term_id
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for term_id in entry[1]:
+            _, normalized, grams = self._terms.pop(term_id)
+            for gram in grams:
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard(term_id)
+                    if not posting:
+                        del self._postings[gram]
+            position = bisect.bisect_left(self._sorted, (normalized, term_id))
+            if position < len(self._sorted) and self._sorted[position] == (normalized, term_id):
+                del self._sorted[position]
+
+    def upsert(self, kind, entry_id, payload, texts):
+        """Insere ou substitui uma entrada; `texts` são os campos pesquisáveis."""
+        key = (kind, entry_id)
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(('upsert', (kind, entry_id, payload, texts)))
+            self._remove_locked(key)
+            term_ids = [term_id for term_id in (self._add_term(key, text) for text in texts) if term_id is not None]
+            self._entries[key] = (payload, term_ids)
+
+    def remove(self, kind, entry_id):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(('remove', (kind, entry_id)))
+            self._remove_locked((kind, entry_id))
+
+    def _prefix_matches(self, query):
+        scores = {}
+        position = bisect.bisect_left(self._sorted, (query, -1))
+        # Limita a varredura: prefixos de 1-2 caracteres podem casar com boa parte do índice
+        end = min(position + Config.SUGGEST_PREFIX_SCAN_LIMIT, len(self._sorted))
+        while position < end:
+            normalized, term_id = self._sorted[position]
+            if not normalized.startswith(query):
+                break
+            key = self._terms[term_id][0]
+            # Termos mais curtos estão mais próximos da consulta
+            score = 1.0 + len(query) / len(normalized)
+            if score > scores.get(key, 0.0):
+                scores[key] = score
+            position += 1
+        return scores
+
+    def _trigram_matches(self, query):
+        query_grams = trigrams(query)
+        min_overlap = max(1, math.ceil(len(query_grams) * Config.SUGGEST_MIN_SIMILARITY))
+        # Um termo com pelo menos `min_overlap` trigramas em comum aparece obrigatoriamente
+        # em uma das (n - min_overlap + 1) listas mais curtas; as listas longas
+        # (trigramas comuns, como o do primeiro caractere) não precisam ser percorridas.
+        postings = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+        candidates = set()
+        for posting in postings[:len(query_grams) - min_overlap + 1]:
+            candidates.update(posting)
+        scores = {}
+        for term_id in candidates:
+            key, normalized, grams = self._terms[term_id]
+            overlap = len(query_grams & grams)
+            if overlap < min_overlap:
+                continue
+            score = overlap / (len(query_grams) + len(grams) - overlap)
+            if normalized.startswith(query):
+                score += 1.0
+            elif query in normalized:
+                score += 0.5
+            if score > scores.get(key, 0.0):
+                scores[key] = score
+        return scores
+
+    def suggest(self, query, limit=10, kind=None):
+        """Retorna até `limit` entradas ordenadas por relevância para `query`."""
+        normalized = normalize(query)
+        if not normalized:
+            return []
+        with self._lock:
+            if len(normalized) < 3:
+                scores = self._prefix_matches(normalized)
+            else:
+                scores = self._trigram_matches(normalized)
+            if kind is not None:
+                scores = {key: score for key, score in scores.items() if key[0] == kind}
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0][1]))
+            return [dict(self._entries[key][0], score=round(score, 4)) for key, score in best]
+
+    def begin_rebuild(self):
+        """Passa a registrar as alterações para reaplicá-las sobre o índice reconstruído."""
+        with self._lock:
+            self._journal = []
+
+    def abort_rebuild(self):
+        with self._lock:
+            self._journal = None
+
+    def replace_with(self, other):
+        """Troca o conteúdo deste índice pelo de outro recém-construído.
+
+        As alterações registradas desde `begin_rebuild` são reaplicadas, para
+        que escritas concorrentes à leitura das tabelas não se percam.
+        """
+        with self._lock, other._lock:
+            for operation, args in self._journal or ():
+                getattr(other, operation)(*args)
+            self._journal = None
+            self._terms = other._terms
+            self._postings = other._postings
+            self._sorted = other._sorted
+            self._entries = other._entries
+            self._next_term_id = other._next_term_id
+            self.ready = True
+            self.built_at = time.time()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'entries': len(self._entries),
+                'terms': len(self._terms),
+                'trigrams': len(self._postings),
+                'built_at': self.built_at,
+            }
+
+
+index = TrigramIndex()
+
+
+def index_manufacturer(manufacturer_id, name, target=None):
+    target = index if target is None else target
+    target.upsert(KIND_MANUFACTURER, manufacturer_id,
+                  {'kind': KIND_MANUFACTURER, 'id': manufacturer_id, 'name': name}, [name])
+
+def index_equipment(equipment_id, name, model, manufacturer_id=None, target=None):
+    target = index if target is None else target
+    target.upsert(KIND_EQUIPMENT, equipment_id,
+                  {'kind': KIND_EQUIPMENT, 'id': equipment_id, 'name': name, 'model': model,
+                   'manufacturer_id': manufacturer_id},
+                  [name, model])
+
+def remove_manufacturer(manufacturer_id):
+    index.remove(KIND_MANUFACTURER, manufacturer_id)
+
+def remove_equipment(equipment_id):
+    index.remove(KIND_EQUIPMENT, equipment_id)
+
+def rebuild():
+    """Reconstrói o índice a partir das tabelas fabricantes e equipamentos."""
+    started = time.monotonic()
+    fresh = TrigramIndex()
+    index.begin_rebuild()
+    try:
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT id, name FROM fabricantes")
+                for row in cursor.fetchall():
+                    index_manufacturer(row['id'], row['name'], target=fresh)
+                cursor.execute("SELECT id, name, model, manufacturer_id FROM equipamentos")
+                for row in cursor.fetchall():
+                    index_equipment(row['id'], row['name'], row['model'], row['manufacturer_id'], target=fresh)
+            finally:
+                cursor.close()
+    except Exception:
+        index.abort_rebuild()
+        raise
+    index.replace_with(fresh)
+    logger.info(f"Índice de sugestões construído com {len(fresh)} entradas em {time.monotonic() - started:.2f}s.")
+
+def _refresh_loop():
+    interval = Config.SUGGEST_REFRESH_INTERVAL
+    while True:
+        try:
+            rebuild()
+        except Exception as e:
+            logger.error(f"Erro ao construir o índice de sugestões: {e}", exc_info=True)
+        if interval <= 0 and index.ready:
+            return
+        # Sem reconstrução periódica, só tenta de novo enquanto a primeira carga não tiver sucesso
+        time.sleep(interval if interval > 0 else 30)
+
+def init_app(app):
+    """Constrói o índice em segundo plano, sem atrasar a inicialização da API.
+
+    A reconstrução periódica (SUGGEST_REFRESH_INTERVAL) faz os demais
+    processos workers convergirem para as alterações feitas em outro processo.
+    """
+    if not Config.SUGGEST_ENABLED:
+        return
+    threading.Thread(target=_refresh_loop, name='suggest-index', daemon=True).start()